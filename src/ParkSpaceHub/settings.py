@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 import os
+import sys
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -37,9 +38,13 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "core",
 ]
 
 MIDDLEWARE = [
+    "core.middleware.PerformanceMiddleware",
+    "core.middleware.MetricsMiddleware",
+    "core.middleware.QueryDetectorMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -82,6 +87,9 @@ DATABASES = {
     }
 }
 
+# core's tables are managed by SQLAlchemy/Alembic, core/migrations is not a Django migrations package
+MIGRATION_MODULES = {"core": None}
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -131,3 +139,90 @@ STATICFILES_DIRS = [
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+# Request profiling (core.middleware.PerformanceMiddleware). Send `X-Profile: <PERF_PROFILE_TOKEN>`
+# to profile one request, or set a sample rate between 0 and 1.
+PERF_PROFILE_SAMPLE_RATE = 0.0
+PERF_PROFILE_TOKEN = os.environ.get('PERF_PROFILE_TOKEN')
+PERF_PROFILER = 'cprofile'  # or 'pyinstrument' when installed
+PERF_PROFILE_DIR = os.path.join(BASE_DIR, 'cache', 'profiles')
+
+# /metrics: every worker snapshots its counters into METRICS_DIR and a scrape merges them all.
+# Set to None for single-process use. With METRICS_TOKEN set, scrapes need `Authorization: Bearer <token>`.
+METRICS_DIR = os.path.join(BASE_DIR, 'cache', 'metrics')
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+# N+1 / slow-query detector (core/query_detector.py): 'warn' logs, 'raise' fails the request, 'off' disables.
+# Defaults to 'raise' under `manage.py test` and 'warn' otherwise; the QUERY_DETECTOR_MODE env var overrides it.
+QUERY_DETECTOR_MODE = os.environ.get('QUERY_DETECTOR_MODE') or ('raise' if sys.argv[1:2] == ['test'] else 'warn')
+QUERY_DETECTOR_REPEAT_THRESHOLD = 5
+QUERY_DETECTOR_SLOW_MS = 200
+
+# availability_hours are local to the spots; open_at/open_now search filters are evaluated in this zone
+SPOT_HOURS_TIME_ZONE = 'Asia/Kolkata'
+
+# Largest k accepted by /api/parking-spots/nearest/
+NEAREST_MAX_K = 100
+
+# Typeahead /api/parking-spots/search/: 'postgres' (pg_trgm), 'memory' (core/spot_text.py) or 'auto' by database
+SPOT_TEXT_SEARCH_BACKEND = 'auto'
+SPOT_TEXT_SEARCH_MAX_LIMIT = 20
+# With lat/lng a spot this far away ranks at half the score of one right there
+SPOT_TEXT_SEARCH_DISTANCE_SCALE_KM = 10.0
+
+# Memory-mapped spot catalog snapshots shared by all workers (core/spot_catalog.py)
+SPOT_CATALOG_DIR = os.path.join(BASE_DIR, 'cache', 'spot_catalog')
+
+# Encoded search results kept per worker (core/spot_json.py), one entry per spot/owner version
+SPOT_JSON_CACHE_SIZE = 10_000
+
+# Spots per page of /api/parking-spots/changes/ delta sync
+SPOT_CHANGES_PAGE_SIZE = 500
+
+# Admission control for expensive endpoint classes (core/admission.py): requests in flight across
+# all workers (503 beyond it) and a token bucket per client, `rate` per second up to `burst` (429
+# when empty). Leave a class out, or set ADMISSION_CLASSES = {}, to disable it.
+ADMISSION_CLASSES = {
+    'search': {'concurrency': 32, 'rate': 10, 'burst': 30},
+    'auth': {'concurrency': 8, 'rate': 0.5, 'burst': 5},  # password hashing is CPU-bound
+    'dashboard': {'concurrency': 4, 'rate': 2, 'burst': 10},
+}
+ADMISSION_DIR = os.path.join(BASE_DIR, 'cache', 'admission')
+# Key clients by the first X-Forwarded-For address (only behind a proxy that sets it)
+ADMISSION_TRUST_X_FORWARDED_FOR = False
+
+# Background job workers (`manage.py run_jobs`, core/jobs.py): threads per worker, queue poll
+# interval when idle, and how long a job may go without a heartbeat before another worker retakes it
+JOB_WORKER_CONCURRENCY = 4
+JOB_POLL_SECONDS = 1.0
+JOB_LOCK_TIMEOUT_SECONDS = 300
+
+# Pickled snapshots of the parsed merch dashboard CSVs (see core/merch_cache.py)
+MERCH_CACHE_DIR = os.path.join(BASE_DIR, 'cache', 'merch')
+
+# 'memory' loads each merch CSV at once, 'chunked' folds it in MERCH_CSV_CHUNKSIZE-row chunks
+MERCH_AGGREGATION_MODE = 'memory'
+MERCH_CSV_CHUNKSIZE = 100_000
+
+# Glob patterns per merch source replacing the default CSV, e.g. {'sales': [os.path.join(BASE_DIR, 'sales', '*.csv')]}.
+# Every matched file is aggregated as a separate task. Requests spread them over MERCH_MAX_WORKERS
+# threads (1 aggregates serially); `manage.py merch_metrics`/`merch_ingest` and the background merch
+# jobs use a pool of MERCH_OFFLINE_MAX_WORKERS processes, which is too costly to start mid-request.
+MERCH_CSV_SOURCES = {}
+MERCH_MAX_WORKERS = 1
+MERCH_PARALLEL_BACKEND = 'thread'  # or 'process'
+MERCH_OFFLINE_MAX_WORKERS = min(4, os.cpu_count() or 1)
+
+# 'csv' recomputes the dashboard from the files above, 'store' reads the MerchMetric totals
+MERCH_DASHBOARD_SOURCE = 'csv'
+
+# Rows per dashboard/API page and the most points any dashboard chart series may have
+MERCH_PAGE_SIZE = 50
+MERCH_API_MAX_PAGE_SIZE = 500
+MERCH_CHART_MAX_POINTS = 100
+
+# Pre-compressed copies of downloadable files (regenerated when the source changes)
+DOWNLOAD_CACHE_DIR = os.path.join(BASE_DIR, 'cache', 'download')
+
+# Largest merch dataset JSON accepted by the dashboard upload
+MERCH_UPLOAD_MAX_BYTES = 512 * 1024 * 1024
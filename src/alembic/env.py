@@ -5,7 +5,7 @@ from alembic import context
 
 # ✅ Apne Base aur engine ko import kar:
 from core.sqlalchemy_engine import Base
-from core.models import User, ParkingSpot , UserRole # Important: ye ensure karega ke models load ho
+from core.models import User, ParkingSpot , ParkingSpotHours, UserRole, Reservation, MerchMetric, MerchBatch, ChangeCounter, Job # Important: ye ensure karega ke models load ho
 
 # Alembic Config
 config = context.config
@@ -0,0 +1,61 @@
+"""Add change sequences
+
+Revision ID: 2f8d6b0e4c17
+Revises: 9e4b7a1c3d58
+Create Date: 2026-10-20 10:12:36.284519
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '2f8d6b0e4c17'
+down_revision: Union[str, None] = '9e4b7a1c3d58'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Same as SEQUENCES in core/models/change_counter.py: counter -> (sequence, table, column it numbers)
+COUNTERS = {
+    'parking_spots': ('parking_spots_change_seq', 'parking_spots', 'change_seq'),
+    'parking_spots.id': ('parking_spots_global_id_seq', 'parking_spots', 'id'),
+    'reservations.id': ('reservations_global_id_seq', 'reservations', 'id'),
+}
+
+
+def _start(name, table, column):
+    """SQL for the last number counter `name` handed out"""
+    greatest = 'MAX' if op.get_bind().dialect.name == 'sqlite' else 'GREATEST'
+    return (
+        f"{greatest}(COALESCE((SELECT value FROM change_counters WHERE name = '{name}'), 0), "
+        f"COALESCE((SELECT MAX({column}) FROM {table}), 0))"
+    )
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name == 'postgresql':
+        # Counters become sequences, continuing from their row (or the data, if the row was never created)
+        for name, (sequence, table, column) in COUNTERS.items():
+            op.execute(sa.schema.CreateSequence(sa.Sequence(sequence)))
+            start = _start(name, table, column)
+            op.execute(f"SELECT setval('{sequence}', GREATEST({start}, 1), {start} > 0)")
+    else:
+        # The row counters stay; create the missing rows so allocating never has to
+        for name, (_, table, column) in COUNTERS.items():
+            op.execute(
+                f"INSERT INTO change_counters (name, value) SELECT '{name}', {_start(name, table, column)} "
+                f"WHERE NOT EXISTS (SELECT 1 FROM change_counters WHERE name = '{name}')"
+            )
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == 'postgresql':
+        for name, (sequence, _, _) in COUNTERS.items():
+            op.execute(
+                f"INSERT INTO change_counters (name, value) "
+                f"SELECT '{name}', CASE WHEN is_called THEN last_value ELSE last_value - 1 END FROM {sequence} "
+                f"ON CONFLICT (name) DO UPDATE SET value = EXCLUDED.value"
+            )
+            op.execute(sa.schema.DropSequence(sa.Sequence(sequence)))
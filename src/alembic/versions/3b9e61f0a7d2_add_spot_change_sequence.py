@@ -0,0 +1,41 @@
+"""Add spot change sequence
+
+Revision ID: 3b9e61f0a7d2
+Revises: d7c5a04b2e6f
+Create Date: 2026-10-19 18:21:47.603118
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3b9e61f0a7d2'
+down_revision: Union[str, None] = 'd7c5a04b2e6f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('change_counters',
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('value', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    op.add_column('parking_spots', sa.Column('change_seq', sa.BigInteger(), server_default='0', nullable=False))
+
+    # Existing spots enter the change log in id order
+    op.execute('UPDATE parking_spots SET change_seq = id')
+    op.execute(
+        "INSERT INTO change_counters (name, value) "
+        "SELECT 'parking_spots', COALESCE(MAX(id), 0) FROM parking_spots"
+    )
+    op.create_index('ix_parking_spots_change_seq', 'parking_spots', ['change_seq'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_parking_spots_change_seq', table_name='parking_spots')
+    op.drop_column('parking_spots', 'change_seq')
+    op.drop_table('change_counters')
@@ -0,0 +1,42 @@
+"""Add parking spot hours
+
+Revision ID: 5e2b8c913f07
+Revises: c41d7e2a9b58
+Create Date: 2026-10-19 15:21:47.118305
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from core import opening_hours
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5e2b8c913f07'
+down_revision: Union[str, None] = 'c41d7e2a9b58'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    hours = op.create_table('parking_spot_hours',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('spot_id', sa.Integer(), nullable=False),
+    sa.Column('opens_at', sa.Integer(), nullable=False),
+    sa.Column('closes_at', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_parking_spot_hours_spot', 'parking_spot_hours', ['spot_id', 'opens_at', 'closes_at'], unique=False)
+    op.create_index('ix_parking_spot_hours_window', 'parking_spot_hours', ['opens_at', 'closes_at', 'spot_id'], unique=False)
+
+    # Backfill existing spots from their free-form availability_hours
+    spots = sa.table('parking_spots', sa.column('id', sa.Integer), sa.column('availability_hours', sa.String))
+    opening_hours.backfill(op.get_bind(), spots, hours)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_parking_spot_hours_window', table_name='parking_spot_hours')
+    op.drop_index('ix_parking_spot_hours_spot', table_name='parking_spot_hours')
+    op.drop_table('parking_spot_hours')
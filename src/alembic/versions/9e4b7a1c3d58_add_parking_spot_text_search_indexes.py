@@ -0,0 +1,39 @@
+"""Add parking spot text search indexes
+
+Revision ID: 9e4b7a1c3d58
+Revises: 6c1f8e2d4a90
+Create Date: 2026-10-19 22:37:45.102934
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9e4b7a1c3d58'
+down_revision: Union[str, None] = '6c1f8e2d4a90'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Elsewhere typeahead search runs on the in-memory index (core/spot_text.py); nothing to create
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        # Same expressions as NAME_TEXT_SQL / DESCRIPTION_TEXT_SQL in core/models/parking_spot.py
+        op.execute(
+            "CREATE INDEX ix_parking_spots_name_trgm ON parking_spots "
+            "USING gin ((lower(coalesce(title, '') || ' ' || coalesce(location, ''))) gin_trgm_ops)"
+        )
+        op.execute(
+            "CREATE INDEX ix_parking_spots_description_trgm ON parking_spots "
+            "USING gin ((lower(coalesce(description, ''))) gin_trgm_ops)"
+        )
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('DROP INDEX IF EXISTS ix_parking_spots_description_trgm')
+        op.execute('DROP INDEX IF EXISTS ix_parking_spots_name_trgm')
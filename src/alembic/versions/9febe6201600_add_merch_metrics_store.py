@@ -0,0 +1,50 @@
+"""Add merch metrics store
+
+Revision ID: 9febe6201600
+Revises: 9a6b773e913e
+Create Date: 2026-10-19 10:12:44.318201
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9febe6201600'
+down_revision: Union[str, None] = '9a6b773e913e'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('merch_metrics',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('asin', sa.String(length=32), nullable=False),
+    sa.Column('product_name', sa.String(length=255), nullable=True),
+    sa.Column('has_sales', sa.Boolean(), nullable=False),
+    sa.Column('gmv_sum', sa.Float(), nullable=False),
+    sa.Column('units_sum', sa.BigInteger(), nullable=False),
+    sa.Column('refunds_sum', sa.BigInteger(), nullable=False),
+    sa.Column('rating_sum', sa.Float(), nullable=False),
+    sa.Column('rating_count', sa.BigInteger(), nullable=False),
+    sa.Column('returns_sum', sa.Float(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('asin')
+    )
+    op.create_table('merch_batches',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('batch_id', sa.String(length=255), nullable=False),
+    sa.Column('product_count', sa.Integer(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('batch_id')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('merch_batches')
+    op.drop_table('merch_metrics')
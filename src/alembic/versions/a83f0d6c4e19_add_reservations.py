@@ -0,0 +1,52 @@
+"""Add reservations
+
+Revision ID: a83f0d6c4e19
+Revises: 5e2b8c913f07
+Create Date: 2026-10-19 16:40:03.552870
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a83f0d6c4e19'
+down_revision: Union[str, None] = '5e2b8c913f07'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('reservations',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('spot_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('starts_at', sa.DateTime(), nullable=False),
+    sa.Column('ends_at', sa.DateTime(), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.CheckConstraint('ends_at > starts_at', name='ck_reservations_positive_duration'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_reservations_spot_start', 'reservations', ['spot_id', 'status', 'starts_at', 'ends_at'], unique=False)
+    op.create_index('ix_reservations_user', 'reservations', ['user_id', 'starts_at'], unique=False)
+
+    if op.get_bind().dialect.name == 'postgresql':
+        # Database-level guarantee that confirmed slots of a spot never overlap
+        op.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+        op.execute(
+            "ALTER TABLE reservations ADD CONSTRAINT reservations_no_overlap "
+            "EXCLUDE USING gist (spot_id WITH =, tsrange(starts_at, ends_at) WITH &&) "
+            "WHERE (status = 'confirmed')"
+        )
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('ALTER TABLE reservations DROP CONSTRAINT IF EXISTS reservations_no_overlap')
+    op.drop_index('ix_reservations_user', table_name='reservations')
+    op.drop_index('ix_reservations_spot_start', table_name='reservations')
+    op.drop_table('reservations')
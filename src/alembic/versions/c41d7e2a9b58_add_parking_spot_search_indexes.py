@@ -0,0 +1,33 @@
+"""Add parking spot search indexes
+
+Revision ID: c41d7e2a9b58
+Revises: 9febe6201600
+Create Date: 2026-10-19 14:05:12.604117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c41d7e2a9b58'
+down_revision: Union[str, None] = '9febe6201600'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_parking_spots_search_geo', 'parking_spots',
+                    ['is_active', 'is_available', 'latitude', 'longitude'], unique=False)
+    op.create_index('ix_parking_spots_search_type', 'parking_spots',
+                    ['is_active', 'is_available', 'parking_type', 'price_per_hour'], unique=False)
+    op.create_index('ix_parking_spots_search_size', 'parking_spots',
+                    ['is_active', 'is_available', 'max_vehicle_size', 'price_per_hour'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_parking_spots_search_size', table_name='parking_spots')
+    op.drop_index('ix_parking_spots_search_type', table_name='parking_spots')
+    op.drop_index('ix_parking_spots_search_geo', table_name='parking_spots')
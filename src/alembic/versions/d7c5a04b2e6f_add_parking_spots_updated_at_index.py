@@ -0,0 +1,26 @@
+"""Add parking spots updated_at index
+
+Revision ID: d7c5a04b2e6f
+Revises: a83f0d6c4e19
+Create Date: 2026-10-19 17:32:26.019442
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd7c5a04b2e6f'
+down_revision: Union[str, None] = 'a83f0d6c4e19'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_parking_spots_updated_at', 'parking_spots', ['updated_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_parking_spots_updated_at', table_name='parking_spots')
@@ -0,0 +1,232 @@
+"""
+Admission control for expensive endpoints, shared by every worker process.
+
+Views are grouped into endpoint classes (search, auth, dashboard; see
+ADMISSION_CLASSES). Each class has:
+
+- a token bucket per client (`rate` requests per second, up to `burst` at
+  once). An empty bucket gets a 429 with Retry-After set to when the next
+  token arrives.
+- a cap on requests of the class in flight across all workers
+  (`concurrency`). A full class gets a 503 with Retry-After.
+
+Rejections cost tens of microseconds and no database work, so cheap requests
+keep their workers and pool connections while a class is overloaded.
+
+State lives in one memory-mapped file per class under ADMISSION_DIR. Every
+worker maps the same pages. Buckets are spread over stripes, each guarded
+by an fcntl byte-range lock (plus a thread lock, as fcntl locks are per
+process). In-flight counts are kept per process id, so a worker that dies
+mid-request does not leak capacity: entries of dead pids are ignored. When
+the store cannot be used, requests are let through (fail open).
+"""
+import fcntl
+import hashlib
+import logging
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.http import JsonResponse
+
+from core import metrics
+from core.auth_utils import decode_jwt
+
+logger = logging.getLogger(__name__)
+
+PROC_SLOTS = 64                   # worker processes tracked per class
+PROC = struct.Struct('<qq')       # pid, requests in flight
+PROCS = struct.Struct('<' + 'qq' * PROC_SLOTS)
+STRIPES = 1024
+STRIPE_SLOTS = 16                 # buckets per stripe; the stalest one is recycled when full
+BUCKET = struct.Struct('<Qdd')    # client key hash, tokens, monotonic time of last update
+STRIPE = struct.Struct('<' + 'Qdd' * STRIPE_SLOTS)
+BUCKETS_OFFSET = PROCS.size
+STRIPE_SIZE = STRIPE.size
+FILE_SIZE = BUCKETS_OFFSET + STRIPES * STRIPE_SIZE
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class ClassLimiter:
+    """Token buckets and the in-flight count of one endpoint class"""
+
+    def __init__(self, path):
+        self.path = path
+        self._thread_lock = threading.Lock()
+        self._pid = None
+        self._fd = None
+        self._map = None
+
+    def _open(self):
+        # Mappings survive fork but thread locks held at the time may not; start fresh per process
+        if self._pid == os.getpid():
+            return
+        with _limiters_lock:
+            if self._pid == os.getpid():
+                return
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            if os.fstat(fd).st_size < FILE_SIZE:
+                os.ftruncate(fd, FILE_SIZE)  # new pages read as zeros: empty slots
+            self._fd, self._map = fd, mmap.mmap(fd, FILE_SIZE)
+            self._thread_lock = threading.Lock()
+            self._pid = os.getpid()
+
+    @contextmanager
+    def _locked(self, start, length):
+        with self._thread_lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, length, start)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, length, start)
+
+    def take(self, client, rate, burst):
+        """0 if `client` may proceed (a token is spent), else seconds until it may"""
+        self._open()
+        key = int.from_bytes(hashlib.blake2b(client.encode(), digest_size=8).digest(), 'little') or 1
+        base = BUCKETS_OFFSET + (key % STRIPES) * STRIPE_SIZE
+        with self._locked(base, STRIPE_SIZE):
+            now = time.monotonic()
+            stripe = STRIPE.unpack_from(self._map, base)
+            keys = stripe[0::3]
+            if key in keys:
+                i = keys.index(key)
+                tokens, updated = stripe[3 * i + 1], stripe[3 * i + 2]
+            else:
+                # New client, or its bucket was recycled: it starts full in an empty or the stalest slot
+                i = keys.index(0) if 0 in keys else min(range(STRIPE_SLOTS), key=lambda j: stripe[3 * j + 2])
+                tokens, updated = burst, now
+            slot = base + i * BUCKET.size
+            if updated > now:
+                tokens, updated = burst, now  # written before a reboot reset the monotonic clock
+            tokens = min(burst, tokens + (now - updated) * rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate
+            BUCKET.pack_into(self._map, slot, key, tokens, now)
+        return wait
+
+    def enter(self, limit):
+        """Count one more request in flight unless `limit` are already; returns whether it was"""
+        self._open()
+        pid = os.getpid()
+        with self._locked(0, BUCKETS_OFFSET):
+            procs = PROCS.unpack_from(self._map, 0)
+            total, own, free = 0, None, None
+            for i in range(PROC_SLOTS):
+                slot_pid, count = procs[2 * i], procs[2 * i + 1]
+                if slot_pid == pid:
+                    own = i
+                    total += count
+                elif count and _pid_alive(slot_pid):
+                    total += count
+                elif free is None:
+                    free = i
+            if total >= limit:
+                return False
+            if own is None:
+                if free is None:
+                    return True  # more workers than slots: not tracked
+                own = free
+            PROC.pack_into(self._map, own * PROC.size, pid, (procs[2 * own + 1] if procs[2 * own] == pid else 0) + 1)
+        return True
+
+    def leave(self):
+        pid = os.getpid()
+        with self._locked(0, BUCKETS_OFFSET):
+            procs = PROCS.unpack_from(self._map, 0)
+            for i in range(PROC_SLOTS):
+                if procs[2 * i] == pid:
+                    PROC.pack_into(self._map, i * PROC.size, pid, max(0, procs[2 * i + 1] - 1))
+                    return
+
+
+def limiter(endpoint_class):
+    with _limiters_lock:
+        if endpoint_class not in _limiters:
+            directory = getattr(settings, 'ADMISSION_DIR', os.path.join(settings.BASE_DIR, 'cache', 'admission'))
+            _limiters[endpoint_class] = ClassLimiter(os.path.join(directory, f'{endpoint_class}.bin'))
+        return _limiters[endpoint_class]
+
+
+def client_key(request):
+    """The signed-in user when the request carries a valid token, else the client address"""
+    auth = request.headers.get('Authorization', '')
+    if auth.startswith('Bearer '):
+        payload = decode_jwt(auth[len('Bearer '):])
+        if payload:
+            return f"user:{payload['user_id']}"
+    address = request.META.get('REMOTE_ADDR', '')
+    if getattr(settings, 'ADMISSION_TRUST_X_FORWARDED_FOR', False):
+        address = request.headers.get('X-Forwarded-For', address).split(',')[0].strip()
+    return f'ip:{address}'
+
+
+def _rejected(endpoint_class, reason, status, retry_after, message):
+    metrics.inc('admission_rejections_total', endpoint_class=endpoint_class, reason=reason)
+    response = JsonResponse({'error': message}, status=status)
+    response['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+def admit(endpoint_class):
+    """View decorator applying the ADMISSION_CLASSES limits of `endpoint_class`"""
+    def decorator(view_func):
+        @wraps(view_func)
+        def _wrapped_view(request, *args, **kwargs):
+            limits = getattr(settings, 'ADMISSION_CLASSES', {}).get(endpoint_class)
+            if not limits:
+                return view_func(request, *args, **kwargs)
+            try:
+                state = limiter(endpoint_class)
+                if limits.get('rate'):
+                    wait = state.take(client_key(request), limits['rate'], limits.get('burst', limits['rate']))
+                    if wait:
+                        return _rejected(endpoint_class, 'rate', 429, wait,
+                                         'Too many requests, slow down')
+                entered = False
+                if limits.get('concurrency'):
+                    if not state.enter(limits['concurrency']):
+                        return _rejected(endpoint_class, 'concurrency', 503,
+                                         limits.get('retry_after', 1), 'Server busy, try again shortly')
+                    entered = True
+            except OSError:
+                logger.exception('Admission store unavailable, letting %s requests through', endpoint_class)
+                return view_func(request, *args, **kwargs)
+
+            if not entered:
+                return view_func(request, *args, **kwargs)
+            with metrics.in_flight('admission_in_flight', endpoint_class=endpoint_class):
+                try:
+                    return view_func(request, *args, **kwargs)
+                finally:
+                    state.leave()
+        return _wrapped_view
+    return decorator
+
+
+metrics.describe('admission_rejections_total', 'counter',
+                 'Requests turned away by admission control, by endpoint class and reason (rate/concurrency)')
+metrics.describe('admission_in_flight', 'gauge', 'Admitted requests currently running, by endpoint class')
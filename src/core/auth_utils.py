@@ -4,6 +4,7 @@ from django.http import JsonResponse
 from django.conf import settings
 from functools import wraps
 from core.models.users import User
+from core.models.user_role import UserRole
 
 # Secret key for JWT
 SECRET_KEY = 'park-space-hub'
@@ -46,8 +47,10 @@ def jwt_required(allowed_roles=None):
                 return JsonResponse({'error': 'User not found'}, status=404)
 
             # Role Check
-            if allowed_roles and user.role.name not in allowed_roles:
-                return JsonResponse({'error': 'Access denied'}, status=403)
+            if allowed_roles:
+                role = UserRole.get_by_user_id(user.id)
+                if not role or role.name not in allowed_roles:
+                    return JsonResponse({'error': 'Access denied'}, status=403)
 
             request.user = user  # attach user to request
             return view_func(request, *args, **kwargs)
@@ -0,0 +1,193 @@
+"""
+End-to-end benchmarks that drive the real views in-process.
+
+Used by `manage.py bench`. A throwaway database (SQLite by default, or any
+SQLAlchemy URL such as a local Postgres) is seeded with synthetic users and
+parking spots (see core/seeding.py), the shared SQLAlchemy session is
+pointed at it, and each scenario is replayed through Django's test client so
+URL routing, middleware and JSON encoding are all measured.
+"""
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+from django.test import Client, override_settings
+from sqlalchemy import event
+
+from core import sqlalchemy_engine
+from core.models.users import User
+from core.seeding import SEED_PASSWORD, seed_database
+
+BENCH_CENTER = (22.5726, 88.3639)  # Kolkata, one of the seeded city clusters
+
+
+class QueryCounter:
+    """Counts statements executed on an engine"""
+
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self._on_execute)
+
+    def _on_execute(self, *args, **kwargs):
+        self.count += 1
+
+
+def peak_rss_kb():
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes on Linux
+    return usage // 1024 if sys.platform == 'darwin' else usage
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def run_scenario(name, make_request, counter, iterations, warmup):
+    """Run `make_request(i)` and summarize latency, throughput, queries and RSS"""
+    for i in range(warmup):
+        make_request(i)
+
+    latencies = []
+    statuses = {}
+    queries_before = counter.count
+    started = time.perf_counter()
+    for i in range(iterations):
+        t0 = time.perf_counter()
+        response = make_request(warmup + i)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        if getattr(response, 'streaming', False):
+            b''.join(response.streaming_content)
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'scenario': name,
+        'iterations': iterations,
+        'throughput_rps': round(iterations / elapsed, 2) if elapsed else None,
+        'latency_ms': {
+            'mean': round(sum(latencies) / len(latencies), 3),
+            'p50': round(percentile(latencies, 50), 3),
+            'p95': round(percentile(latencies, 95), 3),
+            'p99': round(percentile(latencies, 99), 3),
+            'max': round(latencies[-1], 3),
+        },
+        'queries_per_request': round((counter.count - queries_before) / iterations, 2),
+        'status_codes': {str(k): v for k, v in sorted(statuses.items())},
+        'peak_rss_kb': peak_rss_kb(),
+    }
+
+
+def build_scenarios(client, emails, radii, rng):
+    """name -> callable(i) issuing one request through the test client"""
+    lat, lng = BENCH_CENTER
+    scenarios = {}
+
+    for radius in radii:
+        def nearby(i, radius=radius):
+            return client.get('/api/parking-spots/', {
+                'lat': lat + rng.uniform(-0.05, 0.05), 'lng': lng + rng.uniform(-0.05, 0.05),
+                'radius': radius,
+            })
+        scenarios[f'nearby_search_r{radius:g}km'] = nearby
+
+    run_id = f'{os.getpid()}-{int(time.time())}'
+
+    def signup(i):
+        return client.post('/user/signup/', data=json.dumps({
+            'first_name': 'Signup', 'last_name': 'Bench', 'email': f'signup-{run_id}-{i}@example.com',
+            'password': SEED_PASSWORD, 'role': 'provider',
+            'latitude': lat + rng.uniform(-0.1, 0.1), 'longitude': lng + rng.uniform(-0.1, 0.1),
+            'address': 'Benchmark Road', 'parking_type': 'open', 'hourly_rate': '40',
+        }), content_type='application/json')
+    scenarios['signup'] = signup
+
+    def login(i):
+        return client.put('/user/', data=json.dumps({
+            'email': emails[i % len(emails)], 'password': SEED_PASSWORD,
+        }), content_type='application/json')
+    scenarios['login'] = login
+
+    scenarios['merch_dashboard'] = lambda i: client.get('/merch-dashboard/')
+    scenarios['download_json'] = lambda i: client.get('/download-json/')
+    return scenarios
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(database_url, users, spots, iterations, warmup=3, radii=(1, 5, 25, 200),
+                   only=None, slow_iterations=None, seed_data=True):
+    """Seed `database_url`, run every scenario and return the report dict"""
+    engine = sqlalchemy_engine.configure_engine(database_url)
+    sqlalchemy_engine.Base.metadata.create_all(engine)
+
+    rng = random.Random(42)
+    seed_started = time.perf_counter()
+    if seed_data:
+        emails, _ = seed_database(engine, users=users, spots=spots, rng=rng, email_prefix='bench')
+    else:
+        emails = [e for (e,) in sqlalchemy_engine.session.query(User.email).limit(users)]
+    seed_seconds = time.perf_counter() - seed_started
+
+    counter = QueryCounter(engine)
+    client = Client()
+    results = []
+    # One client replays every request, which per-client rate limits would mostly turn away
+    with override_settings(ADMISSION_CLASSES={}):
+        for name, make_request in build_scenarios(client, emails, radii, rng).items():
+            if only and not any(name.startswith(prefix) for prefix in only):
+                continue
+            # Password hashing makes auth scenarios far slower, allow fewer iterations
+            n = slow_iterations if slow_iterations and name in ('signup', 'login') else iterations
+            results.append(run_scenario(name, make_request, counter, n, min(warmup, n)))
+
+    return {
+        'meta': {
+            'git_revision': git_revision(),
+            'timestamp': datetime.utcnow().isoformat() + 'Z',
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'database': engine.dialect.name,
+            'users': users,
+            'spots': spots,
+            'seed_seconds': round(seed_seconds, 2),
+        },
+        'results': results,
+    }
+
+
+def compare_reports(baseline, current):
+    """Per-scenario relative change of p50/p95/throughput/queries against a baseline report"""
+    base = {r['scenario']: r for r in baseline['results']}
+    rows = []
+    for r in current['results']:
+        b = base.get(r['scenario'])
+        if not b:
+            continue
+
+        def change(new, old):
+            return round((new - old) / old * 100, 1) if old else None
+        rows.append({
+            'scenario': r['scenario'],
+            'p50_change_pct': change(r['latency_ms']['p50'], b['latency_ms']['p50']),
+            'p95_change_pct': change(r['latency_ms']['p95'], b['latency_ms']['p95']),
+            'throughput_change_pct': change(r['throughput_rps'], b['throughput_rps']),
+            'queries_change': round(r['queries_per_request'] - b['queries_per_request'], 2),
+        })
+    return rows
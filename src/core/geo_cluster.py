@@ -0,0 +1,176 @@
+"""
+Hierarchical grid index for server-side marker clustering.
+
+Spots are bucketed into Web Mercator grid cells at every level from 0
+(one cell for the world) to LEAF_LEVEL; a level-L cell is split into four
+level-(L+1) cells, like map tiles. Each cell keeps count, coordinate sums
+(for the centroid) and the minimum price of the spots under it. Adding or
+removing a spot touches one cell per level, so the index is updated
+incrementally rather than rebuilt.
+
+A map at zoom z is served from level z + CELL_LEVEL_OFFSET, i.e. cells of
+roughly 64 screen pixels, so a response has at most about one cluster per
+64x64 px of viewport, however many spots there are.
+"""
+import math
+
+from core.spot_index import LiveSpotIndex
+
+LEAF_LEVEL = 16        # ~600 m cells; deeper zooms show the leaf cells, i.e. nearly single spots
+CELL_LEVEL_OFFSET = 2   # 256 px tiles / 4 = 64 px cells
+MAX_CELLS = 4096        # upper bound on cells scanned per query
+MAX_LATITUDE = 85.05112878
+
+
+def mercator(lat, lng):
+    """(x, y) in [0, 1) Web Mercator coordinates"""
+    lat = max(-MAX_LATITUDE, min(MAX_LATITUDE, lat))
+    x = (lng + 180.0) / 360.0
+    sin = math.sin(math.radians(lat))
+    y = 0.5 - math.log((1 + sin) / (1 - sin)) / (4 * math.pi)
+    return min(max(x, 0.0), 1 - 1e-12), min(max(y, 0.0), 1 - 1e-12)
+
+
+def leaf_cell(lat, lng):
+    x, y = mercator(lat, lng)
+    n = 1 << LEAF_LEVEL
+    return int(x * n), int(y * n)
+
+
+class Cell:
+    __slots__ = ('count', 'sum_lat', 'sum_lng', 'min_price')
+
+    def __init__(self):
+        self.count = 0
+        self.sum_lat = 0.0
+        self.sum_lng = 0.0
+        self.min_price = math.inf
+
+
+class ClusterIndex(LiveSpotIndex):
+
+    def _load(self):
+        rows, seqs = self._load_rows()
+        return self._build_state(rows), seqs
+
+    def _build_state(self, rows):
+        levels = [{} for _ in range(LEAF_LEVEL + 1)]
+        leaves = {}
+        spots = {}
+        for row in rows:
+            self._insert(levels, leaves, spots, row)
+        return levels, leaves, spots
+
+    def _swap(self, state):
+        self.levels, self.leaves, self.spots = state
+
+    def _size(self):
+        return len(self.spots)
+
+    @staticmethod
+    def _insert(levels, leaves, spots, row):
+        price = float(row.price_per_hour or 0)
+        cx, cy = leaf_cell(row.latitude, row.longitude)
+        spots[row.id] = (row.latitude, row.longitude, price, cx, cy)
+        leaves.setdefault((cx, cy), {})[row.id] = (row.latitude, row.longitude, price)
+        for level in range(LEAF_LEVEL, -1, -1):
+            shift = LEAF_LEVEL - level
+            key = (cx >> shift, cy >> shift)
+            cell = levels[level].get(key)
+            if cell is None:
+                cell = levels[level][key] = Cell()
+            cell.count += 1
+            cell.sum_lat += row.latitude
+            cell.sum_lng += row.longitude
+            if price < cell.min_price:
+                cell.min_price = price
+
+    def _upsert(self, row):
+        if row.id in self.spots:
+            self._remove(row.id)
+        self._insert(self.levels, self.leaves, self.spots, row)
+
+    def _remove(self, spot_id):
+        entry = self.spots.pop(spot_id, None)
+        if entry is None:
+            return
+        lat, lng, price, cx, cy = entry
+        leaf = self.leaves[(cx, cy)]
+        del leaf[spot_id]
+        if not leaf:
+            del self.leaves[(cx, cy)]
+
+        # Bottom-up, so a parent recomputing its minimum sees updated children
+        for level in range(LEAF_LEVEL, -1, -1):
+            shift = LEAF_LEVEL - level
+            key = (cx >> shift, cy >> shift)
+            cell = self.levels[level][key]
+            cell.count -= 1
+            if cell.count == 0:
+                del self.levels[level][key]
+                continue
+            cell.sum_lat -= lat
+            cell.sum_lng -= lng
+            if price <= cell.min_price:
+                cell.min_price = self._recompute_min(level, key)
+
+    def _recompute_min(self, level, key):
+        if level == LEAF_LEVEL:
+            return min(p for _, _, p in self.leaves[key].values())
+        children = self.levels[level + 1]
+        x, y = key
+        return min(
+            children[child].min_price
+            for child in ((2 * x, 2 * y), (2 * x + 1, 2 * y), (2 * x, 2 * y + 1), (2 * x + 1, 2 * y + 1))
+            if child in children
+        )
+
+    def _single_spot(self, level, key):
+        """Id of the only spot under a count-1 cell, found by walking down the quadtree"""
+        x, y = key
+        for lvl in range(level + 1, LEAF_LEVEL + 1):
+            cells = self.levels[lvl]
+            x, y = next(
+                child for child in ((2 * x, 2 * y), (2 * x + 1, 2 * y), (2 * x, 2 * y + 1), (2 * x + 1, 2 * y + 1))
+                if child in cells
+            )
+        return next(iter(self.leaves[(x, y)]))
+
+    def clusters(self, south, west, north, east, zoom):
+        """Clusters (count, centroid, min price, id when single) of the cells covering the box"""
+        self.ready()
+        level = max(0, min(LEAF_LEVEL, int(zoom) + CELL_LEVEL_OFFSET))
+        x0, y0 = mercator(north, west)
+        x1, y1 = mercator(south, east)
+        with self.lock:
+            # Very large boxes at high zoom fall back to coarser cells to bound the work
+            while level > 0:
+                n = 1 << level
+                span = (int(x1 * n) - int(x0 * n) + 1) * (int(y1 * n) - int(y0 * n) + 1)
+                if span <= MAX_CELLS:
+                    break
+                level -= 1
+            n = 1 << level
+            cx0, cx1, cy0, cy1 = int(x0 * n), int(x1 * n), int(y0 * n), int(y1 * n)
+            cells = self.levels[level]
+            if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) < len(cells):
+                keys = ((x, y) for x in range(cx0, cx1 + 1) for y in range(cy0, cy1 + 1) if (x, y) in cells)
+            else:
+                keys = (k for k in cells if cx0 <= k[0] <= cx1 and cy0 <= k[1] <= cy1)
+
+            result = []
+            for key in keys:
+                cell = cells[key]
+                cluster = {
+                    'count': cell.count,
+                    'latitude': round(cell.sum_lat / cell.count, 6),
+                    'longitude': round(cell.sum_lng / cell.count, 6),
+                    'min_price': cell.min_price,
+                }
+                if cell.count == 1:
+                    cluster['id'] = self._single_spot(level, key)
+                result.append(cluster)
+        return level, result
+
+
+cluster_index = ClusterIndex(background=True)
@@ -0,0 +1,181 @@
+import gzip
+import os
+import re
+import shutil
+import tempfile
+import threading
+
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, parse_http_date_safe
+
+from core import metrics
+
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+_gzip_lock = threading.Lock()
+
+
+def accepts_gzip(request):
+    """Whether Accept-Encoding lets us send gzip: named, or covered by `*`, with q > 0"""
+    qualities = {}
+    for entry in request.headers.get('Accept-Encoding', '').split(','):
+        coding, *params = [part.strip() for part in entry.split(';')]
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding:
+            qualities[coding.lower()] = quality
+    return qualities.get('gzip', qualities.get('*', 0.0)) > 0
+
+
+def gzip_variant(path, cache_dir):
+    """
+    Path of a gzip-compressed copy of `path` inside `cache_dir`.
+
+    The copy carries the source's mtime, so it is only recompressed when the
+    source file changes.
+    """
+    source_mtime = os.stat(path).st_mtime_ns
+    target = os.path.join(cache_dir, os.path.basename(path) + '.gz')
+    try:
+        if os.stat(target).st_mtime_ns == source_mtime:
+            metrics.inc('cache_requests_total', cache='gzip', result='hit')
+            return target
+    except FileNotFoundError:
+        pass
+
+    metrics.inc('cache_requests_total', cache='gzip', result='miss')
+    with _gzip_lock:
+        try:
+            if os.stat(target).st_mtime_ns == source_mtime:
+                return target
+        except FileNotFoundError:
+            pass
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        try:
+            with open(path, 'rb') as src, os.fdopen(fd, 'wb') as raw, \
+                    gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=9, mtime=0) as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+            os.utime(tmp_path, ns=(source_mtime, source_mtime))
+            os.replace(tmp_path, target)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    return target
+
+
+def _parse_range(header, size):
+    """(start, end) inclusive for a single `bytes=` range, None to ignore it, or 'invalid'"""
+    match = _RANGE_RE.match(header.strip())
+    if not match:
+        # Multiple ranges or other units: serving the full body is allowed
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the final N bytes
+        length = int(last)
+        if length == 0:
+            return 'invalid'
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return 'invalid'
+    return start, end
+
+
+def _if_range_matches(request, etag, last_modified):
+    if_range = request.headers.get('If-Range')
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return if_range == etag
+    since = parse_http_date_safe(if_range)
+    return since is not None and int(last_modified) <= since
+
+
+def _file_slice(path, start, length, block_size=64 * 1024):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            block = f.read(min(block_size, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            yield block
+
+
+def serve_file(request, path, filename, gzip_cache_dir=None):
+    """
+    Download response for a static file with validators and partial content.
+
+    - ETag/Last-Modified from the file's mtime and size, answering
+      If-None-Match / If-Modified-Since with 304
+    - single `Range: bytes=` requests (honouring If-Range) with 206/416
+    - a pre-compressed gzip copy for clients that accept it, when
+      `gzip_cache_dir` is given and the request is not a range request
+    """
+    stat = os.stat(path)
+    etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    last_modified = stat.st_mtime
+    range_header = request.headers.get('Range')
+
+    use_gzip = gzip_cache_dir is not None and not range_header and accepts_gzip(request)
+    if use_gzip:
+        # The compressed body is a different representation, so it gets its own ETag
+        etag = etag[:-1] + '-gz"'
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = _file_response(request, path, stat.st_size, etag, last_modified,
+                                  range_header, use_gzip, gzip_cache_dir)
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    if response.status_code != 304:
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    if gzip_cache_dir is not None:
+        patch_vary_headers(response, ('Accept-Encoding',))
+    # Clients may keep the file but must revalidate, which is a cheap 304 when unchanged
+    patch_cache_control(response, public=True, no_cache=True)
+    return response
+
+
+def _file_response(request, path, size, etag, last_modified, range_header, use_gzip, gzip_cache_dir):
+    if use_gzip:
+        compressed = gzip_variant(path, gzip_cache_dir)
+        response = FileResponse(open(compressed, 'rb'), content_type='application/json')
+        response['Content-Encoding'] = 'gzip'
+        response['Content-Length'] = os.path.getsize(compressed)
+        return response
+
+    byte_range = None
+    if range_header and _if_range_matches(request, etag, last_modified):
+        byte_range = _parse_range(range_header, size)
+    if byte_range == 'invalid':
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    if byte_range:
+        start, end = byte_range
+        length = end - start + 1
+        response = StreamingHttpResponse(
+            _file_slice(path, start, length), status=206, content_type='application/json'
+        )
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = length
+    else:
+        response = FileResponse(open(path, 'rb'), content_type='application/json')
+    response['Accept-Ranges'] = 'bytes'
+    return response
@@ -0,0 +1,170 @@
+"""
+Background jobs on a durable queue in the application database.
+
+Slow side effects (provider signup spots, merch imports, dashboard and
+catalog rebuilds) are registered as tasks and queued as Job rows (see
+core/models/job.py) instead of running in the request. `manage.py run_jobs`
+starts a worker: a pool of JOB_WORKER_CONCURRENCY threads that claim due
+jobs, run them and record the result. No broker is needed, and any number
+of worker processes can share the queue.
+
+    @task('spots.publish_catalog', concurrency=1)
+    def publish_catalog():
+        ...
+
+    job = publish_catalog.enqueue()   # GET /api/jobs/<job.id>/ to poll
+
+Failed attempts are retried with exponential backoff (`retry_delay`
+seconds, doubling) up to `max_attempts`. `concurrency` caps how many jobs
+of one task a worker runs at once. Running jobs are heartbeated; jobs of a
+worker that died are requeued after JOB_LOCK_TIMEOUT_SECONDS.
+"""
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+
+from core import metrics
+from core.models.job import Job
+from core.sqlalchemy_engine import session
+
+logger = logging.getLogger(__name__)
+
+TASKS = {}
+
+
+class Task:
+
+    def __init__(self, name, func, max_attempts=3, retry_delay=30, concurrency=None, public=False):
+        self.name = name
+        self.func = func
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.concurrency = concurrency
+        self.public = public  # admins may queue it through POST /api/jobs/
+
+    def __call__(self, *args, **kwargs):
+        return self.func(*args, **kwargs)
+
+    def enqueue(self, payload=None, delay=None, priority=0, created_by=None):
+        """Queue a run with `payload` as keyword arguments; returns the Job"""
+        job = Job.enqueue(self.name, payload, delay=delay, priority=priority,
+                          max_attempts=self.max_attempts, created_by=created_by)
+        metrics.inc('jobs_enqueued_total', kind=self.name)
+        return job
+
+    def retry_in(self, attempts):
+        return timedelta(seconds=self.retry_delay * 2 ** (attempts - 1))
+
+
+def task(name, **options):
+    """Register the decorated function as task `name` (see Task for options)"""
+    def register(func):
+        TASKS[name] = Task(name, func, **options)
+        return TASKS[name]
+    return register
+
+
+def load_tasks():
+    # Tasks register themselves on import
+    import core.tasks  # noqa: F401
+    return TASKS
+
+
+class Worker:
+    """Claims and runs jobs on a pool of threads until stopped"""
+
+    def __init__(self, concurrency=None, kinds=None, poll_seconds=None, lock_timeout=None, name=None):
+        tasks = load_tasks()
+        self.tasks = {kind: tasks[kind] for kind in kinds} if kinds else dict(tasks)
+        self.concurrency = concurrency or getattr(settings, 'JOB_WORKER_CONCURRENCY', 4)
+        self.poll_seconds = poll_seconds or getattr(settings, 'JOB_POLL_SECONDS', 1.0)
+        self.lock_timeout = timedelta(seconds=lock_timeout or getattr(settings, 'JOB_LOCK_TIMEOUT_SECONDS', 300))
+        self.name = name or f'{socket.gethostname()}:{os.getpid()}'
+        self._slots = threading.BoundedSemaphore(self.concurrency)
+        self._lock = threading.Lock()
+        self._running = {}  # job id -> kind
+        self._stop = threading.Event()
+        self._housekept = 0.0
+
+    def stop(self):
+        self._stop.set()
+
+    def _open_kinds(self):
+        """Tasks below their concurrency cap"""
+        with self._lock:
+            busy = list(self._running.values())
+        return [
+            kind for kind, t in self.tasks.items()
+            if t.concurrency is None or busy.count(kind) < t.concurrency
+        ]
+
+    def _housekeeping(self):
+        # Heartbeats well inside the lock timeout, so only dead workers' jobs look stale
+        now = time.monotonic()
+        if now - self._housekept < self.lock_timeout.total_seconds() / 3:
+            return
+        self._housekept = now
+        with self._lock:
+            running = list(self._running)
+        Job.heartbeat(running, self.name)
+        requeued, failed = Job.release_stale(self.lock_timeout)
+        if requeued or failed:
+            logger.warning('Released %d stale jobs (%d failed for good)', requeued + failed, failed)
+        metrics.flush()
+
+    def run(self, burst=False):
+        """Work until stop(); with `burst`, return once the queue has nothing due"""
+        logger.info('Job worker %s running %s with %d threads', self.name, ', '.join(self.tasks), self.concurrency)
+        while not self._stop.is_set():
+            self._housekeeping()
+            if not self._slots.acquire(timeout=self.poll_seconds):
+                continue
+            claimed = Job.claim(self.name, self._open_kinds())
+            if claimed is None:
+                self._slots.release()
+                with self._lock:
+                    idle = not self._running
+                if burst and idle:
+                    break
+                self._stop.wait(self.poll_seconds)
+                continue
+            with self._lock:
+                self._running[claimed[0]] = claimed[1]
+            threading.Thread(target=self._execute, args=claimed, name=f'job-{claimed[0][:8]}', daemon=True).start()
+        # Let running jobs finish
+        for _ in range(self.concurrency):
+            self._slots.acquire()
+        metrics.flush(force=True)
+
+    def _execute(self, job_id, kind, payload, attempts, max_attempts):
+        t = self.tasks[kind]
+        started = time.perf_counter()
+        try:
+            result = t(**payload)
+        except Exception as e:
+            retry_in = t.retry_in(attempts) if attempts < max_attempts else None
+            logger.exception('Job %s (%s) failed on attempt %d/%d%s', job_id, kind, attempts, max_attempts,
+                             f', retrying in {retry_in}' if retry_in else '')
+            outcome = 'retried' if retry_in else 'failed'
+            Job.fail(job_id, self.name, f'{type(e).__name__}: {e}', retry_in)
+        else:
+            outcome = 'succeeded'
+            Job.succeed(job_id, self.name, result)
+        finally:
+            # Whatever the task left in its thread's ORM session is discarded
+            session.remove()
+            with self._lock:
+                self._running.pop(job_id, None)
+            self._slots.release()
+        metrics.inc('jobs_total', kind=kind, outcome=outcome)
+        metrics.observe('job_duration_seconds', time.perf_counter() - started, kind=kind)
+
+
+metrics.describe('jobs_enqueued_total', 'counter', 'Background jobs queued, by task')
+metrics.describe('jobs_total', 'counter', 'Background job attempts, by task and outcome (succeeded/retried/failed)')
+metrics.describe('job_duration_seconds', 'histogram', 'Background job run time by task')
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from core import sharding, sqlalchemy_engine
+from core.models.parking_spot_hours import ParkingSpotHours
+
+
+class Command(BaseCommand):
+    help = "Rebuild structured opening hours from every parking spot's availability_hours, on every shard"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--after-id', type=int, default=0, help='Only spots with a larger id')
+
+    def handle(self, *args, **options):
+        engines = sharding.engines or {sharding.DEFAULT_SHARD: sqlalchemy_engine.engine}
+        parsed, failed = 0, []
+        for shard, engine in engines.items():
+            # A spot's hours live on its own shard, so each shard is rebuilt in its own transaction
+            with engine.begin() as conn:
+                shard_parsed, shard_failed = ParkingSpotHours.backfill(conn, options['batch_size'], options['after_id'])
+            if len(engines) > 1:
+                self.stdout.write(f'{shard}: parsed hours of {shard_parsed} spots')
+            parsed += shard_parsed
+            failed += shard_failed
+        self.stdout.write(self.style.SUCCESS(f'Parsed hours of {parsed} spots'))
+        if failed:
+            preview = ', '.join(map(str, failed[:20])) + (' ...' if len(failed) > 20 else '')
+            self.stdout.write(self.style.WARNING(
+                f'{len(failed)} spots have unrecognised availability_hours and never match open filters: {preview}'
+            ))
@@ -0,0 +1,68 @@
+import json
+import os
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.benchmark import compare_reports, run_benchmarks
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a throwaway database with synthetic users/spots and benchmark the "
+        "real views in-process (nearby search, signup, login, merch dashboard, download)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--database-url',
+            help='SQLAlchemy URL of the stand-in database, e.g. postgresql://localhost/bench '
+                 '(default: a fresh SQLite file in the temp directory)',
+        )
+        parser.add_argument('--spots', type=int, default=10_000)
+        parser.add_argument('--users', type=int, default=1_000)
+        parser.add_argument('--iterations', type=int, default=100)
+        parser.add_argument('--auth-iterations', type=int, default=10,
+                            help='Iterations for signup/login, which hash passwords')
+        parser.add_argument('--warmup', type=int, default=3)
+        parser.add_argument('--radii', type=float, nargs='+', default=[1, 5, 25, 200])
+        parser.add_argument('--only', nargs='+', help='Scenario name prefixes to run')
+        parser.add_argument('--no-seed', action='store_true',
+                            help='Reuse an already seeded --database-url')
+        parser.add_argument('--output', help='Write the JSON report to this file')
+        parser.add_argument('--compare', help='Baseline JSON report to diff against')
+
+    def handle(self, *args, **options):
+        database_url = options['database_url']
+        if not database_url:
+            if options['no_seed']:
+                raise CommandError('--no-seed needs an explicit --database-url')
+            path = os.path.join(tempfile.gettempdir(), f'parkspacehub_bench_{os.getpid()}.sqlite3')
+            if os.path.exists(path):
+                os.remove(path)
+            database_url = f'sqlite:///{path}'
+
+        report = run_benchmarks(
+            database_url,
+            users=options['users'],
+            spots=options['spots'],
+            iterations=options['iterations'],
+            warmup=options['warmup'],
+            radii=options['radii'],
+            only=options['only'],
+            slow_iterations=options['auth_iterations'],
+            seed_data=not options['no_seed'],
+        )
+
+        if options['compare']:
+            with open(options['compare']) as f:
+                report['comparison'] = compare_reports(json.load(f), report)
+
+        payload = json.dumps(report, indent=2)
+        if options['output']:
+            # Views print to stdout, so a file is the reliable machine-readable channel
+            with open(options['output'], 'w') as f:
+                f.write(payload)
+            self.stdout.write(self.style.SUCCESS(f"Wrote benchmark report to {options['output']}"))
+        else:
+            self.stdout.write(payload)
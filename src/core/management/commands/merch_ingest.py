@@ -0,0 +1,56 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.merch_metrics import DEFAULT_CHUNKSIZE
+from core.tasks import ingest_merch
+
+
+class Command(BaseCommand):
+    help = "Apply a new batch of merch sales/reviews/returns to the incremental metrics store"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sales', nargs='*', default=[])
+        parser.add_argument('--reviews', nargs='*', default=[])
+        parser.add_argument('--returns', nargs='*', default=[])
+        parser.add_argument('--json', nargs='*', default=[], help='Merchtech dataset JSON files')
+        parser.add_argument(
+            '--batch-id',
+            help='Identifier recorded with the batch; defaults to a hash of the input files',
+        )
+        parser.add_argument('--chunksize', type=int, default=DEFAULT_CHUNKSIZE)
+        parser.add_argument('--workers', type=int, default=getattr(settings, 'MERCH_OFFLINE_MAX_WORKERS', 1))
+        parser.add_argument('--background', action='store_true',
+                            help='Queue the batch for `manage.py run_jobs` instead of applying it here')
+
+    def handle(self, *args, **options):
+        inputs = options['sales'] + options['reviews'] + options['returns'] + options['json']
+        if not inputs:
+            raise CommandError('Nothing to ingest, pass --sales/--reviews/--returns or --json')
+        for path in inputs:
+            if not os.path.exists(path):
+                raise CommandError(f"File not found: {path}")
+
+        payload = {
+            # Workers may run elsewhere in the tree, so paths go in absolute
+            'sales': [os.path.abspath(p) for p in options['sales']],
+            'reviews': [os.path.abspath(p) for p in options['reviews']],
+            'returns': [os.path.abspath(p) for p in options['returns']],
+            'json_files': [os.path.abspath(p) for p in options['json']],
+            'batch_id': options['batch_id'],
+            'chunksize': options['chunksize'],
+            'workers': options['workers'],
+        }
+        if options['background']:
+            job = ingest_merch.enqueue(payload)
+            self.stdout.write(self.style.SUCCESS(f"Queued job {job.id}"))
+            return
+
+        result = ingest_merch(**payload)
+        if result['skipped']:
+            self.stdout.write(self.style.WARNING(f"Batch {result['batch_id']} was already ingested"))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f"Ingested batch {result['batch_id']}: {result['products_updated']} products updated"
+            ))
@@ -0,0 +1,49 @@
+import json
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.merch_metrics import DEFAULT_CHUNKSIZE, build_csv_metrics
+
+
+class Command(BaseCommand):
+    help = "Compute merch dashboard metrics from sales/reviews/returns CSVs"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sales', nargs='+', default=[os.path.join(settings.BASE_DIR, 'sde2_sales.csv')])
+        parser.add_argument('--reviews', nargs='+', default=[os.path.join(settings.BASE_DIR, 'sde2_reviews.csv')])
+        parser.add_argument('--returns', nargs='+', default=[os.path.join(settings.BASE_DIR, 'sde2_returns.csv')])
+        parser.add_argument(
+            '--mode', choices=['memory', 'chunked'], default='chunked',
+            help="'chunked' streams each CSV and never holds a whole file in memory",
+        )
+        parser.add_argument('--chunksize', type=int, default=DEFAULT_CHUNKSIZE)
+        parser.add_argument(
+            '--workers', type=int, default=getattr(settings, 'MERCH_OFFLINE_MAX_WORKERS', 1),
+            help='Aggregate the input files concurrently on this many workers',
+        )
+        parser.add_argument('--backend', choices=['process', 'thread'], default='process')
+        parser.add_argument('--output', help='Write rows as JSON to this file instead of stdout')
+
+    def handle(self, *args, **options):
+        if options['chunksize'] <= 0:
+            raise CommandError('--chunksize must be positive')
+        for name in ('sales', 'reviews', 'returns'):
+            for path in options[name]:
+                if not os.path.exists(path):
+                    raise CommandError(f"{name} file not found: {path}")
+
+        rows, _ = build_csv_metrics(
+            options['sales'], options['reviews'], options['returns'],
+            mode=options['mode'], chunksize=options['chunksize'],
+            max_workers=options['workers'], backend=options['backend'],
+        )
+        payload = json.dumps(rows, indent=2, default=float)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(payload)
+            self.stdout.write(self.style.SUCCESS(f"Wrote {len(rows)} products to {options['output']}"))
+        else:
+            self.stdout.write(payload)
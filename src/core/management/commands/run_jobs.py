@@ -0,0 +1,33 @@
+import logging
+import signal
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.jobs import Worker, load_tasks
+
+
+class Command(BaseCommand):
+    help = "Run queued background jobs (see core/jobs.py) until interrupted"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int,
+                            help='Jobs run at once (default: JOB_WORKER_CONCURRENCY)')
+        parser.add_argument('--kinds', nargs='+', help='Only run these tasks')
+        parser.add_argument('--burst', action='store_true',
+                            help='Exit once nothing is due instead of waiting for new jobs')
+
+    def handle(self, *args, **options):
+        if options['concurrency'] is not None and options['concurrency'] <= 0:
+            raise CommandError('--concurrency must be positive')
+        unknown = set(options['kinds'] or ()) - set(load_tasks())
+        if unknown:
+            raise CommandError(f"Unknown tasks: {', '.join(sorted(unknown))}")
+        if not logging.getLogger().handlers:
+            logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+        worker = Worker(concurrency=options['concurrency'], kinds=options['kinds'])
+        # Finish what is running, then exit
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: worker.stop())
+        worker.run(burst=options['burst'])
+        self.stdout.write(self.style.SUCCESS('Job worker stopped'))
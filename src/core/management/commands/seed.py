@@ -0,0 +1,76 @@
+import random
+import secrets
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import sharding, sqlalchemy_engine
+from core.seeding import SEED_PASSWORD, seed_database
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate synthetic users, roles and parking spots clustered around Indian "
+        "city centres, written with COPY (Postgres) or multi-row INSERTs"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10_000)
+        parser.add_argument('--spots', type=int, default=100_000)
+        parser.add_argument('--provider-share', type=float, default=0.3,
+                            help='Fraction of users that are providers and own the spots')
+        parser.add_argument('--available-share', type=float, default=0.75,
+                            help="Fraction of spots with is_available='yes'")
+        parser.add_argument('--batch-size', type=int, default=5_000)
+        parser.add_argument('--random-seed', type=int, default=42)
+        parser.add_argument('--email-prefix',
+                            help='Prefix for generated emails (default: unique per run)')
+        parser.add_argument('--database-url',
+                            help='SQLAlchemy URL to seed instead of the configured DATABASE_URL')
+        parser.add_argument('--create-tables', action='store_true',
+                            help='Create missing tables first (for fresh local stand-ins)')
+
+    def handle(self, *args, **options):
+        for name in ('provider_share', 'available_share'):
+            if not 0 <= options[name] <= 1:
+                raise CommandError(f"--{name.replace('_', '-')} must be between 0 and 1")
+        if options['batch_size'] <= 0:
+            raise CommandError('--batch-size must be positive')
+
+        engine = sqlalchemy_engine.engine
+        if options['database_url']:
+            engine = sqlalchemy_engine.configure_engine(options['database_url'])
+        if options['create_tables']:
+            sqlalchemy_engine.Base.metadata.create_all(engine)
+            # Region shards only hold spots and the rows that hang off them
+            spot_tables = [sqlalchemy_engine.Base.metadata.tables[name] for name in sharding.SHARDED_TABLES]
+            for shard, shard_engine in sharding.engines.items():
+                if shard_engine is not engine:
+                    sqlalchemy_engine.Base.metadata.create_all(shard_engine, tables=spot_tables)
+
+        # Emails are unique, so each run gets its own prefix unless one is given
+        email_prefix = options['email_prefix'] or f'seed{secrets.token_hex(3)}x'
+        started = time.perf_counter()
+
+        def progress(kind, count):
+            # Spots report after every batch, only print every 20th
+            if kind == 'spots' and count % (options['batch_size'] * 20) and count != options['spots']:
+                return
+            self.stdout.write(f"  {kind}: {count} ({time.perf_counter() - started:.1f}s)")
+
+        _, provider_ids = seed_database(
+            engine,
+            users=options['users'],
+            spots=options['spots'],
+            provider_share=options['provider_share'],
+            available_share=options['available_share'],
+            batch_size=options['batch_size'],
+            rng=random.Random(options['random_seed']),
+            email_prefix=email_prefix,
+            progress=progress,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {options['users']} users ({len(provider_ids)} providers) and "
+            f"{options['spots']} spots in {time.perf_counter() - started:.1f}s. "
+            f"Logins: {email_prefix}<n>@example.com / {SEED_PASSWORD}"
+        ))
@@ -0,0 +1,137 @@
+import glob
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+import threading
+
+from django.conf import settings
+
+from core import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class MerchDatasetCache:
+    """
+    Cache of computed merch dashboard results (rows, chart_data).
+
+    Entries are keyed on (path, mtime, size) of every source file, so editing
+    or replacing a CSV is picked up on the next request. Results are kept in
+    process memory and also pickled to `cache_dir`, which lets a freshly
+    started worker serve the dashboard without re-parsing the CSVs.
+    """
+
+    # Bump when the way metrics are computed changes, so old snapshots are ignored
+    VERSION = 2
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self._memory = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def file_key(paths):
+        key = []
+        for path in paths:
+            stat = os.stat(path)
+            key.append((os.path.abspath(path), stat.st_mtime_ns, stat.st_size))
+        return tuple(key)
+
+    @staticmethod
+    def _digest(value):
+        return hashlib.sha1(repr(value).encode('utf-8')).hexdigest()[:16]
+
+    def _snapshot_prefix(self, paths):
+        names = tuple(os.path.abspath(p) for p in paths)
+        return os.path.join(self.cache_dir, self._digest(names))
+
+    def _snapshot_path(self, paths, key):
+        return f"{self._snapshot_prefix(paths)}-{self._digest(key)}.pkl"
+
+    def _read_snapshot(self, paths, key):
+        path = self._snapshot_path(paths, key)
+        try:
+            with open(path, 'rb') as f:
+                snapshot = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning('Ignoring unreadable merch cache snapshot %s: %s', path, e)
+            return None
+        if snapshot.get('version') != self.VERSION or snapshot.get('key') != key:
+            return None
+        return snapshot['value']
+
+    def _write_snapshot(self, paths, key, value):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        target = self._snapshot_path(paths, key)
+        # Write to a temp file and rename so readers never see a partial pickle
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                snapshot = {'version': self.VERSION, 'key': key, 'value': value}
+                pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, target)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        # Drop snapshots of older versions of the same files
+        for stale in glob.glob(f"{self._snapshot_prefix(paths)}-*.pkl"):
+            if stale != target:
+                try:
+                    os.remove(stale)
+                except OSError:
+                    pass
+
+    def get_or_build(self, paths, builder):
+        """Return cached (rows, chart_data) for `paths`, calling `builder()` on a miss"""
+        key = self.file_key(paths)
+
+        with self._lock:
+            value = self._memory.get(key)
+        if value is not None:
+            metrics.inc('cache_requests_total', cache='merch', result='hit')
+            return value
+
+        value = self._read_snapshot(paths, key)
+        if value is not None:
+            metrics.inc('cache_requests_total', cache='merch', result='disk_hit')
+        else:
+            metrics.inc('cache_requests_total', cache='merch', result='miss')
+            value = builder()
+            try:
+                self._write_snapshot(paths, key, value)
+            except OSError as e:
+                logger.warning('Could not write merch cache snapshot: %s', e)
+
+        with self._lock:
+            # Only the latest version of a file set is worth keeping in memory
+            names = tuple(k[0] for k in key)
+            for old_key in [k for k in self._memory if tuple(p[0] for p in k) == names]:
+                del self._memory[old_key]
+            self._memory[key] = value
+        return value
+
+    def invalidate(self):
+        """Forget every cached result, in memory and on disk"""
+        with self._lock:
+            self._memory.clear()
+        for path in glob.glob(os.path.join(self.cache_dir, '*.pkl')):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+merch_cache = MerchDatasetCache(
+    getattr(settings, 'MERCH_CACHE_DIR', os.path.join(settings.BASE_DIR, 'cache', 'merch'))
+)
+
+
+def invalidate_merch_cache():
+    """Explicit invalidation hook, e.g. after replacing the default CSVs in place"""
+    merch_cache.invalidate()
@@ -0,0 +1,470 @@
+import json
+import codecs
+import math
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+# Product id column shared by sales, reviews and returns
+PID = 'asin'
+
+# Columns (and their dtypes) the metrics actually use from each CSV. Ratings
+# and return counts are read as text and coerced, matching pd.to_numeric below.
+SALES_DTYPES = {PID: 'str', 'gmv': 'float64', 'units_sold': 'Int64', 'refunds': 'Int64'}
+REVIEWS_DTYPES = {PID: 'str', 'rating': 'str'}
+RETURNS_DTYPES = {PID: 'str', 'count': 'str'}
+
+DEFAULT_CHUNKSIZE = 100_000
+
+
+def aggregate_sales(sales):
+    """Per-ASIN GMV, orders and refunds"""
+    return sales.groupby(PID).agg(
+        total_gmv=('gmv', 'sum'),
+        total_orders=('units_sold', 'sum'),
+        total_refunds=('refunds', 'sum')
+    ).reset_index()
+
+
+def aggregate_reviews(reviews):
+    """Per-ASIN average rating and review count"""
+    reviews['rating'] = pd.to_numeric(reviews['rating'], errors='coerce')
+    return reviews.groupby(PID).agg(
+        avg_rating=('rating', 'mean'),
+        review_count=('rating', 'count')
+    ).reset_index()
+
+
+def aggregate_returns(returns):
+    """Per-ASIN returned units"""
+    returns['count'] = pd.to_numeric(returns['count'], errors='coerce').fillna(0)
+    return returns.groupby(PID).agg(
+        returns_count=('count', 'sum')
+    ).reset_index()
+
+
+def merge_metrics(sales_metrics, reviews_metrics, returns_metrics):
+    """Join the per-source aggregates on ASIN and derive the return rate"""
+    df = (
+        sales_metrics.merge(reviews_metrics, on=PID, how='left')
+        .merge(returns_metrics, on=PID, how='left')
+    )
+    df.fillna(0, inplace=True)
+
+    # RETURN RATE
+    orders = df['total_orders'].to_numpy(dtype=float)
+    returned = df['returns_count'].to_numpy(dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        df['return_rate'] = np.where(orders > 0, returned / orders, 0.0)
+    return df
+
+
+def build_rows(df, product_id_name_dict=None):
+    """Turn the merged metrics frame into table rows and chart series"""
+    product_id_name_dict = product_id_name_dict or {}
+
+    # Thresholds are the same for every row, compute them once
+    gmv_q25 = df['total_gmv'].quantile(0.25)
+    gmv_median = df['total_gmv'].median()
+
+    rows = []
+    for _, r in df.iterrows():
+        issues, suggestions = [], []
+
+        if r['total_gmv'] < gmv_q25:
+            issues.append('Low GMV')
+            suggestions.append('Review pricing & marketing')
+
+        if 0 < r['avg_rating'] < 3.0:
+            issues.append('Low Rating')
+            suggestions.append('Improve quality or descriptions')
+
+        if r['return_rate'] > 0.2:
+            issues.append('High Return Rate')
+            suggestions.append('Check product defects')
+
+        if r['review_count'] < 3 and r['total_gmv'] < gmv_median:
+            suggestions.append('Increase review sampling / promos')
+
+        rows.append({
+            'product_id': r[PID],
+            'product_name': product_id_name_dict.get(r[PID], r[PID]),
+            'gmv': round(r['total_gmv'], 2),
+            'avg_rating': round(r['avg_rating'], 2),
+            'return_rate': round(r['return_rate'] * 100, 2),
+            'total_orders': int(r['total_orders']),
+            'issues': ', '.join(issues) or 'No major issues',
+            'suggestions': '; '.join(dict.fromkeys(suggestions)) or 'No action needed',
+        })
+
+    chart_data = {
+        "labels": [r['product_name'] for r in rows],
+        "gmv": [r['gmv'] for r in rows],
+        "rating": [r['avg_rating'] for r in rows],
+        "returns": [r['return_rate'] for r in rows],
+        "total_orders": [r['total_orders'] for r in rows]
+    }
+
+    return rows, chart_data
+
+
+def build_metrics(sales, reviews, returns, product_id_name_dict=None):
+    """Compute dashboard rows and chart data from raw sales/reviews/returns frames"""
+    df = merge_metrics(
+        aggregate_sales(sales),
+        aggregate_reviews(reviews),
+        aggregate_returns(returns),
+    )
+    return build_rows(df, product_id_name_dict)
+
+
+def read_csv_frames(sales_path, reviews_path, returns_path):
+    """Load the three CSVs fully into memory, reading only the columns we use"""
+    return (
+        pd.read_csv(sales_path, usecols=list(SALES_DTYPES), dtype=SALES_DTYPES),
+        pd.read_csv(reviews_path, usecols=list(REVIEWS_DTYPES), dtype=REVIEWS_DTYPES),
+        pd.read_csv(returns_path, usecols=list(RETURNS_DTYPES), dtype=RETURNS_DTYPES),
+    )
+
+
+def _to_number(value):
+    """Mirror pd.to_numeric(errors='coerce') for a single value; None when not numeric"""
+    if isinstance(value, bool) or value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return None if isinstance(value, float) and math.isnan(value) else value
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        pass
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if math.isnan(number) else number
+
+
+class MetricsAccumulator:
+    """
+    Running per-ASIN sums and counts for sales, reviews and returns.
+
+    Records can be folded in one at a time, so the raw rows never have to be
+    held in memory. `to_frame()` produces the same merged frame as
+    `merge_metrics` does for the equivalent DataFrames.
+    """
+
+    def __init__(self):
+        self.sales = {}    # asin -> [gmv, units_sold, refunds]
+        self.reviews = {}  # asin -> [rating_sum, rating_count]
+        self.returns = {}  # asin -> returned units
+
+    def add_sale(self, record):
+        totals = self.sales.setdefault(record[PID], [0, 0, 0])
+        for i, field in enumerate(('gmv', 'units_sold', 'refunds')):
+            value = record.get(field)
+            if value is not None:
+                totals[i] += value
+
+    def add_review(self, record):
+        totals = self.reviews.setdefault(record[PID], [0, 0])
+        rating = _to_number(record.get('rating'))
+        if rating is not None:
+            totals[0] += rating
+            totals[1] += 1
+
+    def add_return(self, record):
+        count = _to_number(record.get('count'))
+        self.returns[record[PID]] = self.returns.get(record[PID], 0) + (count or 0)
+
+    def add_product(self, product):
+        """Fold one `products[*]` entry of the merchtech JSON into the totals"""
+        for record in product.get('sales', ()):
+            self.add_sale(record)
+        for record in product.get('reviews', ()):
+            self.add_review(record)
+        for record in product.get('returns', ()):
+            self.add_return(record)
+
+    def add_sales_frame(self, sales):
+        grouped = sales.groupby(PID)[['gmv', 'units_sold', 'refunds']].sum()
+        for asin, gmv, units, refunds in zip(
+            grouped.index, grouped['gmv'].tolist(),
+            grouped['units_sold'].tolist(), grouped['refunds'].tolist()
+        ):
+            totals = self.sales.setdefault(asin, [0, 0, 0])
+            totals[0] += gmv
+            totals[1] += units
+            totals[2] += refunds
+
+    def add_reviews_frame(self, reviews):
+        ratings = pd.to_numeric(reviews['rating'], errors='coerce')
+        grouped = ratings.groupby(reviews[PID]).agg(['sum', 'count'])
+        for asin, total, count in zip(grouped.index, grouped['sum'].tolist(), grouped['count'].tolist()):
+            totals = self.reviews.setdefault(asin, [0, 0])
+            totals[0] += total
+            totals[1] += count
+
+    def add_returns_frame(self, returns):
+        counts = pd.to_numeric(returns['count'], errors='coerce').fillna(0)
+        grouped = counts.groupby(returns[PID]).sum()
+        for asin, count in zip(grouped.index, grouped.tolist()):
+            self.returns[asin] = self.returns.get(asin, 0) + count
+
+    def merge(self, other):
+        """Add another accumulator's totals (e.g. from a parallel shard) into this one"""
+        for asin, (gmv, units, refunds) in other.sales.items():
+            totals = self.sales.setdefault(asin, [0, 0, 0])
+            totals[0] += gmv
+            totals[1] += units
+            totals[2] += refunds
+        for asin, (total, count) in other.reviews.items():
+            totals = self.reviews.setdefault(asin, [0, 0])
+            totals[0] += total
+            totals[1] += count
+        for asin, count in other.returns.items():
+            self.returns[asin] = self.returns.get(asin, 0) + count
+        return self
+
+    def to_frame(self):
+        """Merged per-ASIN metrics, same layout as `merge_metrics`"""
+        sales_keys = sorted(self.sales)
+        sales_metrics = pd.DataFrame({
+            PID: sales_keys,
+            'total_gmv': [self.sales[k][0] for k in sales_keys],
+            'total_orders': [self.sales[k][1] for k in sales_keys],
+            'total_refunds': [self.sales[k][2] for k in sales_keys],
+        })
+
+        review_keys = sorted(self.reviews)
+        reviews_metrics = pd.DataFrame({
+            PID: review_keys,
+            'avg_rating': [
+                (total / count) if count else np.nan
+                for total, count in (self.reviews[k] for k in review_keys)
+            ],
+            'review_count': [self.reviews[k][1] for k in review_keys],
+        })
+
+        return_keys = sorted(self.returns)
+        returns_metrics = pd.DataFrame({
+            PID: return_keys,
+            'returns_count': [self.returns[k] for k in return_keys],
+        })
+
+        return merge_metrics(sales_metrics, reviews_metrics, returns_metrics)
+
+
+# (dtypes, MetricsAccumulator method) for each CSV source
+CSV_SOURCES = {
+    'sales': (SALES_DTYPES, 'add_sales_frame'),
+    'reviews': (REVIEWS_DTYPES, 'add_reviews_frame'),
+    'returns': (RETURNS_DTYPES, 'add_returns_frame'),
+}
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def _as_list(paths):
+    return [paths] if isinstance(paths, (str, os.PathLike)) else list(paths)
+
+
+def aggregate_csv_file(source, path, chunksize=None):
+    """
+    Fold one CSV of the given source ('sales', 'reviews' or 'returns') into a
+    fresh MetricsAccumulator. With `chunksize` the file is read that many rows
+    at a time, otherwise in one go. Runs in pool workers, so it must stay a
+    picklable module-level function.
+    """
+    dtypes, method = CSV_SOURCES[source]
+    accumulator = MetricsAccumulator()
+    fold = getattr(accumulator, method)
+    if chunksize:
+        with pd.read_csv(path, usecols=list(dtypes), dtype=dtypes, chunksize=chunksize) as reader:
+            for chunk in reader:
+                fold(chunk)
+    else:
+        fold(pd.read_csv(path, usecols=list(dtypes), dtype=dtypes))
+    return accumulator
+
+
+def get_executor(max_workers, backend='process'):
+    """Shared pool per (backend, size); created lazily and reused across requests"""
+    key = (backend, max_workers)
+    with _executors_lock:
+        executor = _executors.get(key)
+        if executor is None:
+            if backend == 'thread':
+                executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='merch')
+            else:
+                # spawn keeps the web process' DB connections and threads out of the workers
+                executor = ProcessPoolExecutor(
+                    max_workers=max_workers, mp_context=multiprocessing.get_context('spawn')
+                )
+            _executors[key] = executor
+        return executor
+
+
+def aggregate_csv_files(sales_paths, reviews_paths, returns_paths, chunksize=None,
+                        max_workers=1, backend='process'):
+    """
+    Aggregate any number of CSV files per source into one MetricsAccumulator.
+
+    Every file (e.g. one sales export per region) is an independent task; with
+    `max_workers` > 1 they run concurrently on a shared pool and the partial
+    accumulators are merged afterwards, so wall time tracks the largest file
+    rather than the total file count.
+    """
+    tasks = [
+        (source, path)
+        for source, paths in (('sales', sales_paths), ('reviews', reviews_paths), ('returns', returns_paths))
+        for path in _as_list(paths)
+    ]
+
+    accumulator = MetricsAccumulator()
+    if max_workers <= 1 or len(tasks) <= 1:
+        for source, path in tasks:
+            accumulator.merge(aggregate_csv_file(source, path, chunksize))
+        return accumulator
+
+    executor = get_executor(max_workers, backend)
+    futures = [executor.submit(aggregate_csv_file, source, path, chunksize) for source, path in tasks]
+    for future in futures:
+        accumulator.merge(future.result())
+    return accumulator
+
+
+def aggregate_csv_chunked(sales_path, reviews_path, returns_path, chunksize=DEFAULT_CHUNKSIZE):
+    """
+    Out-of-core variant of `read_csv_frames` + `merge_metrics`.
+
+    Each CSV is read `chunksize` rows at a time and every chunk's groupby
+    totals are folded into a MetricsAccumulator, so peak memory depends on
+    the chunk size and number of ASINs rather than on the file size.
+    """
+    return aggregate_csv_files(sales_path, reviews_path, returns_path, chunksize=chunksize)
+
+
+def build_csv_metrics(sales_paths, reviews_paths, returns_paths, mode='memory',
+                      chunksize=DEFAULT_CHUNKSIZE, max_workers=1, backend='process'):
+    """
+    Dashboard rows and chart data for the sales/reviews/returns CSVs.
+
+    Each argument is a path or a list of paths. `mode` is 'memory' (read each
+    file whole) or 'chunked' (read `chunksize` rows at a time); `max_workers`
+    spreads the files over a pool.
+    """
+    if mode not in ('memory', 'chunked'):
+        raise ValueError(f"Unknown aggregation mode {mode!r}, expected 'memory' or 'chunked'")
+
+    sources = [_as_list(sales_paths), _as_list(reviews_paths), _as_list(returns_paths)]
+    if mode == 'memory' and max_workers <= 1 and all(len(paths) == 1 for paths in sources):
+        return build_metrics(*read_csv_frames(*(paths[0] for paths in sources)))
+
+    accumulator = aggregate_csv_files(
+        *sources,
+        chunksize=chunksize if mode == 'chunked' else None,
+        max_workers=max_workers,
+        backend=backend,
+    )
+    return build_rows(accumulator.to_frame())
+
+
+class UploadTooLarge(ValueError):
+    pass
+
+
+def iter_json_products(fileobj, chunk_size=64 * 1024, max_bytes=None, progress=None):
+    """
+    Incrementally yield each entry of the top-level `products` array.
+
+    Only one product (plus one read chunk) is held in memory at a time, so
+    memory stays flat regardless of upload size. `progress(bytes_read)` is
+    called after every chunk; `max_bytes` aborts with UploadTooLarge once
+    more than that many bytes have been read.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    state = {'buf': '', 'pos': 0, 'read': 0, 'eof': False}
+
+    def fill(min_extra=0):
+        # Drop the consumed prefix, then read at least one more chunk
+        state['buf'] = state['buf'][state['pos']:]
+        state['pos'] = 0
+        target = len(state['buf']) + max(min_extra, 1)
+        while not state['eof'] and len(state['buf']) < target:
+            chunk = fileobj.read(chunk_size)
+            if not chunk:
+                state['buf'] += utf8.decode(b'', final=True)
+                state['eof'] = True
+                break
+            state['read'] += len(chunk)
+            if max_bytes is not None and state['read'] > max_bytes:
+                raise UploadTooLarge(f'Upload exceeds the {max_bytes} byte limit')
+            state['buf'] += utf8.decode(chunk) if isinstance(chunk, bytes) else chunk
+            if progress:
+                progress(state['read'])
+
+    def peek():
+        # Next non-whitespace character, reading more input as needed
+        while True:
+            buf = state['buf']
+            pos = state['pos']
+            while pos < len(buf) and buf[pos] in ' \t\r\n':
+                pos += 1
+            state['pos'] = pos
+            if pos < len(buf):
+                return buf[pos]
+            if state['eof']:
+                return ''
+            fill()
+
+    def expect(char):
+        if peek() != char:
+            raise ValueError(f'Invalid JSON: expected {char!r} at byte ~{state["read"]}')
+        state['pos'] += 1
+
+    def value():
+        peek()
+        while True:
+            try:
+                obj, end = decoder.raw_decode(state['buf'], state['pos'])
+                # A number at the very end of the buffer may still be incomplete
+                if end < len(state['buf']) or state['eof']:
+                    state['pos'] = end
+                    return obj
+            except json.JSONDecodeError:
+                if state['eof']:
+                    raise
+            # Grow geometrically so a large value is not re-parsed once per chunk
+            fill(min_extra=max(chunk_size, len(state['buf']) - state['pos']))
+
+    expect('{')
+    if peek() == '}':
+        return
+    while True:
+        key = value()
+        expect(':')
+        if key == 'products':
+            expect('[')
+            if peek() == ']':
+                state['pos'] += 1
+            else:
+                while True:
+                    yield value()
+                    if peek() == ',':
+                        state['pos'] += 1
+                        continue
+                    expect(']')
+                    break
+        else:
+            value()
+        if peek() == ',':
+            state['pos'] += 1
+            continue
+        expect('}')
+        return
@@ -0,0 +1,154 @@
+import base64
+import bisect
+import json
+import math
+import threading
+from collections import OrderedDict
+
+# API sort name -> dashboard row field
+SORT_FIELDS = {
+    'gmv': 'gmv',
+    'rating': 'avg_rating',
+    'return_rate': 'return_rate',
+    'orders': 'total_orders',
+    'name': 'product_name',
+    'product_id': 'product_id',
+}
+ISSUE_TYPES = ('Low GMV', 'Low Rating', 'High Return Rate')
+NO_ISSUES = 'No major issues'
+
+_sorted_memo = OrderedDict()
+_sorted_memo_lock = threading.Lock()
+_SORTED_MEMO_SIZE = 16
+
+
+class InvalidQuery(ValueError):
+    pass
+
+
+def _row_key(row, field):
+    return (row[field], str(row['product_id']))
+
+
+def _has_issue(row, issue):
+    if issue == 'none':
+        return row['issues'] == NO_ISSUES
+    return issue in row['issues'].split(', ')
+
+
+def sorted_view(rows, sort='gmv', issue=None):
+    """
+    Rows matching `issue`, in ascending (sort value, product_id) order, plus
+    their keys for bisecting.
+
+    The result is memoized on the identity of `rows`, so while the dashboard
+    cache keeps handing out the same list, paging through it never re-sorts.
+    """
+    if sort not in SORT_FIELDS:
+        raise InvalidQuery(f"Unknown sort '{sort}', expected one of {', '.join(SORT_FIELDS)}")
+    if issue and issue != 'none' and issue not in ISSUE_TYPES:
+        raise InvalidQuery(f"Unknown issue '{issue}', expected one of {', '.join(ISSUE_TYPES)} or none")
+
+    memo_key = (id(rows), sort, issue)
+    with _sorted_memo_lock:
+        hit = _sorted_memo.get(memo_key)
+        if hit and hit[0] is rows:
+            _sorted_memo.move_to_end(memo_key)
+            return hit[1], hit[2]
+
+    field = SORT_FIELDS[sort]
+    ordered = sorted(
+        (r for r in rows if not issue or _has_issue(r, issue)),
+        key=lambda r: _row_key(r, field),
+    )
+    keys = [_row_key(r, field) for r in ordered]
+
+    with _sorted_memo_lock:
+        _sorted_memo[memo_key] = (rows, ordered, keys)
+        while len(_sorted_memo) > _SORTED_MEMO_SIZE:
+            _sorted_memo.popitem(last=False)
+    return ordered, keys
+
+
+def encode_cursor(row, sort, descending):
+    key = _row_key(row, SORT_FIELDS[sort])
+    raw = json.dumps([sort, descending, key[0], key[1]], default=float)
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, sort, descending):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        c_sort, c_desc, value, product_id = json.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, TypeError):
+        raise InvalidQuery('Malformed cursor')
+    if c_sort != sort or c_desc != descending:
+        raise InvalidQuery('Cursor does not match the requested sort order')
+    return (value, product_id)
+
+
+def query_rows(rows, sort='gmv', descending=True, issue=None, top=None):
+    """All rows matching the query in display order, e.g. for charting a filtered view"""
+    ordered, _ = sorted_view(rows, sort, issue)
+    if descending:
+        ordered = ordered[::-1]
+    return ordered if top is None else ordered[:top]
+
+
+def query_page(rows, sort='gmv', descending=True, issue=None, top=None, limit=50, cursor=None):
+    """
+    One page of dashboard rows with server-side sort, issue filter and top-N.
+
+    Pagination is keyset based: the cursor carries the last row's
+    (sort value, product_id), so a page is located with a bisect instead of
+    an offset scan. Returns (page_rows, total_count, next_cursor).
+    """
+    ordered, keys = sorted_view(rows, sort, issue)
+    total = len(ordered) if top is None else min(top, len(ordered))
+
+    # Position (in display order) of the first row after the cursor
+    start = 0
+    if cursor:
+        key = decode_cursor(cursor, sort, descending)
+        if descending:
+            start = len(ordered) - bisect.bisect_left(keys, key)
+        else:
+            start = bisect.bisect_right(keys, key)
+
+    end = min(start + limit, total)
+    if descending:
+        page = [ordered[len(ordered) - 1 - i] for i in range(start, end)]
+    else:
+        page = ordered[start:end]
+
+    next_cursor = encode_cursor(page[-1], sort, descending) if page and end < total else None
+    return page, total, next_cursor
+
+
+def downsample_chart(rows, max_points=100):
+    """
+    Chart series for `rows` with at most `max_points` points.
+
+    Consecutive rows are merged into equal-sized buckets: GMV and orders are
+    summed, rating and return rate averaged, and the label names the bucket's
+    first and last product.
+    """
+    if len(rows) <= max_points:
+        buckets = [[r] for r in rows]
+    else:
+        size = math.ceil(len(rows) / max_points)
+        buckets = [rows[i:i + size] for i in range(0, len(rows), size)]
+
+    chart_data = {"labels": [], "gmv": [], "rating": [], "returns": [], "total_orders": []}
+    for bucket in buckets:
+        if len(bucket) == 1:
+            r = bucket[0]
+            label = r['product_name']
+        else:
+            label = f"{bucket[0]['product_name']} … {bucket[-1]['product_name']} ({len(bucket)})"
+        chart_data['labels'].append(label)
+        chart_data['gmv'].append(round(float(sum(r['gmv'] for r in bucket)), 2))
+        chart_data['rating'].append(round(float(sum(r['avg_rating'] for r in bucket)) / len(bucket), 2))
+        chart_data['returns'].append(round(float(sum(r['return_rate'] for r in bucket)) / len(bucket), 2))
+        chart_data['total_orders'].append(sum(r['total_orders'] for r in bucket))
+    return chart_data
@@ -0,0 +1,325 @@
+"""
+Minimal Prometheus-style metrics without an external client or agent.
+
+Each worker process updates plain in-memory counters, gauges and histograms
+(a dict update under a lock on the hot path) and periodically snapshots them
+to `<METRICS_DIR>/<pid>-<token>.json`, the token telling apart processes
+that got the same pid. The /metrics view merges every process' snapshot:
+counters and histograms are summed over all processes, gauges over live
+processes only. Snapshots of dead processes are folded into `archive.json`
+and deleted (like prometheus_client's mark_process_dead), so restarts
+neither reset totals nor leave a file behind per pid.
+"""
+import bisect
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+FLUSH_INTERVAL = 1.0
+
+ARCHIVE_FILE = 'archive.json'
+
+_HELP = {}
+_TYPES = {}
+_identity = (None, None)  # (pid, token) this process' snapshot is written under
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}    # (name, labels) -> value
+        self.gauges = {}      # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> [bucket counts..., sum, count]
+        self.collectors = []  # callables refreshing gauges at scrape/flush time
+        self.last_flush = 0.0
+
+    def snapshot(self):
+        for collect in self.collectors:
+            collect(self)
+        with self.lock:
+            return {
+                'counters': [[n, list(l), v] for (n, l), v in self.counters.items()],
+                'gauges': [[n, list(l), v] for (n, l), v in self.gauges.items()],
+                'histograms': [[n, list(l), list(v)] for (n, l), v in self.histograms.items()],
+            }
+
+
+registry = Registry()
+
+
+def describe(name, kind, help_text):
+    _TYPES[name] = kind
+    _HELP[name] = help_text
+
+
+def _labels(labels):
+    return tuple(sorted(labels.items())) if labels else ()
+
+
+def inc(name, value=1, **labels):
+    key = (name, _labels(labels))
+    with registry.lock:
+        registry.counters[key] = registry.counters.get(key, 0) + value
+
+
+def set_gauge(name, value, **labels):
+    key = (name, _labels(labels))
+    with registry.lock:
+        registry.gauges[key] = value
+
+
+def add_gauge(name, delta, **labels):
+    key = (name, _labels(labels))
+    with registry.lock:
+        registry.gauges[key] = registry.gauges.get(key, 0) + delta
+
+
+def observe(name, value, **labels):
+    key = (name, _labels(labels))
+    index = bisect.bisect_left(DEFAULT_BUCKETS, value)
+    with registry.lock:
+        data = registry.histograms.get(key)
+        if data is None:
+            data = registry.histograms[key] = [0] * len(DEFAULT_BUCKETS) + [0.0, 0]
+        if index < len(DEFAULT_BUCKETS):
+            data[index] += 1
+        data[-2] += value
+        data[-1] += 1
+
+
+@contextmanager
+def in_flight(name, **labels):
+    """Gauge of operations currently running, e.g. password hashes queued on the CPU"""
+    add_gauge(name, 1, **labels)
+    try:
+        yield
+    finally:
+        add_gauge(name, -1, **labels)
+
+
+def add_collector(collect):
+    """Register `collect(registry)`, called before every snapshot to refresh gauges"""
+    registry.collectors.append(collect)
+
+
+def metrics_dir():
+    return getattr(settings, 'METRICS_DIR', None)
+
+
+def _snapshot_name():
+    """This process' snapshot file name; a new token after a fork, as the pid changes too"""
+    global _identity
+    pid = os.getpid()
+    if _identity[0] != pid:
+        _identity = (pid, uuid.uuid4().hex[:12])
+        # An earlier process with this pid is gone, its snapshot must not be taken for ours
+        directory = metrics_dir()
+        if directory and os.path.isdir(directory):
+            _fold(directory, lambda other_pid, token: other_pid == pid and token != _identity[1])
+    return f'{pid}-{_identity[1]}.json'
+
+
+def _atomic_write(directory, name, data):
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, os.path.join(directory, name))
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def flush(force=False):
+    """Write this process' snapshot for the other workers' /metrics to read"""
+    directory = metrics_dir()
+    now = time.monotonic()
+    if not directory or (not force and now - registry.last_flush < FLUSH_INTERVAL):
+        return
+    registry.last_flush = now
+    os.makedirs(directory, exist_ok=True)
+    try:
+        _atomic_write(directory, _snapshot_name(), registry.snapshot())
+    except OSError:
+        pass
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _parse_name(name):
+    """(pid, token) of a snapshot file name, or None for other files"""
+    pid, _, token = name[:-5].partition('-') if name.endswith('.json') else ('', '', '')
+    return (int(pid), token) if pid.isdigit() and token else None
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (ValueError, OSError):
+        return None
+
+
+def _fold(directory, is_dead):
+    """
+    Add the counters and histograms of the snapshots `is_dead(pid, token)`
+    picks to the archive and delete them. Gauges die with their process.
+    The archive lists the files it has absorbed until they are gone, so a
+    crash between the two steps cannot count one twice.
+    """
+    with open(os.path.join(directory, '.fold.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        archive = _read(os.path.join(directory, ARCHIVE_FILE)) or {'counters': [], 'histograms': [], 'folded': []}
+        names = set(os.listdir(directory))
+        archive['folded'] = [name for name in archive['folded'] if name in names]
+        dead = [
+            name for name in sorted(names)
+            if (parsed := _parse_name(name)) and is_dead(*parsed)
+        ]
+        if not dead:
+            return
+        counters = {(n, tuple(map(tuple, l))): v for n, l, v in archive['counters']}
+        histograms = {(n, tuple(map(tuple, l))): v for n, l, v in archive['histograms']}
+        for name in dead:
+            snap = _read(os.path.join(directory, name))
+            if name in archive['folded'] or snap is None:
+                continue
+            _merge(snap, counters, histograms)
+            archive['folded'].append(name)
+        archive['counters'] = [[n, list(l), v] for (n, l), v in counters.items()]
+        archive['histograms'] = [[n, list(l), v] for (n, l), v in histograms.items()]
+        _atomic_write(directory, ARCHIVE_FILE, archive)
+        for name in dead:
+            try:
+                os.remove(os.path.join(directory, name))
+            except FileNotFoundError:
+                pass
+
+
+def _merge(snap, counters, histograms, gauges=None):
+    for name, labels, value in snap['counters']:
+        key = (name, tuple(tuple(p) for p in labels))
+        counters[key] = counters.get(key, 0) + value
+    if gauges is not None:
+        for name, labels, value in snap['gauges']:
+            key = (name, tuple(tuple(p) for p in labels))
+            gauges[key] = gauges.get(key, 0) + value
+    for name, labels, value in snap['histograms']:
+        key = (name, tuple(tuple(p) for p in labels))
+        merged = histograms.setdefault(key, [0] * len(value))
+        for i, v in enumerate(value):
+            merged[i] += v
+
+
+def _snapshots():
+    """(snapshot, alive) of every process, the dead ones folded into the archive"""
+    directory = metrics_dir()
+    if not directory:
+        yield registry.snapshot(), True
+        return
+    flush(force=True)
+    try:
+        _fold(directory, lambda pid, token: not _pid_alive(pid))
+    except OSError:
+        pass  # the unfolded snapshots are still read below
+    for name in os.listdir(directory):
+        parsed = _parse_name(name)
+        if name != ARCHIVE_FILE and not parsed:
+            continue
+        snap = _read(os.path.join(directory, name))
+        if snap is not None:
+            yield snap, parsed is not None and _pid_alive(parsed[0])
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = ('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+               for k, v in pairs)
+    return '{' + ','.join(escaped) + '}'
+
+
+def render():
+    """All processes' metrics merged into the Prometheus text exposition format"""
+    counters, gauges, histograms = {}, {}, {}
+    for snap, alive in _snapshots():
+        _merge(snap, counters, histograms, gauges if alive else None)
+
+    lines = []
+    seen = set()
+
+    def header(name, kind):
+        if name not in seen:
+            seen.add(name)
+            lines.append(f'# HELP {name} {_HELP.get(name, name)}')
+            lines.append(f'# TYPE {name} {_TYPES.get(name, kind)}')
+
+    for (name, labels), value in sorted(counters.items()):
+        header(name, 'counter')
+        lines.append(f'{name}{_format_labels(labels)} {value}')
+    for (name, labels), value in sorted(gauges.items()):
+        header(name, 'gauge')
+        lines.append(f'{name}{_format_labels(labels)} {value}')
+    for (name, labels), data in sorted(histograms.items()):
+        header(name, 'histogram')
+        cumulative = 0
+        for bound, count in zip(DEFAULT_BUCKETS, data[:-2]):
+            cumulative += count
+            lines.append(f'{name}_bucket{_format_labels(labels, [("le", bound)])} {cumulative}')
+        lines.append(f'{name}_bucket{_format_labels(labels, [("le", "+Inf")])} {data[-1]}')
+        lines.append(f'{name}_sum{_format_labels(labels)} {data[-2]}')
+        lines.append(f'{name}_count{_format_labels(labels)} {data[-1]}')
+    return '\n'.join(lines) + '\n'
+
+
+describe('http_requests_total', 'counter', 'Requests handled, by route, method and status')
+describe('http_request_errors_total', 'counter', 'Requests that raised or returned a 5xx, by route')
+describe('http_request_duration_seconds', 'histogram', 'Request latency by route')
+describe('db_pool_checked_out', 'gauge', 'SQLAlchemy pool connections currently checked out, by shard')
+describe('db_pool_overflow', 'gauge', 'SQLAlchemy pool connections open beyond pool_size, by shard')
+describe('db_pool_size', 'gauge', 'SQLAlchemy pool size, by shard')
+describe('db_pool_wait_seconds_total', 'counter', 'Time spent obtaining pool connections (queueing or connecting), by shard')
+describe('db_pool_checkouts_total', 'counter', 'Pool connections handed out, by shard')
+describe('cache_requests_total', 'counter', 'Cache lookups by cache and result (hit/miss)')
+describe('password_hash_in_flight', 'gauge', 'Password hash/verify operations currently running')
+
+
+def _collect_pool(reg):
+    from core import sharding, sqlalchemy_engine
+
+    engines = sharding.engines or {sharding.DEFAULT_SHARD: sqlalchemy_engine.engine}
+    for shard, engine in engines.items():
+        pool = engine.pool
+        labels = (('shard', shard),)
+        gauges = {'db_pool_checked_out': getattr(pool, 'checkedout', None),
+                  'db_pool_overflow': getattr(pool, 'overflow', None),
+                  'db_pool_size': getattr(pool, 'size', None)}
+        with reg.lock:
+            for name, read in gauges.items():
+                if callable(read):
+                    # QueuePool.overflow() counts up from -pool_size until the pool is full
+                    reg.gauges[(name, labels)] = max(0, read())
+            if hasattr(pool, 'checkouts_total'):
+                reg.counters[('db_pool_checkouts_total', labels)] = pool.checkouts_total
+                reg.counters[('db_pool_wait_seconds_total', labels)] = round(pool.wait_seconds_total, 6)
+
+
+add_collector(_collect_pool)
@@ -0,0 +1,138 @@
+import cProfile
+import logging
+import os
+import random
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from core import metrics, perf, query_detector
+
+logger = logging.getLogger(__name__)
+
+
+class PerformanceMiddleware:
+    """
+    Adds a Server-Timing header with query count, SQL time, serialization
+    time and the remaining view time of every request.
+
+    A request is also profiled, and its ORM hydration time reported apart, (cProfile, or pyinstrument when
+    PERF_PROFILER = 'pyinstrument' and it is installed) when it is picked by
+    PERF_PROFILE_SAMPLE_RATE or carries an `X-Profile` header. The header
+    must equal PERF_PROFILE_TOKEN, or is honoured only with DEBUG on when no
+    token is configured. Dumps go to PERF_PROFILE_DIR.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'PERF_PROFILE_SAMPLE_RATE', 0.0)
+        self.profile_token = getattr(settings, 'PERF_PROFILE_TOKEN', None)
+        self.profile_dir = getattr(
+            settings, 'PERF_PROFILE_DIR', os.path.join(settings.BASE_DIR, 'cache', 'profiles')
+        )
+        self.profiler = getattr(settings, 'PERF_PROFILER', 'cprofile')
+
+    def __call__(self, request):
+        profile = self._should_profile(request)
+        metrics, token = perf.start_request(detailed=profile)
+        try:
+            if profile:
+                response = self._profiled(request)
+            else:
+                response = self.get_response(request)
+        finally:
+            perf.end_request(token)
+
+        response['Server-Timing'] = perf.server_timing(metrics)
+        return response
+
+    def _should_profile(self, request):
+        header = request.headers.get('X-Profile')
+        if header:
+            if self.profile_token:
+                return header == self.profile_token
+            return settings.DEBUG
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def _dump_path(self, request, extension):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        name = request.path.strip('/').replace('/', '_') or 'root'
+        return os.path.join(self.profile_dir, f'{int(time.time() * 1000)}-{request.method}-{name}.{extension}')
+
+    def _profiled(self, request):
+        if self.profiler == 'pyinstrument':
+            try:
+                from pyinstrument import Profiler
+            except ImportError:
+                logger.warning('PERF_PROFILER is pyinstrument but it is not installed, using cProfile')
+            else:
+                profiler = Profiler()
+                profiler.start()
+                try:
+                    return self.get_response(request)
+                finally:
+                    profiler.stop()
+                    path = self._dump_path(request, 'html')
+                    with open(path, 'w') as f:
+                        f.write(profiler.output_html())
+                    logger.info('Wrote request profile %s', path)
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            return self.get_response(request)
+        finally:
+            profiler.disable()
+            path = self._dump_path(request, 'prof')
+            profiler.dump_stats(path)
+            logger.info('Wrote request profile %s', path)
+
+
+class MetricsMiddleware:
+    """
+    Records request count, 5xx errors and latency per route for /metrics
+    (see core/metrics.py) and periodically shares them with the other
+    worker processes.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        response = self.get_response(request)
+        elapsed = time.perf_counter() - started
+
+        match = request.resolver_match
+        route = '/' + match.route if match else 'unmatched'
+        view = match._func_path.rsplit('.', 1)[-1] if match else 'unmatched'
+        metrics.inc('http_requests_total', route=route, view=view, method=request.method,
+                    status=response.status_code)
+        if response.status_code >= 500:
+            metrics.inc('http_request_errors_total', route=route, view=view)
+        metrics.observe('http_request_duration_seconds', elapsed, route=route, view=view)
+        metrics.flush()
+        return response
+
+
+class QueryDetectorMiddleware:
+    """
+    Runs every request inside query_detector.detect() so N+1 patterns and
+    slow statements are logged (QUERY_DETECTOR_MODE = 'warn') or fail the
+    request with QueryProblem ('raise', used under `manage.py test`).
+    Removed from the stack entirely when the mode is 'off' or None.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.mode = getattr(settings, 'QUERY_DETECTOR_MODE', None)
+        if self.mode in (None, 'off'):
+            raise MiddlewareNotUsed()
+        self.repeat_threshold = getattr(settings, 'QUERY_DETECTOR_REPEAT_THRESHOLD', 5)
+        self.slow_ms = getattr(settings, 'QUERY_DETECTOR_SLOW_MS', 200)
+
+    def __call__(self, request):
+        label = f'{request.method} {request.path}'
+        with query_detector.detect(label, self.mode, self.repeat_threshold, self.slow_ms):
+            return self.get_response(request)
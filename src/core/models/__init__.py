@@ -1,5 +1,10 @@
 from .users import User
 from .parking_spot import ParkingSpot
+from .parking_spot_hours import ParkingSpotHours
 from .user_role import UserRole
+from .reservation import Reservation
+from .merch_metric import MerchMetric, MerchBatch
+from .change_counter import ChangeCounter
+from .job import Job
 
-__all__ = ["User", "ParkingSpot", "UserRole"]
\ No newline at end of file
+__all__ = ["User", "ParkingSpot", "ParkingSpotHours", "UserRole", "Reservation", "MerchMetric", "MerchBatch", "ChangeCounter", "Job"]
\ No newline at end of file
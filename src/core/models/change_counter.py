@@ -0,0 +1,85 @@
+import zlib
+
+from sqlalchemy import BigInteger, Column, Sequence, String, event, func, insert, select, text, update
+from core.sqlalchemy_engine import BaseModel
+
+# Counters handing out change sequence numbers, which readers must see in order (see head())
+CHANGE_COUNTERS = ('parking_spots',)
+# Counters handing out ids unique across shards, only ever allocated on the main database
+ID_COUNTERS = ('parking_spots.id', 'reservations.id')
+
+SEQUENCES = {
+    'parking_spots': Sequence('parking_spots_change_seq', metadata=BaseModel.metadata),
+    'parking_spots.id': Sequence('parking_spots_global_id_seq', metadata=BaseModel.metadata),
+    'reservations.id': Sequence('reservations_global_id_seq', metadata=BaseModel.metadata),
+}
+
+
+def _lock_key(name):
+    """Advisory lock key of a change counter"""
+    return zlib.crc32(f'change_counters.{name}'.encode())
+
+
+class ChangeCounter(BaseModel):
+    """
+    Named monotonic counters handing out change sequence numbers and
+    cross-shard ids.
+
+    On Postgres each counter is a sequence, so concurrent writers never
+    queue on a counter row. nextval() numbers can commit out of order,
+    though: writers of change numbers hold a shared advisory lock until
+    their transaction ends, and head() takes it exclusively for a moment,
+    so the head it returns has no number still in flight below it.
+
+    Elsewhere (SQLite) a counter is a row of this table, incremented inside
+    the writer's transaction; the database write lock already orders the
+    writers, and the committed value is the head. The rows are created
+    with the table (and by the migration), so allocating never has to
+    insert one.
+    """
+    __tablename__ = 'change_counters'
+
+    name = Column(String(50), primary_key=True)
+    value = Column(BigInteger, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"<ChangeCounter(name='{self.name}', value={self.value})>"
+
+    @classmethod
+    def allocate(cls, conn, name, count=1):
+        """`count` new numbers of counter `name` in ascending order, on connection `conn`"""
+        if conn.dialect.name == 'postgresql':
+            if name in CHANGE_COUNTERS:
+                conn.execute(select(func.pg_advisory_xact_lock_shared(_lock_key(name))))
+            return sorted(conn.execute(
+                select(SEQUENCES[name].next_value()).select_from(func.generate_series(1, count))
+            ).scalars())
+        table = cls.__table__
+        result = conn.execute(update(table).where(table.c.name == name).values(value=table.c.value + count))
+        if result.rowcount == 0:
+            raise LookupError(f'No change counter {name!r}; run the migrations')
+        last = conn.execute(select(table.c.value).where(table.c.name == name)).scalar()
+        return list(range(last - count + 1, last + 1))
+
+    @classmethod
+    def head(cls, conn, name):
+        """
+        Largest number of counter `name` such that every number up to it
+        is committed or rolled back, on connection `conn`
+        """
+        if conn.dialect.name == 'postgresql':
+            sequence = SEQUENCES[name].name
+            last, called = conn.execute(text(f'SELECT last_value, is_called FROM {sequence}')).one()
+            # Writers that drew a number up to `last` hold the shared lock until they end
+            key = _lock_key(name)
+            conn.execute(select(func.pg_advisory_lock(key)))
+            conn.execute(select(func.pg_advisory_unlock(key)))
+            return last if called else last - 1
+        table = cls.__table__
+        return conn.execute(select(table.c.value).where(table.c.name == name)).scalar() or 0
+
+
+@event.listens_for(ChangeCounter.__table__, 'after_create')
+def _create_counters(table, conn, **kw):
+    if conn.dialect.name != 'postgresql':
+        conn.execute(insert(table), [{'name': name, 'value': 0} for name in CHANGE_COUNTERS + ID_COUNTERS])
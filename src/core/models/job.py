@@ -0,0 +1,163 @@
+import json
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy import Column, DateTime, Index, Integer, String, Text, and_, select, update
+from core import sqlalchemy_engine
+from core.sqlalchemy_engine import session, BaseModel
+
+
+class Job(BaseModel):
+    """
+    A unit of background work in the durable queue (see core/jobs.py).
+
+    Workers claim queued jobs one at a time: SELECT ... FOR UPDATE SKIP
+    LOCKED on Postgres, so concurrent workers never wait on each other's
+    rows, and a conditional UPDATE (status still 'queued') elsewhere, which
+    SQLite's single writer makes race-free. A claimed job carries its
+    worker's name and a heartbeat in locked_at; jobs whose heartbeat stops
+    are handed out again. Ids are random, so they can double as the
+    capability to poll a job's status.
+    """
+    __tablename__ = 'jobs'
+
+    id = Column(String(32), primary_key=True, default=lambda: uuid.uuid4().hex)
+    kind = Column(String(100), nullable=False)
+    payload = Column(Text, nullable=False, default='{}')  # JSON keyword arguments for the task
+    status = Column(String(20), nullable=False, default='queued')  # queued, running, succeeded, failed
+    priority = Column(Integer, nullable=False, default=0)  # higher runs first
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=3)
+    run_after = Column(DateTime, nullable=False, default=datetime.utcnow)
+    locked_by = Column(String(100))
+    locked_at = Column(DateTime)
+    result = Column(Text)  # JSON return value of the task
+    error = Column(Text)  # last failure
+    created_by = Column(Integer)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+
+    __table_args__ = (
+        # Claims scan queued jobs that are due, best first
+        Index('ix_jobs_claim', 'status', 'run_after', 'priority'),
+        Index('ix_jobs_kind_status', 'kind', 'status'),
+    )
+
+    def __repr__(self):
+        return f"<Job(id='{self.id}', kind='{self.kind}', status='{self.status}', attempts={self.attempts})>"
+
+    @classmethod
+    def enqueue(cls, kind, payload=None, delay=None, priority=0, max_attempts=3, created_by=None):
+        """Queue `kind` with JSON-serialisable `payload`; committed straight away"""
+        job = cls(
+            kind=kind, payload=json.dumps(payload or {}), priority=priority, max_attempts=max_attempts,
+            run_after=datetime.utcnow() + (delay or timedelta()), created_by=created_by,
+        )
+        session.add(job)
+        session.commit()
+        return job
+
+    @classmethod
+    def get_by_id(cls, job_id):
+        return session.query(cls).filter_by(id=job_id).first()
+
+    @classmethod
+    def claim(cls, worker, kinds):
+        """
+        Mark the best due job of one of `kinds` as running for `worker` and
+        return (id, kind, payload, attempts, max_attempts), or None when
+        nothing is due. Uses its own short transaction.
+        """
+        if not kinds:
+            return None
+        table = cls.__table__
+        now = datetime.utcnow()
+        due = select(table.c.id).where(
+            table.c.status == 'queued', table.c.run_after <= now, table.c.kind.in_(list(kinds))
+        ).order_by(table.c.priority.desc(), table.c.run_after).limit(1)
+        engine = sqlalchemy_engine.engine
+        postgres = engine.dialect.name == 'postgresql'
+        # Elsewhere another worker can win the race for a candidate; try the next one
+        for _ in range(1 if postgres else 5):
+            with engine.begin() as conn:
+                job_id = conn.execute(due.with_for_update(skip_locked=True) if postgres else due).scalar()
+                if job_id is None:
+                    return None
+                claimed = conn.execute(
+                    update(table).where(table.c.id == job_id, table.c.status == 'queued').values(
+                        status='running', locked_by=worker, locked_at=now, started_at=now,
+                        attempts=table.c.attempts + 1,
+                    )
+                ).rowcount
+                if claimed:
+                    row = conn.execute(select(
+                        table.c.id, table.c.kind, table.c.payload, table.c.attempts, table.c.max_attempts,
+                    ).where(table.c.id == job_id)).first()
+                    return row.id, row.kind, json.loads(row.payload), row.attempts, row.max_attempts
+        return None
+
+    @classmethod
+    def _finish(cls, job_id, worker, **values):
+        table = cls.__table__
+        with sqlalchemy_engine.engine.begin() as conn:
+            # A job handed to another worker after a lost heartbeat is no longer ours to finish
+            return conn.execute(update(table).where(
+                table.c.id == job_id, table.c.status == 'running', table.c.locked_by == worker
+            ).values(locked_by=None, locked_at=None, **values)).rowcount
+
+    @classmethod
+    def succeed(cls, job_id, worker, result=None):
+        return cls._finish(job_id, worker, status='succeeded', result=json.dumps(result),
+                           error=None, finished_at=datetime.utcnow())
+
+    @classmethod
+    def fail(cls, job_id, worker, error, retry_in=None):
+        """Requeue after `retry_in` (a timedelta), or fail for good when it is None"""
+        now = datetime.utcnow()
+        if retry_in is None:
+            return cls._finish(job_id, worker, status='failed', error=error, finished_at=now)
+        return cls._finish(job_id, worker, status='queued', error=error, run_after=now + retry_in)
+
+    @classmethod
+    def heartbeat(cls, job_ids, worker):
+        if not job_ids:
+            return
+        table = cls.__table__
+        with sqlalchemy_engine.engine.begin() as conn:
+            conn.execute(update(table).where(
+                table.c.id.in_(list(job_ids)), table.c.locked_by == worker
+            ).values(locked_at=datetime.utcnow()))
+
+    @classmethod
+    def release_stale(cls, timeout):
+        """Requeue running jobs without a heartbeat for `timeout` (failing those out of attempts)"""
+        table = cls.__table__
+        cutoff = datetime.utcnow() - timeout
+        stale = and_(table.c.status == 'running', table.c.locked_at < cutoff)
+        with sqlalchemy_engine.engine.begin() as conn:
+            failed = conn.execute(update(table).where(stale, table.c.attempts >= table.c.max_attempts).values(
+                status='failed', error='Worker stopped responding', locked_by=None, locked_at=None,
+                finished_at=datetime.utcnow(),
+            )).rowcount
+            requeued = conn.execute(update(table).where(stale).values(
+                status='queued', error='Worker stopped responding', locked_by=None, locked_at=None,
+            )).rowcount
+        return requeued, failed
+
+    def to_dict(self):
+        def timestamp(value):
+            return value.isoformat() + 'Z' if value else None
+
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'attempts': self.attempts,
+            'max_attempts': self.max_attempts,
+            'result': json.loads(self.result) if self.result else None,
+            'error': self.error,
+            'created_at': timestamp(self.created_at),
+            'run_after': timestamp(self.run_after) if self.status == 'queued' else None,
+            'started_at': timestamp(self.started_at),
+            'finished_at': timestamp(self.finished_at),
+        }
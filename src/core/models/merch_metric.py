@@ -0,0 +1,123 @@
+# models/merch_metric.py
+from datetime import datetime
+from sqlalchemy import BigInteger, Boolean, Column, DateTime, Float, Integer, String, func, or_
+from sqlalchemy.dialects import postgresql, sqlite
+from core.sqlalchemy_engine import session, BaseModel
+from core.merch_metrics import MetricsAccumulator
+
+
+_ADDITIVE_COLUMNS = ('gmv_sum', 'units_sum', 'refunds_sum', 'rating_sum', 'rating_count', 'returns_sum')
+
+
+def _upsert(values):
+    """INSERT ... ON CONFLICT (asin) DO UPDATE that adds the batch totals to the stored ones"""
+    dialect = session.get_bind().dialect.name
+    insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+    table = MerchMetric.__table__
+    stmt = insert(table).values(values)
+    updates = {name: table.c[name] + stmt.excluded[name] for name in _ADDITIVE_COLUMNS}
+    updates['has_sales'] = or_(table.c.has_sales, stmt.excluded.has_sales)
+    updates['product_name'] = func.coalesce(stmt.excluded.product_name, table.c.product_name)
+    updates['updated_at'] = stmt.excluded.updated_at
+    return stmt.on_conflict_do_update(index_elements=[table.c.asin], set_=updates)
+
+
+class MerchMetric(BaseModel):
+    """
+    Running per-ASIN totals behind the merch dashboard.
+
+    Only sums and counts are stored, so a weekly batch is applied by adding
+    its own totals (see `ingest`) and the dashboard is rebuilt from one row
+    per ASIN instead of from the full sales/reviews/returns history.
+    """
+    __tablename__ = 'merch_metrics'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    asin = Column(String(32), nullable=False, unique=True)
+    product_name = Column(String(255))
+    has_sales = Column(Boolean, nullable=False, default=False)  # Dashboard only lists ASINs with sales
+    gmv_sum = Column(Float, nullable=False, default=0)
+    units_sum = Column(BigInteger, nullable=False, default=0)
+    refunds_sum = Column(BigInteger, nullable=False, default=0)
+    rating_sum = Column(Float, nullable=False, default=0)
+    rating_count = Column(BigInteger, nullable=False, default=0)
+    returns_sum = Column(Float, nullable=False, default=0)
+
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    @classmethod
+    def ingest(cls, accumulator, product_names=None, batch_id=None, chunk_size=1000):
+        """
+        Add one batch of sales/reviews/returns totals to the store.
+
+        `accumulator` holds only the new batch, so the cost is proportional
+        to the batch. With a `batch_id` the batch is recorded and ingesting it
+        again is skipped. Returns the number of ASINs touched, or None when
+        skipped.
+        """
+        product_names = product_names or {}
+        if batch_id and MerchBatch.exists(batch_id):
+            cls.logger.info('Merch batch %s already ingested, skipping', batch_id)
+            return None
+
+        now = datetime.utcnow()
+        asins = set(accumulator.sales) | set(accumulator.reviews) | set(accumulator.returns)
+        values = []
+        for asin in sorted(asins):
+            gmv, units, refunds = accumulator.sales.get(asin, (0, 0, 0))
+            rating_sum, rating_count = accumulator.reviews.get(asin, (0, 0))
+            values.append({
+                'asin': asin,
+                'product_name': product_names.get(asin),
+                'has_sales': asin in accumulator.sales,
+                'gmv_sum': gmv,
+                'units_sum': units,
+                'refunds_sum': refunds,
+                'rating_sum': rating_sum,
+                'rating_count': rating_count,
+                'returns_sum': accumulator.returns.get(asin, 0),
+                'created_at': now,
+                'updated_at': now,
+            })
+
+        try:
+            for start in range(0, len(values), chunk_size):
+                session.execute(_upsert(values[start:start + chunk_size]))
+            if batch_id:
+                session.add(MerchBatch(batch_id=batch_id, product_count=len(values)))
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        return len(values)
+
+    @classmethod
+    def load_accumulator(cls):
+        """Rebuild a MetricsAccumulator (plus product names) from the stored totals"""
+        accumulator = MetricsAccumulator()
+        product_names = {}
+        for m in session.query(cls).all():
+            if m.has_sales:
+                accumulator.sales[m.asin] = [m.gmv_sum, m.units_sum, m.refunds_sum]
+            if m.rating_count or m.rating_sum:
+                accumulator.reviews[m.asin] = [m.rating_sum, m.rating_count]
+            if m.returns_sum:
+                accumulator.returns[m.asin] = m.returns_sum
+            if m.product_name:
+                product_names[m.asin] = m.product_name
+        return accumulator, product_names
+
+
+class MerchBatch(BaseModel):
+    """Batches already applied to MerchMetric, so re-running an ingest is a no-op"""
+    __tablename__ = 'merch_batches'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    batch_id = Column(String(255), nullable=False, unique=True)
+    product_count = Column(Integer)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    @staticmethod
+    def exists(batch_id):
+        return session.query(MerchBatch).filter_by(batch_id=batch_id).first() is not None
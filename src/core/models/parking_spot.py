@@ -1,9 +1,39 @@
 # models/parking_spot.py
 from datetime import datetime
-from sqlalchemy import Column, DateTime, Integer, String, Float, Text, Boolean
+from sqlalchemy import BigInteger, Column, DateTime, Integer, String, Float, Text, Boolean, Index, and_, case, event, func, literal, literal_column, or_, true
+from sqlalchemy.orm import Session
 from core.sqlalchemy_engine import BaseModel
 from core.sqlalchemy_engine import session, BaseModel
 import json
+import logging
+import math
+
+from core import opening_hours, sharding, sqlalchemy_engine
+from core.models.change_counter import ChangeCounter
+from core.models.parking_spot_hours import ParkingSpotHours
+
+logger = logging.getLogger(__name__)
+
+KM_PER_DEGREE = 6371 * math.pi / 180
+# Slack on the SQL distance bound for floating-point rounding; the exact haversine filter follows
+DISTANCE_PAD = 1.001
+
+# Upper bounds of the price facet buckets (₹/hr); anything above the last one is "200+"
+PRICE_BUCKETS = (25, 50, 100, 200)
+
+# Text the typeahead search matches (see core/spot_text.py); the trigram indexes are built on exactly these
+NAME_TEXT_SQL = "lower(coalesce(title, '') || ' ' || coalesce(location, ''))"
+DESCRIPTION_TEXT_SQL = "lower(coalesce(description, ''))"
+
+# Smallest to largest, a spot fits every vehicle up to its max_vehicle_size
+VEHICLE_SIZES = ('bike', 'car', 'suv', 'truck')
+
+
+def price_bucket_label(index):
+    if index >= len(PRICE_BUCKETS):
+        return f'{PRICE_BUCKETS[-1]}+'
+    low = PRICE_BUCKETS[index - 1] if index else 0
+    return f'{low}-{PRICE_BUCKETS[index]}'
 
 class ParkingSpot(BaseModel):
     __tablename__ = 'parking_spots'
@@ -32,6 +62,17 @@ class ParkingSpot(BaseModel):
     updated_by = Column(Integer)
     
     is_active = Column(Boolean, nullable=False, default=True)
+    change_seq = Column(BigInteger, nullable=False, default=0)  # 🔁 Bumped on every write, see /api/parking-spots/changes/
+
+    # Nearby search narrows on the bounding box, each facet filter on its own column plus price
+    __table_args__ = (
+        Index('ix_parking_spots_search_geo', 'is_active', 'is_available', 'latitude', 'longitude'),
+        Index('ix_parking_spots_search_type', 'is_active', 'is_available', 'parking_type', 'price_per_hour'),
+        Index('ix_parking_spots_search_size', 'is_active', 'is_available', 'max_vehicle_size', 'price_per_hour'),
+        Index('ix_parking_spots_updated_at', 'updated_at'),
+        # Delta sync and the in-memory spot indexes read rows in change order
+        Index('ix_parking_spots_change_seq', 'change_seq'),
+    )
 
     @classmethod
     def add(cls, data):
@@ -73,10 +114,22 @@ class ParkingSpot(BaseModel):
             data['images'] = json.dumps(data['images'])
 
         parking_spot.fill(**data)
+        session.add(parking_spot)
+        session.flush()  # assigns the id the hours rows point at
+        ParkingSpotHours.set_for_spot(parking_spot.id, ParkingSpot.parse_hours(data['availability_hours']))
         parking_spot.save()
         
         return parking_spot
 
+    @staticmethod
+    def parse_hours(text):
+        """Weekly intervals for availability_hours, none (never matches open filters) if unrecognised"""
+        try:
+            return opening_hours.parse_hours(text)
+        except opening_hours.HoursParseError as e:
+            logger.info('Unrecognised availability_hours %r: %s', text, e)
+            return []
+
     @staticmethod
     def get_by_id(spot_id):
         """Get parking spot by ID"""
@@ -112,6 +165,201 @@ class ParkingSpot(BaseModel):
             ParkingSpot.is_active == True
         ).limit(limit).all()
 
+    @staticmethod
+    def _nearby_clauses(latitude, longitude, radius_km, open_window=None, free_window=None):
+        """
+        Available spots inside the radius, open for the whole of
+        `open_window` (spot-local start, end) and without a reservation in
+        `free_window` (UTC start, end) when given. The bounding box lets the
+        geo index do the narrowing, the equirectangular distance (plain
+        arithmetic, so it runs on SQLite too) trims its corners. Both are
+        loose: every spot within the haversine radius passes, a few just
+        outside may too, and callers needing the exact radius filter again.
+        """
+        lat_delta, lng_delta, lng_scale = ParkingSpot._bounding_box(latitude, radius_km)
+        bound = lat_delta * DISTANCE_PAD
+        clauses = [
+            ParkingSpot.is_active == True,
+            ParkingSpot.is_available == 'yes',
+            ParkingSpot.latitude.between(latitude - lat_delta, latitude + lat_delta),
+            ParkingSpot.longitude.between(longitude - lng_delta, longitude + lng_delta),
+            ParkingSpot._distance_sq(latitude, longitude, lng_scale) <= bound * bound,
+        ]
+        if open_window:
+            clauses += ParkingSpotHours.open_clauses(ParkingSpot.id, *open_window)
+        if free_window:
+            from core.models.reservation import Reservation
+            clauses.append(Reservation.free_clause(ParkingSpot.id, *free_window))
+        return clauses
+
+    @staticmethod
+    def _bounding_box(latitude, radius_km):
+        """
+        (lat_delta, lng_delta, lng_scale) in degrees around a centre at
+        `latitude`. Longitude degrees shrink towards the pole, so the box and
+        the trimming distance scale longitude by the cosine of the radius'
+        poleward edge, not of the centre: a spot poleward of the centre is
+        never judged further away than it is. Past a pole every longitude is
+        in range.
+        """
+        lat_delta = radius_km / KM_PER_DEGREE
+        poleward = abs(latitude) + lat_delta
+        if poleward >= 90:
+            return lat_delta, 180.0, 0.0
+        lng_scale = math.cos(math.radians(poleward))
+        return lat_delta, lat_delta / lng_scale, lng_scale
+
+    @staticmethod
+    def _distance_sq(latitude, longitude, lng_scale=None):
+        """
+        Squared equirectangular distance in degrees of latitude, good enough
+        to rank and, with the poleward `lng_scale` of _bounding_box(), to trim
+        """
+        if lng_scale is None:
+            lng_scale = max(math.cos(math.radians(latitude)), 0.01)
+        dlat = ParkingSpot.latitude - latitude
+        dlng = (ParkingSpot.longitude - longitude) * lng_scale
+        return dlat * dlat + dlng * dlng
+
+    @staticmethod
+    def _facet_clauses(min_price=None, max_price=None, parking_types=None, vehicle_sizes=None):
+        """facet name -> SQL condition for the filters that are set"""
+        clauses = {}
+        if parking_types:
+            clauses['parking_type'] = ParkingSpot.parking_type.in_(parking_types)
+        if vehicle_sizes:
+            clauses['max_vehicle_size'] = ParkingSpot.max_vehicle_size.in_(vehicle_sizes)
+        price = []
+        if min_price is not None:
+            price.append(ParkingSpot.price_per_hour >= min_price)
+        if max_price is not None:
+            price.append(ParkingSpot.price_per_hour <= max_price)
+        if price:
+            clauses['price'] = and_(*price)
+        return clauses
+
+    @staticmethod
+    def bookable_among(spot_ids, open_window=None, free_window=None):
+        """{id: spot} for those of `spot_ids` that are bookable now (and open / unreserved for the windows)"""
+        clauses = [ParkingSpot.id.in_(spot_ids), ParkingSpot.is_active == True, ParkingSpot.is_available == 'yes']
+        if open_window:
+            clauses += ParkingSpotHours.open_clauses(ParkingSpot.id, *open_window)
+        if free_window:
+            from core.models.reservation import Reservation
+            clauses.append(Reservation.free_clause(ParkingSpot.id, *free_window))
+        return {spot.id: spot for spot in session.query(ParkingSpot).filter(*clauses)}
+
+    @staticmethod
+    def search(latitude, longitude, radius_km, min_price=None, max_price=None,
+               parking_types=None, vehicle_sizes=None, open_window=None, free_window=None, limit=50):
+        """Closest available spots within the radius matching every filter, nearest first"""
+        clauses = ParkingSpot._nearby_clauses(latitude, longitude, radius_km, open_window, free_window)
+        clauses += ParkingSpot._facet_clauses(min_price, max_price, parking_types, vehicle_sizes).values()
+        query = session.query(ParkingSpot).filter(*clauses).order_by(
+            ParkingSpot._distance_sq(latitude, longitude)
+        ).limit(limit)
+        spots = sharding.in_shards(query, ParkingSpot._shards_within(latitude, longitude, radius_km)).all()
+        if len(spots) > limit:
+            # Several shards answered: each sent its nearest `limit`, keep the overall nearest
+            lng_scale = max(math.cos(math.radians(latitude)), 0.01)
+            spots.sort(key=lambda s: (s.latitude - latitude) ** 2 + ((s.longitude - longitude) * lng_scale) ** 2)
+            spots = spots[:limit]
+        return spots
+
+    @staticmethod
+    def text_search(query, limit=10, latitude=None, longitude=None, distance_scale_km=10.0):
+        """
+        Postgres typeahead: [(spot, score)] best first for bookable spots whose
+        title/location (weighted 3x) or description has words close to
+        `query`, by pg_trgm word similarity. Partial words match, so does a
+        typo or two. The trigram GIN indexes serve the `<%` filter. With a
+        position the score is divided by 1 + distance / distance_scale_km.
+        """
+        text = query.lower()
+        name, description = literal_column(NAME_TEXT_SQL), literal_column(DESCRIPTION_TEXT_SQL)
+        score = 3 * func.word_similarity(text, name) + func.word_similarity(text, description)
+        if latitude is not None and longitude is not None:
+            distance_km = func.sqrt(ParkingSpot._distance_sq(latitude, longitude)) * KM_PER_DEGREE
+            score = score / (1 + distance_km / distance_scale_km)
+        score = score.label('score')
+        rows = session.query(ParkingSpot, score).filter(
+            ParkingSpot.is_active == True,
+            ParkingSpot.is_available == 'yes',
+            or_(literal(text).op('<%')(name), literal(text).op('<%')(description)),
+        ).order_by(score.desc(), ParkingSpot.id).limit(limit).all()
+        # Each shard sent its best `limit`
+        rows.sort(key=lambda row: (-row.score, row[0].id))
+        return [(spot, float(s)) for spot, s in rows[:limit]]
+
+    @staticmethod
+    def _shards_within(latitude, longitude, radius_km):
+        """Shards whose regions overlap the search radius' bounding box"""
+        lat_delta, lng_delta, _ = ParkingSpot._bounding_box(latitude, radius_km)
+        return sharding.shard_map.shards_for_box(
+            latitude - lat_delta, longitude - lng_delta, latitude + lat_delta, longitude + lng_delta
+        )
+
+    @staticmethod
+    def facet_counts(latitude, longitude, radius_km, min_price=None, max_price=None,
+                     parking_types=None, vehicle_sizes=None, open_window=None, free_window=None):
+        """
+        Spot counts per parking type, vehicle size and price bucket within the
+        radius, from one GROUP BY query. Each facet is counted with the other
+        facets' filters applied but not its own, so unselected options still
+        show how many spots choosing them would add.
+
+        The counts match the haversine radius the results are filtered by:
+        spots surely inside it (the equirectangular distance scaled by the
+        equatorward edge overstates the true one) are counted in the groups,
+        the few near its edge come back one per group and are checked here.
+        """
+        from core.spot_text import haversine_km
+        facets = ParkingSpot._facet_clauses(min_price, max_price, parking_types, vehicle_sizes)
+        bucket = case(
+            *[(func.coalesce(ParkingSpot.price_per_hour, 0) <= bound, i) for i, bound in enumerate(PRICE_BUCKETS)],
+            else_=len(PRICE_BUCKETS),
+        )
+        price_ok = case((facets.get('price', true()), 1), else_=0)
+        lat_delta = radius_km / KM_PER_DEGREE
+        inner = lat_delta / DISTANCE_PAD
+        equatorward = math.cos(math.radians(max(abs(latitude) - lat_delta, 0)))
+        edge = case((ParkingSpot._distance_sq(latitude, longitude, equatorward) <= inner * inner, 0),
+                    else_=ParkingSpot.id)
+        query = session.query(
+            ParkingSpot.parking_type, ParkingSpot.max_vehicle_size, bucket, edge,
+            func.min(ParkingSpot.latitude), func.min(ParkingSpot.longitude), func.count(), func.sum(price_ok),
+        ).filter(*ParkingSpot._nearby_clauses(latitude, longitude, radius_km, open_window, free_window)).group_by(
+            ParkingSpot.parking_type, ParkingSpot.max_vehicle_size, bucket, edge
+        )
+        # With several shards the same group can come back once per shard; the sums below add them up
+        rows = [
+            (parking_type, size, bucket_index, count, price_count)
+            for parking_type, size, bucket_index, edge_id, lat, lng, count, price_count
+            in sharding.in_shards(query, ParkingSpot._shards_within(latitude, longitude, radius_km)).all()
+            if not edge_id or haversine_km(latitude, longitude, lat, lng) <= radius_km
+        ]
+
+        type_ok = lambda value: not parking_types or value in parking_types
+        size_ok = lambda value: not vehicle_sizes or value in vehicle_sizes
+        counts = {'parking_type': {}, 'max_vehicle_size': {}, 'price': {}}
+        total = 0
+        for parking_type, size, bucket_index, count, price_count in rows:
+            price_count = int(price_count or 0)
+            if size_ok(size):
+                counts['parking_type'][parking_type] = counts['parking_type'].get(parking_type, 0) + price_count
+            if type_ok(parking_type):
+                counts['max_vehicle_size'][size] = counts['max_vehicle_size'].get(size, 0) + price_count
+            if type_ok(parking_type) and size_ok(size):
+                label = price_bucket_label(bucket_index)
+                counts['price'][label] = counts['price'].get(label, 0) + count
+                total += price_count
+        counts['price'] = {
+            price_bucket_label(i): counts['price'].get(price_bucket_label(i), 0)
+            for i in range(len(PRICE_BUCKETS) + 1)
+        }
+        counts['total'] = total
+        return counts
+
     @staticmethod
     def update_availability(spot_id, is_available):
         """Update spot availability"""
@@ -126,16 +374,16 @@ class ParkingSpot(BaseModel):
     @staticmethod
     def get_stats_by_owner(owner_id):
         """Get parking spots statistics for owner"""
-        total_spots = session.query(ParkingSpot).filter_by(
+        total_spots = sharding.count(session.query(ParkingSpot).filter_by(
             owner_id=owner_id,
             is_active=True
-        ).count()
+        ))
         
-        available_spots = session.query(ParkingSpot).filter_by(
+        available_spots = sharding.count(session.query(ParkingSpot).filter_by(
             owner_id=owner_id,
             is_available='yes',
             is_active=True
-        ).count()
+        ))
         
         return {
             'total_spots': total_spots,
@@ -143,6 +391,31 @@ class ParkingSpot(BaseModel):
             'occupied_spots': total_spots - available_spots
         }
 
+    @staticmethod
+    def head_seq(conn):
+        """change_seq up to which every write to a spot on `conn`'s database is settled"""
+        return ChangeCounter.head(conn, ParkingSpot.__tablename__)
+
+    @staticmethod
+    def head_seqs():
+        """{shard id: head_seq() there}"""
+        heads = {}
+        for shard, engine in (sharding.engines or {sharding.DEFAULT_SHARD: sqlalchemy_engine.engine}).items():
+            with engine.connect() as conn:
+                heads[shard] = ParkingSpot.head_seq(conn)
+        return heads
+
+    @staticmethod
+    def changes_since(change_seq, limit=500, shard=sharding.DEFAULT_SHARD, until=None):
+        """
+        Spots of a shard written after `change_seq` (and up to the head
+        `until`), in change order, active or not
+        """
+        query = session.query(ParkingSpot).filter(ParkingSpot.change_seq > change_seq)
+        if until is not None:
+            query = query.filter(ParkingSpot.change_seq <= until)
+        return sharding.on_shard(query.order_by(ParkingSpot.change_seq).limit(limit), shard).all()
+
     def update_spot(self, data):
         """Update parking spot details"""
         # Convert data types if needed
@@ -159,8 +432,16 @@ class ParkingSpot(BaseModel):
         if 'images' in data and isinstance(data['images'], list):
             data['images'] = json.dumps(data['images'])
             
+        if sharding.enabled() and ('latitude' in data or 'longitude' in data):
+            moved_to = sharding.shard_map.shard_for(data.get('latitude', self.latitude),
+                                                    data.get('longitude', self.longitude))
+            if moved_to != sharding.spot_shard(self.id, session()):
+                raise ValueError('A parking spot cannot be moved into another region')
+
         data['updated_at'] = datetime.utcnow()
         self.fill(**data)
+        if 'availability_hours' in data:
+            ParkingSpotHours.set_for_spot(self.id, ParkingSpot.parse_hours(data['availability_hours']))
         self.save()
         return self
 
@@ -198,6 +479,24 @@ class ParkingSpot(BaseModel):
         return f"<ParkingSpot(id={self.id}, title='{self.title}', owner_id={self.owner_id})>"
 
 
+@event.listens_for(Session, 'before_flush')
+def _assign_change_seq(db_session, flush_context, instances):
+    """Give every spot inserted or modified by this flush a new change_seq"""
+    written = [obj for obj in db_session.new if isinstance(obj, ParkingSpot)]
+    written += [
+        obj for obj in db_session.dirty
+        if isinstance(obj, ParkingSpot) and db_session.is_modified(obj, include_collections=False)
+    ]
+    # Each shard numbers its own spots, on the connection that writes them
+    by_connection = {}
+    for spot in written:
+        conn = sharding.connection_for(db_session, ParkingSpot.__mapper__, spot)
+        by_connection.setdefault(conn, []).append(spot)
+    for conn, spots in by_connection.items():
+        for spot, seq in zip(spots, ChangeCounter.allocate(conn, ParkingSpot.__tablename__, len(spots))):
+            spot.change_seq = seq
+
+
 # # Usage Examples following your pattern:
 
 # def create_parking_spot_example():
@@ -0,0 +1,51 @@
+from sqlalchemy import Column, Index, Integer, and_, select
+from core.sqlalchemy_engine import session, BaseModel
+from core import opening_hours, sharding
+
+
+class ParkingSpotHours(BaseModel):
+    """
+    Weekly opening intervals of a parking spot, parsed from its
+    availability_hours (see core/opening_hours.py). Minutes since Monday
+    00:00 in spot-local time.
+    """
+    __tablename__ = 'parking_spot_hours'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    spot_id = Column(Integer, nullable=False)
+    opens_at = Column(Integer, nullable=False)
+    closes_at = Column(Integer, nullable=False)
+
+    __table_args__ = (
+        Index('ix_parking_spot_hours_spot', 'spot_id', 'opens_at', 'closes_at'),
+        Index('ix_parking_spot_hours_window', 'opens_at', 'closes_at', 'spot_id'),
+    )
+
+    def __repr__(self):
+        return f"<ParkingSpotHours(spot_id={self.spot_id}, {self.opens_at}-{self.closes_at})>"
+
+    @classmethod
+    def set_for_spot(cls, spot_id, intervals):
+        """Replace a spot's intervals; committed with the caller's save()"""
+        shard = sharding.spot_shard(spot_id, session())
+        sharding.on_shard(session.query(cls).filter_by(spot_id=spot_id), shard).delete(synchronize_session=False)
+        session.add_all(cls(spot_id=spot_id, opens_at=a, closes_at=b) for a, b in intervals)
+
+    @classmethod
+    def open_clauses(cls, spot_id_column, start, end):
+        """
+        Conditions on `spot_id_column` that hold when the spot is open for
+        the whole of [start, end), one indexed range lookup per week piece.
+        """
+        return [
+            spot_id_column.in_(
+                select(cls.spot_id).where(and_(cls.opens_at <= a, cls.closes_at >= b))
+            )
+            for a, b in opening_hours.window_pieces(start, end)
+        ]
+
+    @classmethod
+    def backfill(cls, conn, batch_size=5000, after_id=0):
+        """Rebuild intervals from availability_hours; returns (parsed, unparseable spot ids)"""
+        from core.models.parking_spot import ParkingSpot
+        return opening_hours.backfill(conn, ParkingSpot.__table__, cls.__table__, batch_size, after_id)
@@ -0,0 +1,187 @@
+from datetime import datetime, timedelta
+from sqlalchemy import CheckConstraint, Column, DateTime, Index, Integer, String, and_, exists, select, update
+from sqlalchemy.exc import IntegrityError
+from core import sharding
+from core.sqlalchemy_engine import session, BaseModel
+from core.models.parking_spot import ParkingSpot
+from core.models.parking_spot_hours import ParkingSpotHours
+
+# Longest bookable slot. Bounding it turns "any reservation overlapping [t1, t2)"
+# into an index range scan over starts_at in (t1 - MAX_DURATION, t2).
+MAX_DURATION = timedelta(days=7)
+# The Postgres exclusion constraint keeping confirmed reservations of a spot apart (see the migration)
+OVERLAP_CONSTRAINT = 'reservations_no_overlap'
+
+
+class ReservationConflict(Exception):
+    """The slot overlaps a confirmed reservation, or the spot cannot be booked for it"""
+
+
+class Reservation(BaseModel):
+    """
+    A time-slotted booking of a parking spot. Times are naive UTC.
+
+    Confirmed reservations of one spot never overlap: bookings serialize on
+    the spot row (SELECT ... FOR UPDATE on Postgres, the database write lock
+    on SQLite), and on Postgres an exclusion constraint backs this up.
+    Because they are disjoint, the only confirmed reservation that can
+    overlap [starts_at, ends_at) is the last one starting before ends_at,
+    a single descending seek on ix_reservations_spot_start.
+    """
+    __tablename__ = 'reservations'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    spot_id = Column(Integer, nullable=False)
+    user_id = Column(Integer, nullable=False)
+    starts_at = Column(DateTime, nullable=False)
+    ends_at = Column(DateTime, nullable=False)
+    status = Column(String(20), nullable=False, default='confirmed')  # confirmed, cancelled
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        Index('ix_reservations_spot_start', 'spot_id', 'status', 'starts_at', 'ends_at'),
+        Index('ix_reservations_user', 'user_id', 'starts_at'),
+        CheckConstraint('ends_at > starts_at', name='ck_reservations_positive_duration'),
+    )
+
+    def __repr__(self):
+        return f"<Reservation(id={self.id}, spot_id={self.spot_id}, {self.starts_at}-{self.ends_at}, {self.status})>"
+
+    @staticmethod
+    def _lock_spot(spot_id, shard=sharding.DEFAULT_SHARD, bookable=True):
+        """
+        Serialize bookings of one spot for the rest of the transaction; None
+        if it is not bookable (deleted, or marked unavailable by its owner).
+        With bookable=False any active spot is locked, for cancelling.
+        """
+        clauses = [ParkingSpot.id == spot_id, ParkingSpot.is_active == True]
+        if bookable:
+            clauses.append(ParkingSpot.is_available == 'yes')
+        engine = sharding.engines.get(shard) or session.get_bind()
+        if engine.dialect.name == 'postgresql':
+            return sharding.on_shard(session.query(ParkingSpot.id).filter(*clauses).with_for_update(), shard).first()
+        # SQLite has no row locks; a no-op UPDATE takes the database write lock up front instead.
+        # Setting updated_at to itself keeps its onupdate default from firing.
+        result = session.execute(sharding.on_shard(
+            update(ParkingSpot).where(*clauses)
+            .values(updated_at=ParkingSpot.updated_at).execution_options(synchronize_session=False),
+            shard,
+        ))
+        return result.rowcount or None
+
+    @classmethod
+    def find_conflict(cls, spot_id, starts_at, ends_at, shard=sharding.DEFAULT_SHARD):
+        """The confirmed reservation overlapping [starts_at, ends_at), if any"""
+        previous = sharding.on_shard(session.query(cls).filter(
+            cls.spot_id == spot_id, cls.status == 'confirmed', cls.starts_at < ends_at
+        ).order_by(cls.starts_at.desc()), shard).first()
+        return previous if previous and previous.ends_at > starts_at else None
+
+    @classmethod
+    def book(cls, spot_id, user_id, starts_at, ends_at, open_window=None):
+        """
+        Reserve [starts_at, ends_at) or raise ReservationConflict; commits
+        either way. With `open_window`, the same slot in spot-local time, the
+        spot must also be open for all of it.
+        """
+        if ends_at <= starts_at:
+            raise ValueError('ends_at must be after starts_at')
+        if ends_at - starts_at > MAX_DURATION:
+            raise ValueError(f'reservations are limited to {MAX_DURATION.days} days')
+        try:
+            # The spot, its hours and its reservations all live on the spot's shard
+            shard = sharding.spot_shard(spot_id)
+            if shard is None or not cls._lock_spot(spot_id, shard):
+                raise ReservationConflict('Parking spot not found or not available')
+            if open_window and not sharding.on_shard(session.query(ParkingSpot.id).filter(
+                ParkingSpot.id == spot_id, *ParkingSpotHours.open_clauses(ParkingSpot.id, *open_window)
+            ), shard).first():
+                raise ReservationConflict('Parking spot is closed during part of that time')
+            conflict = cls.find_conflict(spot_id, starts_at, ends_at, shard)
+            if conflict:
+                raise ReservationConflict(
+                    f'Already booked from {conflict.starts_at.isoformat()}Z to {conflict.ends_at.isoformat()}Z'
+                )
+            reservation = cls(spot_id=spot_id, user_id=user_id, starts_at=starts_at, ends_at=ends_at,
+                              status='confirmed')
+            session.add(reservation)
+            session.commit()
+            return reservation
+        except IntegrityError as e:
+            session.rollback()
+            # The Postgres exclusion constraint caught a booking that slipped past the lock;
+            # any other constraint failing is a bug, not a conflict
+            if getattr(getattr(e.orig, 'diag', None), 'constraint_name', None) == OVERLAP_CONSTRAINT:
+                raise ReservationConflict('Slot was just booked by someone else')
+            raise
+        except Exception:
+            session.rollback()
+            raise
+
+    def cancel(self):
+        """Cancel on the spot's shard, serialized with bookings of the spot like book()"""
+        try:
+            shard = sharding.spot_shard(self.spot_id, session())
+            if shard is None:
+                raise ValueError(f'Reservation {self.id} refers to unknown parking spot {self.spot_id}')
+            Reservation._lock_spot(self.spot_id, shard, bookable=False)
+            session.execute(sharding.on_shard(
+                update(Reservation).where(Reservation.id == self.id)
+                .values(status='cancelled', updated_at=datetime.utcnow())
+                .execution_options(synchronize_session=False),
+                shard,
+            ))
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        return self
+
+    @classmethod
+    def get_by_id(cls, reservation_id, spot_id=None):
+        """
+        A reservation by its (globally unique) id, read on its spot's shard
+        when `spot_id` is given, otherwise from one shard after another.
+        """
+        shards = [sharding.spot_shard(spot_id)] if spot_id is not None else sharding.shard_ids()
+        for shard in shards:
+            if shard is None:
+                continue
+            reservation = sharding.on_shard(session.query(cls).filter_by(id=reservation_id), shard).first()
+            if reservation:
+                return reservation
+        return None
+
+    @classmethod
+    def for_spot(cls, spot_id, starts_at, ends_at):
+        """Confirmed reservations of a spot overlapping the window, in time order"""
+        shard = sharding.spot_shard(spot_id)
+        if shard is None:
+            return []
+        return sharding.on_shard(session.query(cls).filter(
+            cls.spot_id == spot_id, cls.status == 'confirmed',
+            cls.starts_at > starts_at - MAX_DURATION, cls.starts_at < ends_at, cls.ends_at > starts_at,
+        ).order_by(cls.starts_at), shard).all()
+
+    @classmethod
+    def free_clause(cls, spot_id_column, starts_at, ends_at):
+        """
+        Condition that no confirmed reservation of `spot_id_column` overlaps
+        the window: one anti-join over the whole candidate set, each probe a
+        bounded range scan of the (spot_id, status, starts_at) index.
+        """
+        return ~exists(select(cls.id).where(and_(
+            cls.spot_id == spot_id_column, cls.status == 'confirmed',
+            cls.starts_at > starts_at - MAX_DURATION, cls.starts_at < ends_at, cls.ends_at > starts_at,
+        )))
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'spot_id': self.spot_id,
+            'user_id': self.user_id,
+            'starts_at': self.starts_at.isoformat() + 'Z',
+            'ends_at': self.ends_at.isoformat() + 'Z',
+            'status': self.status,
+        }
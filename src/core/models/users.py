@@ -6,6 +6,7 @@ import binascii
 from sqlalchemy import Boolean, Column, DateTime, Integer, String, and_
 from core.sqlalchemy_engine import Base
 from core.sqlalchemy_engine import session, BaseModel
+from core import metrics
 
 
 
@@ -66,15 +67,21 @@ class User(BaseModel):
     @staticmethod
     def get_by_id(_id):
         return session.query(User).filter_by(id = _id).first()
+
+    @staticmethod
+    def get_by_ids(ids):
+        return session.query(User).filter(User.id.in_(list(ids))).all()
     
     @classmethod
     def _hash_password(cls, password_plain):
-        hashed_password = pbkdf2_sha256.encrypt(password_plain, rounds = 200000, salt_size = 16)
+        with metrics.in_flight('password_hash_in_flight', op='hash'):
+            hashed_password = pbkdf2_sha256.encrypt(password_plain, rounds = 200000, salt_size = 16)
         return hashed_password
     
     @classmethod
     def _match_password(cls, password_plain, hashed_password):
-        return pbkdf2_sha256.verify(password_plain, hashed_password)
+        with metrics.in_flight('password_hash_in_flight', op='verify'):
+            return pbkdf2_sha256.verify(password_plain, hashed_password)
 
     @classmethod
     def update_dict(cls, user_id,  data):
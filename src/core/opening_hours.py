@@ -0,0 +1,199 @@
+"""
+Parsing of free-form `availability_hours` ("24/7", "9AM-6PM",
+"Mon-Fri 9AM-6PM; Sat 10AM-2PM", "22:00-06:00") into weekly intervals.
+
+An interval is (opens_at, closes_at) in minutes since Monday 00:00, merged
+and sorted, so "is this spot open for the whole of [a, b)" is a single
+`opens_at <= a AND closes_at >= b` range check. Intervals running past
+Sunday midnight are split at the week boundary. A bare "9-5" could be a day
+or a night, so ranges that close before they open need am/pm or HH:MM.
+"""
+import logging
+import re
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import delete, insert, select
+
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
+DAYS = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+DAY_GROUPS = {
+    'daily': range(7), 'everyday': range(7), 'weekdays': range(5), 'weekends': range(5, 7),
+}
+ALWAYS = {'24/7', '24x7', '24 hours', '24hrs', 'always', 'open 24 hours'}
+
+_TIME = r'(\d{1,2})(?:[:.](\d{2}))?\s*(am|pm)?'
+_RANGE_RE = re.compile(rf'^{_TIME}\s*-\s*{_TIME}$')
+_DAY_RE = re.compile(r'^(mon|tue|wed|thu|fri|sat|sun)[a-z]*$')
+
+logger = logging.getLogger(__name__)
+
+
+class HoursParseError(ValueError):
+    pass
+
+
+def _minute(hour, minute, meridiem):
+    hour, minute = int(hour), int(minute or 0)
+    if meridiem:
+        if not 1 <= hour <= 12:
+            raise HoursParseError(f'bad 12-hour time {hour}')
+        hour = hour % 12 + (12 if meridiem == 'pm' else 0)
+    if minute > 59 or hour > 24 or (hour == 24 and minute):
+        raise HoursParseError(f'bad time {hour}:{minute:02d}')
+    return hour * 60 + minute
+
+
+def _day(token):
+    match = _DAY_RE.match(token)
+    if not match:
+        raise HoursParseError(f'unknown day {token!r}')
+    return DAYS.index(match.group(1))
+
+
+def _days(spec):
+    if not spec:
+        return range(7)
+    if spec in DAY_GROUPS:
+        return DAY_GROUPS[spec]
+    days = []
+    for part in spec.split('/'):
+        if '-' in part:
+            first, last = (_day(p.strip()) for p in part.split('-', 1))
+            days.extend((first + i) % 7 for i in range((last - first) % 7 + 1))
+        else:
+            days.append(_day(part.strip()))
+    return days
+
+
+def _segment(text):
+    """(days, open minute, close minute) for one "Mon-Fri 9AM-6PM" style segment"""
+    match = re.match(r'^([a-z/\-]+)\s+(.*)$', text)
+    spec, times = match.groups() if match else ('', text)
+    days = _days(spec)
+    if times in ALWAYS or times in ('24h', 'all day', 'open'):
+        return days, 0, MINUTES_PER_DAY
+    if times == 'closed':
+        return days, 0, 0
+    match = _RANGE_RE.match(times)
+    if not match:
+        raise HoursParseError(f'unrecognised hours {text!r}')
+    h1, m1, ap1, h2, m2, ap2 = match.groups()
+    closes = _minute(h2, m2, ap2)
+    if ap1 or not ap2:
+        opens = _minute(h1, m1, ap1)
+    else:
+        # "1-5PM" shares the closing meridiem, "9-6PM" means 9AM
+        opens = _minute(h1, m1, ap2)
+        if opens > closes:
+            opens = _minute(h1, m1, 'am' if ap2 == 'pm' else 'pm')
+    if closes <= opens:
+        if not (ap1 or ap2 or m1 or m2) and int(h1) <= 12 and int(h2) <= 12:
+            # "9-5" is far more likely 9AM-5PM than overnight, but guessing either way misleads
+            raise HoursParseError(f'ambiguous hours {text!r}, add AM/PM or use HH:MM')
+        closes += MINUTES_PER_DAY  # overnight, e.g. 10PM-6AM, 22-6 or 9AM-12AM
+    return days, opens, closes
+
+
+def merge(intervals):
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [tuple(i) for i in merged]
+
+
+def _wrap(start, end):
+    """Split an interval running past Sunday midnight at the week boundary"""
+    if end <= MINUTES_PER_WEEK:
+        return [(start, end)]
+    if end - start >= MINUTES_PER_WEEK:
+        return [(0, MINUTES_PER_WEEK)]
+    return [(start, MINUTES_PER_WEEK), (0, end - MINUTES_PER_WEEK)]
+
+
+def parse_hours(text):
+    """Merged weekly intervals for an availability_hours string; HoursParseError when unrecognised"""
+    normalized = (text or '').strip().lower().replace('–', '-').replace('—', '-')
+    normalized = re.sub(r'\s+to\s+', '-', re.sub(r'\s+', ' ', normalized))
+    if not normalized:
+        raise HoursParseError('empty hours')
+    if normalized in ALWAYS:
+        return [(0, MINUTES_PER_WEEK)]
+
+    intervals = []
+    for segment in filter(None, (s.strip() for s in re.split(r'[;,]', normalized))):
+        days, opens, closes = _segment(segment)
+        if closes == opens:
+            continue
+        for day in days:
+            intervals.extend(_wrap(day * MINUTES_PER_DAY + opens, day * MINUTES_PER_DAY + closes))
+    return merge(intervals)
+
+
+def week_minute(moment):
+    return moment.weekday() * MINUTES_PER_DAY + moment.hour * 60 + moment.minute
+
+
+def window_pieces(start, end):
+    """
+    The [start, end) datetime window as week-minute ranges, split at the week
+    boundary. A spot is open for the window when each piece lies inside one
+    of its intervals.
+    """
+    if end - start >= timedelta(days=7):
+        return [(0, MINUTES_PER_WEEK)]
+    a = week_minute(start)
+    length = max(1, int((end - start).total_seconds() // 60))
+    return _wrap(a, a + length)
+
+
+def backfill(conn, spots_table, hours_table, batch_size=5000, after_id=0):
+    """
+    (Re)build hours rows from availability_hours for every spot with an id
+    above `after_id`, in id-ordered batches. Returns (spots parsed,
+    unparseable spot ids); each of those is logged with its text.
+    """
+    query = select(spots_table.c.id, spots_table.c.availability_hours).order_by(spots_table.c.id)
+    parsed, failed = 0, []
+    last_id = after_id
+    while True:
+        batch = conn.execute(query.where(spots_table.c.id > last_id).limit(batch_size)).all()
+        if not batch:
+            break
+        last_id = batch[-1][0]
+        rows = []
+        for spot_id, text in batch:
+            try:
+                intervals = parse_hours(text or '24/7')
+            except HoursParseError as e:
+                logger.warning('Skipping hours of spot %s, availability_hours %r: %s', spot_id, text, e)
+                failed.append(spot_id)
+                continue
+            parsed += 1
+            rows.extend({'spot_id': spot_id, 'opens_at': a, 'closes_at': b} for a, b in intervals)
+        conn.execute(delete(hours_table).where(hours_table.c.spot_id.in_([r[0] for r in batch])))
+        if rows:
+            conn.execute(insert(hours_table), rows)
+    return parsed, failed
+
+
+def as_local(moment, tz):
+    """Naive datetimes are taken as spot-local time, aware ones are converted to it"""
+    if isinstance(moment, str):
+        moment = datetime.fromisoformat(moment)
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(tz).replace(tzinfo=None)
+    return moment
+
+
+def as_utc(moment, tz):
+    """Naive UTC for a datetime or ISO string; naive input is taken as spot-local time"""
+    if isinstance(moment, str):
+        moment = datetime.fromisoformat(moment)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=tz)
+    return moment.astimezone(timezone.utc).replace(tzinfo=None)
@@ -0,0 +1,126 @@
+"""
+Per-request timing of SQL, ORM hydration and serialization.
+
+SQLAlchemy events feed whatever RequestMetrics is active in the current
+context (set by core.middleware.PerformanceMiddleware), so model code needs
+no changes. Views can time their own sections with `span('name')`. ORM
+hydration is only split out of the view time for `detailed` requests (the
+profiled ones), since measuring it buffers every ORM result.
+"""
+import contextvars
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    def __init__(self, detailed=False):
+        self.started = time.perf_counter()
+        self.detailed = detailed
+        self.query_count = 0
+        self.spans = {}  # name -> seconds
+
+    def add(self, name, seconds):
+        self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+
+def start_request(detailed=False):
+    metrics = RequestMetrics(detailed)
+    return metrics, _current.set(metrics)
+
+
+def end_request(token):
+    _current.reset(token)
+
+
+def current():
+    return _current.get()
+
+
+@contextmanager
+def span(name):
+    """Time a block of view code (e.g. 'haversine', 'serialize') for the current request"""
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.add(name, time.perf_counter() - started)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        conn.info.setdefault('perf_query_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    metrics = _current.get()
+    starts = conn.info.get('perf_query_start')
+    if metrics is None or not starts:
+        return
+    metrics.query_count += 1
+    metrics.add('db', time.perf_counter() - starts.pop())
+
+
+@event.listens_for(Engine, 'handle_error')
+def _on_cursor_error(context):
+    # A failed statement never reaches after_cursor_execute, drop its start time
+    starts = context.connection.info.get('perf_query_start') if context.connection else None
+    if starts:
+        starts.pop()
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _time_orm_hydration(orm_execute_state):
+    """
+    For ORM SELECTs issued during a detailed request, fetch and build the
+    objects up front (the "re-executing statements" freeze pattern) so the
+    time spent turning rows into instances can be measured separately from
+    the SQL. Other requests get their results untouched.
+    """
+    metrics = _current.get()
+    if (
+        metrics is None
+        or not metrics.detailed
+        or not orm_execute_state.is_select
+        or orm_execute_state.execution_options.get('yield_per')
+        or orm_execute_state.execution_options.get('stream_results')
+    ):
+        return None
+
+    started = time.perf_counter()
+    db_before = metrics.spans.get('db', 0.0)
+    frozen = orm_execute_state.invoke_statement().freeze()
+    # Cursor time inside invoke_statement is already counted under 'db'
+    sql = metrics.spans.get('db', 0.0) - db_before
+    metrics.add('orm', max(0.0, time.perf_counter() - started - sql))
+    return frozen()
+
+
+def server_timing(metrics):
+    """Server-Timing header value: db, orm, serialize and other spans, view remainder, total"""
+    total = metrics.elapsed()
+    parts = []
+    accounted = 0.0
+    for name, seconds in metrics.spans.items():
+        accounted += seconds
+        desc = f';desc="{metrics.query_count} queries"' if name == 'db' else ''
+        parts.append(f'{name};dur={seconds * 1000:.2f}{desc}')
+    if 'db' not in metrics.spans:
+        parts.insert(0, 'db;dur=0.00;desc="0 queries"')
+    parts.append(f'view;dur={max(0.0, total - accounted) * 1000:.2f}')
+    parts.append(f'total;dur={total * 1000:.2f}')
+    return ', '.join(parts)
@@ -0,0 +1,145 @@
+"""
+N+1 and slow-query detection.
+
+While a `detect()` block is active (one per request, opened by
+core.middleware.QueryDetectorMiddleware), every statement run on an engine
+from core.sqlalchemy_engine is counted by its SQL text. Parameters are bound
+separately, so `User.get_by_id(1)` and `User.get_by_id(2)` share a shape. A
+shape repeated QUERY_DETECTOR_REPEAT_THRESHOLD times, or a statement slower
+than QUERY_DETECTOR_SLOW_MS, is reported with the model method that issued it
+and the application stack: logged in 'warn' mode, raised in 'raise' mode.
+"""
+import contextvars
+import logging
+import os
+import re
+import sys
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+_current = contextvars.ContextVar('query_detector', default=None)
+_SRC_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_SKIP_FILES = (os.path.abspath(__file__), os.path.join(_SRC_ROOT, 'core', 'perf.py'))
+_WHITESPACE = re.compile(r'\s+')
+
+
+class QueryProblem(AssertionError):
+    """Raised at the end of a `detect(mode='raise')` block that saw an N+1 or slow query"""
+
+
+def _app_stack():
+    """Application frames (outermost first) of the code that triggered the current statement"""
+    frames = []
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(_SRC_ROOT) and filename not in _SKIP_FILES and 'site-packages' not in filename:
+            # co_qualname (Class.method) is Python 3.11+; older ones only have the bare name
+            name = getattr(frame.f_code, 'co_qualname', frame.f_code.co_name)
+            frames.append((os.path.relpath(filename, _SRC_ROOT), frame.f_lineno, name))
+        frame = frame.f_back
+    frames.reverse()
+    return frames
+
+
+def _origin(stack):
+    """Innermost model method on the stack, else the innermost application frame"""
+    for path, line, name in reversed(stack):
+        if path.startswith(os.path.join('core', 'models')):
+            return f'{name} ({path}:{line})'
+    if stack:
+        path, line, name = stack[-1]
+        return f'{name} ({path}:{line})'
+    return 'unknown'
+
+
+def _format_stack(stack):
+    return '\n'.join(f'    {path}:{line} in {name}' for path, line, name in stack)
+
+
+class QueryReport:
+    def __init__(self, label, repeat_threshold, slow_ms):
+        self.label = label
+        self.repeat_threshold = repeat_threshold
+        self.slow_ms = slow_ms
+        self.counts = {}  # statement shape -> executions
+        self.stacks = {}  # statement shape -> stack of the first execution
+        self.slow = []    # (ms, statement shape, stack)
+
+    def record(self, statement, seconds):
+        shape = _WHITESPACE.sub(' ', statement).strip()
+        count = self.counts.get(shape, 0) + 1
+        self.counts[shape] = count
+        if count == 1:
+            self.stacks[shape] = _app_stack()
+        ms = seconds * 1000
+        if self.slow_ms is not None and ms >= self.slow_ms:
+            self.slow.append((ms, shape, _app_stack()))
+
+    def problems(self):
+        found = []
+        for shape, count in self.counts.items():
+            if count >= self.repeat_threshold:
+                stack = self.stacks[shape]
+                found.append(
+                    f'N+1 in {self.label}: {count} x {shape[:200]}\n'
+                    f'  from {_origin(stack)}\n{_format_stack(stack)}'
+                )
+        for ms, shape, stack in self.slow:
+            found.append(
+                f'Slow query in {self.label}: {ms:.1f} ms (threshold {self.slow_ms} ms) {shape[:200]}\n'
+                f'  from {_origin(stack)}\n{_format_stack(stack)}'
+            )
+        return found
+
+
+@contextmanager
+def detect(label='block', mode='warn', repeat_threshold=5, slow_ms=200):
+    """
+    Watch the statements run inside the block. On exit, problems are logged
+    ('warn') or raised as QueryProblem ('raise'); the report is yielded
+    either way so callers can inspect `counts` themselves.
+    """
+    report = QueryReport(label, repeat_threshold, slow_ms)
+    token = _current.set(report)
+    try:
+        yield report
+    finally:
+        _current.reset(token)
+    problems = report.problems()
+    if not problems:
+        return
+    if mode == 'raise':
+        raise QueryProblem('\n\n'.join(problems))
+    for problem in problems:
+        logger.warning(problem)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        conn.info.setdefault('detector_query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    report = _current.get()
+    starts = conn.info.get('detector_query_start')
+    if report is None or not starts:
+        return
+    report.record(statement, time.perf_counter() - starts.pop())
+
+
+def _on_error(context):
+    starts = context.connection.info.get('detector_query_start') if context.connection else None
+    if starts:
+        starts.pop()
+
+
+def install(engine):
+    """Attach the detector to `engine`; statements are only inspected inside `detect()`"""
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(engine, 'handle_error', _on_error)
@@ -0,0 +1,227 @@
+"""
+Synthetic data for scale testing (`manage.py seed`, `manage.py bench`).
+
+Spots are clustered like real demand: most fall in tight gaussian clusters
+around city centres, the rest spread thinly over the suburbs. Rows are
+generated lazily in batches and written with COPY on Postgres or multi-row
+INSERTs elsewhere, so millions of rows never sit in memory at once.
+Seeding the main database while sharded (core/sharding.py) writes each
+spot, with its hours, to the shard of its region.
+"""
+import csv
+import io
+import json
+import math
+import random
+from contextlib import ExitStack
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, insert, select
+
+from core import sharding
+
+from core.models.change_counter import ChangeCounter
+from core.models.parking_spot import ParkingSpot
+from core.models.parking_spot_hours import ParkingSpotHours
+from core.models.user_role import UserRole
+from core.models.users import User
+
+SEED_PASSWORD = 'seed-password'
+
+# name, latitude, longitude, relative weight (roughly metro population)
+CITIES = [
+    ('Mumbai', 19.0760, 72.8777, 20),
+    ('Delhi', 28.6139, 77.2090, 19),
+    ('Bengaluru', 12.9716, 77.5946, 13),
+    ('Kolkata', 22.5726, 88.3639, 15),
+    ('Chennai', 13.0827, 80.2707, 11),
+    ('Hyderabad', 17.3850, 78.4867, 10),
+    ('Pune', 18.5204, 73.8567, 7),
+    ('Ahmedabad', 23.0225, 72.5714, 8),
+]
+
+CENTRE_SHARE = 0.7        # fraction of spots in the dense city-centre cluster
+CENTRE_SIGMA_KM = 2.5
+SUBURB_SIGMA_KM = 15.0
+KM_PER_DEGREE = 111.0
+
+# (value, weight) mixes
+PARKING_TYPES = [('open', 35), ('covered', 30), ('driveway', 20), ('garage', 15)]
+VEHICLE_SIZES = [('car', 55), ('bike', 25), ('suv', 15), ('truck', 5)]
+AVAILABILITY_HOURS = [('24/7', 45), ('9AM-6PM', 25), ('8AM-10PM', 20), ('6AM-11PM', 10)]
+AMENITIES = ['cctv', 'security_guard', 'ev_charging', 'covered', 'lighting', 'washroom', 'valet', 'disabled_access']
+FIRST_NAMES = ['Aarav', 'Vivaan', 'Aditya', 'Ananya', 'Diya', 'Ishaan', 'Kavya', 'Rohan', 'Saanvi', 'Arjun']
+LAST_NAMES = ['Sharma', 'Verma', 'Gupta', 'Iyer', 'Reddy', 'Das', 'Patel', 'Singh', 'Nair', 'Bose']
+
+
+def _weighted(rng, choices):
+    values, weights = zip(*choices)
+    return rng.choices(values, weights=weights)[0]
+
+
+def spot_coordinates(rng):
+    """(city, lat, lng): dense near a city centre, sparse in its suburbs"""
+    name, lat, lng, _ = rng.choices(CITIES, weights=[c[3] for c in CITIES])[0]
+    sigma = CENTRE_SIGMA_KM if rng.random() < CENTRE_SHARE else SUBURB_SIGMA_KM
+    # A degree of longitude shrinks by cos(latitude), so clusters stay round away from the equator
+    km_per_degree_lng = KM_PER_DEGREE * max(math.cos(math.radians(lat)), 0.01)
+    return (
+        name,
+        lat + rng.gauss(0, sigma) / KM_PER_DEGREE,
+        lng + rng.gauss(0, sigma) / km_per_degree_lng,
+    )
+
+
+def generate_users(count, email_prefix, password_hash, now):
+    for i in range(count):
+        yield {
+            'first_name': FIRST_NAMES[i % len(FIRST_NAMES)],
+            'last_name': LAST_NAMES[(i // len(FIRST_NAMES)) % len(LAST_NAMES)],
+            'email': f'{email_prefix}{i}@example.com',
+            'mobile_number': f'+91{9000000000 + i % 1000000000}',
+            'gender': None,
+            'password': password_hash,
+            'created_at': now,
+            'updated_at': now,
+            'is_active': True,
+        }
+
+
+def generate_spots(count, owner_ids, rng, now, available_share=0.75):
+    for i in range(count):
+        city, lat, lng = spot_coordinates(rng)
+        parking_type = _weighted(rng, PARKING_TYPES)
+        amenities = rng.sample(AMENITIES, rng.randint(0, 4))
+        owner_id = rng.choice(owner_ids) if owner_ids else None
+        created = now - timedelta(days=rng.randint(0, 365))
+        yield {
+            'title': f'{parking_type.title()} parking near {city} #{i}',
+            'description': f'{parking_type.title()} spot in {city}',
+            'location': f'{city}, India',
+            'latitude': round(lat, 6),
+            'longitude': round(lng, 6),
+            'price_per_hour': round(max(10.0, rng.lognormvariate(3.6, 0.5)), 2),
+            'parking_type': parking_type,
+            'is_available': 'yes' if rng.random() < available_share else 'no',
+            'owner_id': owner_id,
+            'max_vehicle_size': _weighted(rng, VEHICLE_SIZES),
+            'amenities': json.dumps(amenities),
+            'images': '[]',
+            'contact_phone': f'+91{8000000000 + i % 1000000000}',
+            'availability_hours': _weighted(rng, AVAILABILITY_HOURS),
+            'created_at': created,
+            'created_by': owner_id,
+            'updated_at': created,
+            'updated_by': owner_id,
+            'is_active': True,
+        }
+
+
+def _batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _copy_rows(conn, table, batch):
+    """Postgres COPY ... FROM STDIN for one batch, the fastest bulk path psycopg2 offers"""
+    columns = list(batch[0])
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    for row in batch:
+        writer.writerow(['\\N' if row[c] is None else row[c] for c in columns])
+    buf.seek(0)
+    cursor = conn.connection.dbapi_connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')", buf
+        )
+    finally:
+        cursor.close()
+
+
+def bulk_insert(conn, table, rows, batch_size=5000):
+    """Write `rows` (any iterable of dicts) in batches; returns the row count"""
+    use_copy = conn.dialect.name == 'postgresql'
+    total = 0
+    for batch in _batches(rows, batch_size):
+        if use_copy:
+            _copy_rows(conn, table, batch)
+        else:
+            conn.execute(insert(table), batch)
+        total += len(batch)
+    return total
+
+
+def seed_database(engine, users=1000, spots=10000, provider_share=0.3, available_share=0.75,
+                  batch_size=5000, rng=None, email_prefix='seed', progress=None):
+    """
+    Insert `users` users (a `provider_share` of them providers owning every
+    spot, the rest seekers) and `spots` clustered parking spots. All users
+    get SEED_PASSWORD. Returns (emails, provider_ids).
+    """
+    rng = rng or random.Random(42)
+    now = datetime.utcnow()
+    password_hash = User._hash_password(SEED_PASSWORD)  # hash once, share across rows
+    report = progress or (lambda *args: None)
+
+    # Shard engines only apply to the database they were configured for, not e.g. a benchmark copy
+    sharded = sharding.enabled() and engine is sharding.engines.get(sharding.DEFAULT_SHARD)
+
+    with ExitStack() as stack:
+        conn = stack.enter_context(engine.begin())
+        shard_conns = {sharding.DEFAULT_SHARD: conn}
+        if sharded:
+            for shard, shard_engine in sharding.engines.items():
+                if shard != sharding.DEFAULT_SHARD:
+                    shard_conns[shard] = stack.enter_context(shard_engine.begin())
+
+        bulk_insert(conn, User.__table__, generate_users(users, email_prefix, password_hash, now), batch_size)
+        report('users', users)
+
+        user_ids = [
+            row[0] for row in conn.execute(
+                select(User.id).where(User.email.like(f'{email_prefix}%@example.com')).order_by(User.id)
+            )
+        ]
+        provider_count = max(1, int(len(user_ids) * provider_share)) if user_ids else 0
+        provider_ids = user_ids[:provider_count]
+        roles = (
+            {'user_id': uid, 'name': 'provider' if n < provider_count else 'seeker'}
+            for n, uid in enumerate(user_ids)
+        )
+        bulk_insert(conn, UserRole.__table__, roles, batch_size)
+        report('roles', len(user_ids))
+
+        first_new_after = conn.execute(select(func.coalesce(func.max(ParkingSpot.id), 0))).scalar()
+        written = 0
+        for batch in _batches(generate_spots(spots, provider_ids, rng, now, available_share), batch_size):
+            by_shard = {sharding.DEFAULT_SHARD: batch}
+            if sharded:
+                # Ids come from the main database's counter, as for ORM writes, so they stay unique
+                ids = ChangeCounter.allocate(conn, f'{ParkingSpot.__tablename__}.id', len(batch))
+                if not written:  # the counter only grows, so later batches get larger ids
+                    first_new_after = ids[0] - 1
+                by_shard = {}
+                for row, new_id in zip(batch, ids):
+                    row['id'] = new_id
+                    by_shard.setdefault(sharding.shard_map.shard_for(row['latitude'], row['longitude']), []).append(row)
+            for shard, rows in by_shard.items():
+                seqs = ChangeCounter.allocate(shard_conns[shard], ParkingSpot.__tablename__, len(rows))
+                for row, seq in zip(rows, seqs):
+                    row['change_seq'] = seq
+                written += bulk_insert(shard_conns[shard], ParkingSpot.__table__, rows, batch_size)
+            report('spots', written)
+
+        parsed = 0
+        for shard_conn in shard_conns.values():
+            parsed += ParkingSpotHours.backfill(shard_conn, batch_size, after_id=first_new_after)[0]
+        report('hours', parsed)
+
+    emails = [f'{email_prefix}{i}@example.com' for i in range(users)]
+    return emails, provider_ids
@@ -0,0 +1,287 @@
+"""
+Region-based sharding of parking spot data.
+
+With DATABASE_SHARDS set (JSON `{"shard id": "database URL"}`), parking
+spots live on the shard of their region, and so do the rows that hang off
+a spot: opening hours, reservations and the spot change counter. Users
+and everything else stay on the main database (DATABASE_URL). The main
+database is also the 'default' shard, which holds spots outside every
+configured region. SPOT_SHARD_REGIONS (JSON `{"geohash prefix": "shard
+id"}`) assigns regions, and the longest matching prefix wins.
+
+Routing uses SQLAlchemy's horizontal sharding (ShardedSession):
+
+- New spots go to their region's shard, and hours and reservations to
+  their spot's shard. Loaded rows remember their shard, so updates go
+  back to it.
+- Queries on sharded tables run on every shard (scatter-gather) unless
+  narrowed with the `shard_ids` execution option (see ParkingSpot.search
+  for bounding boxes) or pinned with `on_shard`.
+- Spot and reservation ids come from a counter on the main database, so
+  they stay unique across shards.
+
+Without DATABASE_SHARDS the plain single-database session is used and
+nothing here changes behaviour. Local SQLite files work as shards, e.g.
+DATABASE_SHARDS='{"south": "sqlite:///south.db"}' SPOT_SHARD_REGIONS='{"te": "south"}'.
+"""
+import json
+import os
+
+from sqlalchemy import event, inspect, select
+from sqlalchemy.ext.horizontal_shard import ShardedSession
+from sqlalchemy.orm import object_session
+from sqlalchemy.orm.util import identity_key
+
+DEFAULT_SHARD = 'default'
+SHARDED_TABLES = frozenset({'parking_spots', 'parking_spot_hours', 'reservations', 'change_counters'})
+GLOBAL_ID_TABLES = ('parking_spots', 'reservations')  # looked up by id, so ids must not repeat across shards
+
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+# Shard id -> engine, set up by sqlalchemy_engine; just the main engine when not sharded
+engines = {}
+
+# Spots never change shard, so where a committed spot lives can be remembered
+_spot_shards = {}
+SPOT_SHARD_CACHE_SIZE = 100_000
+
+
+def geohash(latitude, longitude, precision):
+    """Geohash of a point, `precision` characters long"""
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    code, bits, value, even = [], 0, 0, True
+    while len(code) < precision:
+        interval, coordinate = (lng_range, longitude) if even else (lat_range, latitude)
+        mid = (interval[0] + interval[1]) / 2
+        value <<= 1
+        if coordinate >= mid:
+            value |= 1
+            interval[0] = mid
+        else:
+            interval[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            code.append(_BASE32[value])
+            bits, value = 0, 0
+    return ''.join(code)
+
+
+def geohash_box(prefix):
+    """(south, west, north, east) of a geohash cell"""
+    lat_range, lng_range = [-90.0, 90.0], [-180.0, 180.0]
+    even = True
+    for char in prefix:
+        value = _BASE32.index(char)
+        for shift in range(4, -1, -1):
+            interval = lng_range if even else lat_range
+            mid = (interval[0] + interval[1]) / 2
+            if value >> shift & 1:
+                interval[0] = mid
+            else:
+                interval[1] = mid
+            even = not even
+    return lat_range[0], lng_range[0], lat_range[1], lng_range[1]
+
+
+class ShardMap:
+    """Geohash prefix -> shard assignment of regions"""
+
+    def __init__(self, regions, default=DEFAULT_SHARD):
+        self.regions = {prefix.lower(): shard for prefix, shard in regions.items()}
+        self.default = default
+        self._lengths = sorted({len(prefix) for prefix in self.regions}, reverse=True)
+
+    def shard_for(self, latitude, longitude):
+        if latitude is None or longitude is None or not self._lengths:
+            return self.default
+        code = geohash(latitude, longitude, self._lengths[0])
+        for length in self._lengths:
+            shard = self.regions.get(code[:length])
+            if shard:
+                return shard
+        return self.default
+
+    def shards_for_box(self, south, west, north, east):
+        """Shards that can hold spots inside the box, in a stable order"""
+        shards, covered = set(), False
+        for prefix, shard in self.regions.items():
+            s, w, n, e = geohash_box(prefix)
+            if s <= north and south <= n and w <= east and west <= e:
+                shards.add(shard)
+                # Inside one cell, every point belongs to it or to a longer prefix found here too
+                covered = covered or (s <= south and north <= n and w <= west and east <= e)
+        if not covered:
+            shards.add(self.default)
+        return sorted(shards)
+
+
+shard_map = ShardMap({})
+
+
+def enabled():
+    return len(engines) > 1
+
+
+def shard_ids():
+    return list(engines) or [DEFAULT_SHARD]
+
+
+def on_shard(query, shard_id):
+    """`query` restricted to one shard (a no-op without sharding)"""
+    return query.execution_options(_sa_shard_id=shard_id) if enabled() else query
+
+
+def in_shards(query, ids):
+    """`query` restricted to the given shards (a no-op without sharding)"""
+    return query.execution_options(shard_ids=list(ids)) if enabled() else query
+
+
+def count(query):
+    """query.count() over every shard; a scatter-gather count() would only see the first shard's"""
+    return sum(on_shard(query, shard).count() for shard in shard_ids()) if enabled() else query.count()
+
+
+def encode_token(seqs):
+    """Opaque version token for {shard id: change_seq}; a plain number without sharding"""
+    if set(seqs) <= {DEFAULT_SHARD}:
+        return str(seqs.get(DEFAULT_SHARD, 0))
+    return '.'.join(f'{shard}:{seq}' for shard, seq in sorted(seqs.items()))
+
+
+def decode_token(token):
+    """{shard id: change_seq} from encode_token(); ValueError if malformed"""
+    if not token:
+        return {}
+    if token.isdigit():
+        return {DEFAULT_SHARD: int(token)}
+    seqs = {}
+    for part in token.split('.'):
+        shard, _, seq = part.partition(':')
+        if not seq.isdigit():
+            raise ValueError(f'malformed token part {part!r}')
+        seqs[shard] = int(seq)
+    return seqs
+
+
+def _committed_spot_shard(spot_id):
+    shard = _spot_shards.get(spot_id)
+    if shard is not None:
+        return shard
+    from core.sqlalchemy_engine import Base
+    spots = Base.metadata.tables['parking_spots']
+    for shard, engine in engines.items():
+        with engine.connect() as conn:
+            if conn.execute(select(spots.c.id).where(spots.c.id == spot_id)).first():
+                if len(_spot_shards) >= SPOT_SHARD_CACHE_SIZE:
+                    _spot_shards.clear()
+                _spot_shards[spot_id] = shard
+                return shard
+    return None
+
+
+def spot_shard(spot_id, db_session=None):
+    """Shard holding a spot, None if no shard has it; also sees spots flushed but not yet committed by `db_session`"""
+    if not enabled():
+        return DEFAULT_SHARD
+    if db_session is not None:
+        from core.models.parking_spot import ParkingSpot
+        for shard in engines:
+            if identity_key(ParkingSpot, spot_id, identity_token=shard) in db_session.identity_map:
+                return shard
+    return _committed_spot_shard(spot_id)
+
+
+def _shard_chooser(mapper, instance, clause=None):
+    if mapper is None or instance is None or mapper.local_table.name not in SHARDED_TABLES:
+        return DEFAULT_SHARD
+    if mapper.local_table.name == 'parking_spots':
+        return shard_map.shard_for(instance.latitude, instance.longitude)
+    spot_id = getattr(instance, 'spot_id', None)
+    shard = spot_shard(spot_id, object_session(instance)) if spot_id is not None else None
+    if shard is None:
+        raise ValueError(f'{mapper.class_.__name__} refers to unknown parking spot {spot_id}')
+    return shard
+
+
+def _identity_chooser(mapper, primary_key, *, lazy_loaded_from=None, execution_options=None,
+                      bind_arguments=None, **kw):
+    if lazy_loaded_from is not None:
+        return [lazy_loaded_from.identity_token]
+    if mapper.local_table.name not in SHARDED_TABLES:
+        return [DEFAULT_SHARD]
+    return shard_ids()
+
+
+def _execute_chooser(orm_context):
+    narrowed = orm_context.execution_options.get('shard_ids')
+    if narrowed is not None:
+        return narrowed
+    mapper = orm_context.bind_mapper
+    if mapper is None or mapper.local_table.name not in SHARDED_TABLES:
+        return [DEFAULT_SHARD]
+    return shard_ids()
+
+
+@event.listens_for(ShardedSession, 'before_flush')
+def _assign_global_ids(db_session, flush_context, instances):
+    from core.models.change_counter import ChangeCounter
+    pending = {}
+    for obj in db_session.new:
+        table = inspect(obj).mapper.local_table.name
+        if table in GLOBAL_ID_TABLES and obj.id is None:
+            pending.setdefault(table, []).append(obj)
+    for table, objs in pending.items():
+        for obj, new_id in zip(objs, ChangeCounter.allocate(main_connection(db_session), f'{table}.id', len(objs))):
+            obj.id = new_id
+
+
+def connection_for(db_session, mapper, instance):
+    """Connection of the session's transaction on the instance's shard"""
+    if isinstance(db_session, ShardedSession):
+        return db_session.connection_callable(mapper, instance)
+    return db_session.connection()
+
+
+def main_connection(db_session):
+    """Connection of the session's transaction on the main database"""
+    if isinstance(db_session, ShardedSession):
+        return db_session.connection_callable(shard_id=DEFAULT_SHARD)
+    return db_session.connection()
+
+
+def configure(main_engine, shard_urls, regions, create_engine):
+    """
+    Set up shards from {shard id: URL} and {geohash prefix: shard id};
+    returns sessionmaker keyword arguments for a ShardedSession, or None
+    when there are no extra shards.
+    """
+    global shard_map
+    engines.clear()
+    engines[DEFAULT_SHARD] = main_engine
+    for shard, url in shard_urls.items():
+        if shard != DEFAULT_SHARD:
+            engines[shard] = create_engine(url)
+    shard_map = ShardMap(regions)
+    unknown = set(shard_map.regions.values()) - set(engines)
+    if unknown:
+        raise ValueError(f"SPOT_SHARD_REGIONS names unknown shards: {', '.join(sorted(unknown))}")
+    _spot_shards.clear()
+    if not enabled():
+        return None
+    return {
+        'class_': ShardedSession,
+        'shards': dict(engines),
+        'shard_chooser': _shard_chooser,
+        'identity_chooser': _identity_chooser,
+        'execute_chooser': _execute_chooser,
+    }
+
+
+def configure_from_environment(main_engine, create_engine):
+    return configure(
+        main_engine,
+        json.loads(os.environ.get('DATABASE_SHARDS') or '{}'),
+        json.loads(os.environ.get('SPOT_SHARD_REGIONS') or '{}'),
+        create_engine,
+    )
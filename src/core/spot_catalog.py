@@ -0,0 +1,250 @@
+"""
+Read-only snapshot of the active spot catalog, shared by every worker.
+
+One process builds the snapshot and writes it as fixed-width numpy arrays
+under SPOT_CATALOG_DIR/v<version>-<suffix>/. Every worker memory-maps the
+same files, so the page cache holds one copy however many workers run.
+`current.json` names the newest snapshot and is replaced atomically.
+Readers switch to a new snapshot the next time they look and never wait
+for a build.
+
+A snapshot's version maps each shard (see core/sharding.py; just 'default'
+without sharding) to its change_seq head when the rows were read (see
+core/models/change_counter.py), so `change_seq > version[shard]` selects
+every write to that shard the snapshot may have missed. Spots are stored in KD-tree order with the tree's
+nodes alongside (see core/spot_tree.py), so the tree is shared as well.
+"""
+import fcntl
+import glob
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from sqlalchemy import select
+
+from core import sharding, sqlalchemy_engine
+from core.models.parking_spot import ParkingSpot
+
+logger = logging.getLogger(__name__)
+
+
+def spot_dtype(type_code='u1', size_code='u1'):
+    """Record of one spot; the coded columns are as wide as the snapshot's label count needs"""
+    return np.dtype([
+        ('id', '<i8'), ('latitude', '<f8'), ('longitude', '<f8'),
+        ('x', '<f8'), ('y', '<f8'), ('z', '<f8'),  # unit-sphere point
+        ('price', '<f8'), ('parking_type', type_code), ('vehicle_size', size_code), ('available', '?'),
+    ])
+
+
+NODE_DTYPE = np.dtype([
+    ('lo', '<i4'), ('hi', '<i4'), ('left', '<i4'), ('right', '<i4'),
+    ('box_min', '<f8', (3,)), ('box_max', '<f8', (3,)),
+])
+LEAF_SIZE = 64
+KEEP_SNAPSHOTS = 2  # the current one and its predecessor, which readers may still be opening
+
+
+def unit_vectors(latitudes, longitudes):
+    lat, lng = np.radians(latitudes), np.radians(longitudes)
+    cos_lat = np.cos(lat)
+    return np.column_stack((cos_lat * np.cos(lng), cos_lat * np.sin(lng), np.sin(lat)))
+
+
+def build_kdtree(points):
+    """(order, nodes): the permutation putting `points` in KD-tree order, and the tree's nodes"""
+    order = np.arange(len(points))
+    nodes = []
+
+    def build(lo, hi):
+        node = len(nodes)
+        segment = points[order[lo:hi]]
+        low, high = segment.min(axis=0), segment.max(axis=0)
+        nodes.append([lo, hi, -1, -1, low, high])
+        if hi - lo > LEAF_SIZE:
+            axis = int(np.argmax(high - low))
+            mid = (hi - lo) // 2
+            order[lo:hi] = order[lo:hi][np.argpartition(segment[:, axis], mid)]
+            nodes[node][2] = build(lo, lo + mid)
+            nodes[node][3] = build(lo + mid, hi)
+        return node
+
+    if len(points):
+        build(0, len(points))
+    return order, np.array([tuple(n) for n in nodes], dtype=NODE_DTYPE)
+
+
+def _labels(values):
+    return sorted(set(values), key=lambda v: (v is None, v or ''))
+
+
+def _code_type(labels):
+    """Narrowest unsigned integer numbering `labels`: one byte unless free-text input grew past 256"""
+    return 'u1' if len(labels) <= 1 << 8 else '<u2' if len(labels) <= 1 << 16 else '<u4'
+
+
+class Snapshot:
+    """One published catalog: memory-mapped arrays plus the labels behind the coded columns"""
+
+    def __init__(self, path, meta):
+        self.path = path
+        version = meta['version']
+        self.version = version if isinstance(version, dict) else {sharding.DEFAULT_SHARD: version}
+        self.parking_types = meta['parking_types']
+        self.vehicle_sizes = meta['vehicle_sizes']
+        self.available_count = meta['available_count']
+        # Empty arrays cannot be mapped
+        mode = 'r' if meta['count'] else None
+        self.spots = np.load(os.path.join(path, 'spots.npy'), mmap_mode=mode)
+        self.nodes = np.load(os.path.join(path, 'nodes.npy'), mmap_mode=mode)
+        self.ids = np.load(os.path.join(path, 'ids.npy'), mmap_mode=mode)  # sorted spot ids
+        self.by_id = np.load(os.path.join(path, 'by_id.npy'), mmap_mode=mode)  # their positions in spots
+
+    def __len__(self):
+        return len(self.spots)
+
+    def position(self, spot_id):
+        """Index of a spot in `spots`, None if it is not in the snapshot"""
+        i = int(np.searchsorted(self.ids, spot_id))
+        if i < len(self.ids) and self.ids[i] == spot_id:
+            return int(self.by_id[i])
+        return None
+
+
+class SpotCatalog:
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._snapshot = None
+        self._pointer_stat = None
+        self._lock = threading.Lock()
+
+    @property
+    def _pointer(self):
+        return os.path.join(self.directory, 'current.json')
+
+    def current(self):
+        """Newest published snapshot (one stat() when unchanged), None before the first build"""
+        try:
+            stat = os.stat(self._pointer)
+        except FileNotFoundError:
+            return None
+        key = (stat.st_ino, stat.st_mtime_ns)
+        if key != self._pointer_stat:
+            with self._lock:
+                if key != self._pointer_stat:
+                    try:
+                        with open(self._pointer) as f:
+                            meta = json.load(f)
+                        self._snapshot = Snapshot(os.path.join(self.directory, meta['path']), meta)
+                    except FileNotFoundError:
+                        # Pruned between reading the pointer and opening the files; retried next call
+                        return self._snapshot
+                    self._pointer_stat = key
+        return self._snapshot
+
+    def publish(self, min_version=None):
+        """
+        The current snapshot, after building a new one if the current one is
+        older than `min_version` ({shard id: change_seq}) on any shard.
+        Builders in other processes are waited for and their snapshot
+        reused, so each version is built once.
+        """
+        min_version = min_version or {}
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, 'build.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            snapshot = self.current()
+            if snapshot is not None and all(
+                snapshot.version.get(shard, 0) >= seq for shard, seq in min_version.items()
+            ):
+                return snapshot
+            started = time.perf_counter()
+            meta = self._write(self._read_rows())
+            self._prune(keep=meta['path'])
+        logger.info('Published spot catalog %s (%d spots) in %.2fs',
+                    meta['path'], meta['count'], time.perf_counter() - started)
+        return self.current()
+
+    @staticmethod
+    def _read_rows():
+        """{shard id: (head_seq, rows of its spots)}"""
+        engines = sharding.engines or {sharding.DEFAULT_SHARD: sqlalchemy_engine.engine}
+        rows = {}
+        for shard, engine in engines.items():
+            with engine.connect() as conn:
+                # Head first: every write up to it is in the rows; later ones may be too, and are seen again
+                head = ParkingSpot.head_seq(conn)
+                rows[shard] = head, conn.execute(select(
+                    ParkingSpot.id, ParkingSpot.latitude, ParkingSpot.longitude, ParkingSpot.price_per_hour,
+                    ParkingSpot.parking_type, ParkingSpot.max_vehicle_size, ParkingSpot.is_available,
+                    ParkingSpot.is_active, ParkingSpot.change_seq,
+                )).all()
+        return rows
+
+    def _write(self, shard_rows):
+        version = {shard: head for shard, (head, _) in shard_rows.items()}
+        rows = [
+            r for _, rows in shard_rows.values() for r in rows
+            if r.is_active and r.latitude is not None and r.longitude is not None
+        ]
+        parking_types = _labels(r.parking_type for r in rows)
+        vehicle_sizes = _labels(r.max_vehicle_size for r in rows)
+        type_codes = {label: i for i, label in enumerate(parking_types)}
+        size_codes = {label: i for i, label in enumerate(vehicle_sizes)}
+
+        spots = np.zeros(len(rows), dtype=spot_dtype(_code_type(parking_types), _code_type(vehicle_sizes)))
+        spots['id'] = [r.id for r in rows]
+        spots['latitude'] = [r.latitude for r in rows]
+        spots['longitude'] = [r.longitude for r in rows]
+        points = unit_vectors(spots['latitude'], spots['longitude'])
+        spots['x'], spots['y'], spots['z'] = points[:, 0], points[:, 1], points[:, 2]
+        spots['price'] = [float(r.price_per_hour or 0) for r in rows]
+        spots['parking_type'] = [type_codes[r.parking_type] for r in rows]
+        spots['vehicle_size'] = [size_codes[r.max_vehicle_size] for r in rows]
+        spots['available'] = [r.is_available == 'yes' for r in rows]
+
+        order, nodes = build_kdtree(points)
+        spots = spots[order]
+        by_id = np.argsort(spots['id'], kind='stable').astype('<i4')
+
+        name = f'v{sum(version.values())}-{time.time_ns():x}'
+        staging = tempfile.mkdtemp(dir=self.directory, prefix='.tmp-')
+        try:
+            np.save(os.path.join(staging, 'spots.npy'), spots)
+            np.save(os.path.join(staging, 'nodes.npy'), nodes)
+            np.save(os.path.join(staging, 'ids.npy'), spots['id'][by_id])
+            np.save(os.path.join(staging, 'by_id.npy'), by_id)
+            os.rename(staging, os.path.join(self.directory, name))
+        except Exception:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+
+        meta = {
+            'path': name, 'version': version, 'count': len(spots),
+            'available_count': int(spots['available'].sum()),
+            'parking_types': parking_types, 'vehicle_sizes': vehicle_sizes,
+        }
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self._pointer)
+        return meta
+
+    def _prune(self, keep):
+        snapshots = sorted(glob.glob(os.path.join(self.directory, 'v*')), key=os.path.getmtime)
+        older = [path for path in snapshots if os.path.basename(path) != keep]
+        # Unlinking is safe for workers still mapping them; the pages go once they remap
+        for path in older[:max(0, len(older) - (KEEP_SNAPSHOTS - 1))]:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+catalog = SpotCatalog(
+    getattr(settings, 'SPOT_CATALOG_DIR', os.path.join(settings.BASE_DIR, 'cache', 'spot_catalog'))
+)
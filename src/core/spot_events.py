@@ -0,0 +1,47 @@
+"""
+Notifications that parking spots changed, for in-process derived indexes.
+
+ORM inserts, updates and deletes of ParkingSpot flag the session, and once
+that session commits every registered callback runs. Writes from other
+processes (or bulk Core statements) are not seen here; indexes catch those
+with their own periodic delta query.
+"""
+import logging
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+from core.models.parking_spot import ParkingSpot
+
+logger = logging.getLogger(__name__)
+
+_callbacks = []
+
+
+def on_spots_changed(callback):
+    """Call `callback()` after every commit that wrote a ParkingSpot"""
+    _callbacks.append(callback)
+    return callback
+
+
+def _flag(mapper, connection, target):
+    object_session(target).info['spots_changed'] = True
+
+
+for _name in ('after_insert', 'after_update', 'after_delete'):
+    event.listen(ParkingSpot, _name, _flag)
+
+
+@event.listens_for(Session, 'after_commit')
+def _after_commit(db_session):
+    if db_session.info.pop('spots_changed', False):
+        for callback in _callbacks:
+            try:
+                callback()
+            except Exception:
+                logger.exception('Spot change callback %r failed', callback)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _after_rollback(db_session):
+    db_session.info.pop('spots_changed', None)
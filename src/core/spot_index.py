@@ -0,0 +1,174 @@
+"""
+Base class for in-memory indexes derived from the parking_spots table
+(marker clusters, nearest-neighbour trees).
+
+An index is built once from every bookable spot, then kept current with
+delta queries (change_seq after the last head seen and up to the current
+one, see core/models/change_counter.py) instead of full reloads. Local ORM
+writes mark it stale straight away (see core/spot_events.py); writes from other workers are picked up every
+`refresh_seconds`. Spots are never deleted, only deactivated, so a spot
+leaving the index is a row with a fresh change_seq that is no longer
+bookable; no count of the table is needed. With sharding (core/sharding.py)
+every shard is read and tracked by its own change_seq. With
+`background=True` refreshes run on a daemon thread, so requests only ever
+read the current state.
+"""
+import logging
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+
+from sqlalchemy import select
+
+from core import sharding, spot_events, sqlalchemy_engine
+from core.models.parking_spot import ParkingSpot
+
+logger = logging.getLogger(__name__)
+
+SPOT_COLUMNS = (
+    ParkingSpot.id, ParkingSpot.latitude, ParkingSpot.longitude, ParkingSpot.price_per_hour,
+    ParkingSpot.parking_type, ParkingSpot.max_vehicle_size, ParkingSpot.is_active,
+    ParkingSpot.is_available, ParkingSpot.change_seq,
+)
+
+
+def _bookable():
+    return [
+        ParkingSpot.is_active == True, ParkingSpot.is_available == 'yes',
+        ParkingSpot.latitude.isnot(None), ParkingSpot.longitude.isnot(None),
+    ]
+
+
+def _engines():
+    return sharding.engines or {sharding.DEFAULT_SHARD: sqlalchemy_engine.engine}
+
+
+def is_bookable(row):
+    return bool(row.is_active) and row.is_available == 'yes' and row.latitude is not None \
+        and row.longitude is not None
+
+
+class LiveSpotIndex(ABC):
+    refresh_seconds = 5.0
+    columns = SPOT_COLUMNS  # what rows passed to the hooks carry
+
+    def __init__(self, background=False, refresh_seconds=None):
+        self.background = background
+        if refresh_seconds is not None:
+            self.refresh_seconds = refresh_seconds
+        self.lock = threading.RLock()
+        self._refresh_lock = threading.Lock()
+        self._built = False
+        self._stale = False
+        self._checked = 0.0
+        self._seq = {}  # shard id -> change_seq
+        self._thread_pid = None
+        self._wake = threading.Event()
+        self.version = 0  # bumped on every change, for caches built on top of the index
+        spot_events.on_spots_changed(self.mark_stale)
+
+    def _load_rows(self):
+        """(bookable rows with `columns`, {shard id: change_seq they are current to}) for a full build"""
+        seqs, rows = {}, []
+        for shard, engine in _engines().items():
+            with engine.connect() as conn:
+                # Head first: rows written in between are seen again by the next delta, which is harmless
+                seqs[shard] = ParkingSpot.head_seq(conn)
+                rows += conn.execute(select(*self.columns).where(*_bookable())).all()
+        return rows, seqs
+
+    # Subclass hooks; _upsert/_remove/_swap are called with self.lock held
+
+    @abstractmethod
+    def _load(self):
+        """(state, {shard id: change_seq it is current to}) for a full build"""
+
+    @abstractmethod
+    def _swap(self, state):
+        """Make a state returned by _load the current one"""
+
+    @abstractmethod
+    def _upsert(self, row):
+        """Add a bookable row, or replace the spot's previous entry"""
+
+    @abstractmethod
+    def _remove(self, spot_id):
+        """Drop a spot if it is indexed"""
+
+    @abstractmethod
+    def _size(self):
+        """Number of spots indexed"""
+
+    def _needs_rebuild(self):
+        """Return True when accumulated patches make a fresh build worthwhile"""
+        return False
+
+    def mark_stale(self):
+        self._stale = True
+        self._wake.set()
+
+    def ready(self):
+        """Call before reading: builds on first use, afterwards refreshes off (or, without a thread, on) the request path"""
+        if not self._built:
+            self.refresh()
+        if self.background:
+            self._ensure_thread()
+        elif self._stale or time.monotonic() - self._checked >= self.refresh_seconds:
+            self.refresh()
+
+    def rebuild(self):
+        state, seq = self._load()
+        with self.lock:
+            self._swap(state)
+            self._seq = seq
+            self.version += 1
+            self._built = True
+            size = self._size()
+        logger.info('%s rebuilt with %d spots', type(self).__name__, size)
+
+    def refresh(self):
+        """Apply rows changed since the last look; rebuild when patching has worn the index down"""
+        with self._refresh_lock:
+            self._stale = False
+            self._checked = time.monotonic()
+            if not self._built:
+                self.rebuild()
+            changed, heads = {}, {}
+            for shard, engine in _engines().items():
+                with engine.connect() as conn:
+                    # Only up to the head: a later row may commit before an earlier one
+                    heads[shard] = ParkingSpot.head_seq(conn)
+                    changed[shard] = conn.execute(select(*self.columns).where(
+                        ParkingSpot.change_seq > self._seq.get(shard, 0), ParkingSpot.change_seq <= heads[shard]
+                    )).all()
+            with self.lock:
+                for shard, rows in changed.items():
+                    for row in rows:
+                        if is_bookable(row):
+                            self._upsert(row)
+                        else:
+                            self._remove(row.id)
+                    self._seq[shard] = max(self._seq.get(shard, 0), heads[shard])
+                if any(changed.values()):
+                    self.version += 1
+                compact = self._needs_rebuild()
+            if compact:
+                logger.info('%s needs compacting; rebuilding', type(self).__name__)
+                self.rebuild()
+
+    def _ensure_thread(self):
+        # Threads do not survive a fork, so every worker process starts its own
+        if self._thread_pid == os.getpid():
+            return
+        self._thread_pid = os.getpid()
+        threading.Thread(target=self._run, name=f'{type(self).__name__}-refresh', daemon=True).start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.refresh_seconds)
+            self._wake.clear()
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception('%s refresh failed', type(self).__name__)
@@ -0,0 +1,85 @@
+"""
+Pre-encoded JSON for parking spot search results.
+
+Popular spots show up in most searches, and building their payload (owner
+fields, number conversions, encoding) is the same work every time. Each
+spot's payload is encoded once into a fragment: the object minus its
+closing brace, which keeps the per-request `distance_km` out of the cached
+bytes. A response is then assembled by joining fragments.
+
+Fragments are keyed by (spot id, spot updated_at, owner id, owner
+updated_at). Any write to the spot or its owner bumps updated_at, so a
+stale fragment is never served, only left to age out of the LRU.
+"""
+import json
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+from core import metrics
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(value):
+    """`value` as compact UTF-8 JSON bytes, through orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+class FragmentCache:
+    """Thread-safe LRU of encoded fragments"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_build(self, key, build):
+        with self._lock:
+            fragment = self._entries.get(key)
+            if fragment is not None:
+                self._entries.move_to_end(key)
+        if fragment is not None:
+            metrics.inc('cache_requests_total', cache='spot_json', result='hit')
+            return fragment
+
+        metrics.inc('cache_requests_total', cache='spot_json', result='miss')
+        fragment = build()
+        with self._lock:
+            self._entries[key] = fragment
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return fragment
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+spot_fragments = FragmentCache(getattr(settings, 'SPOT_JSON_CACHE_SIZE', 10_000))
+
+
+def spot_fragment(spot, owner, build):
+    """Encoded `build(spot, owner)` without its closing brace, cached per spot/owner version"""
+    key = (spot.id, spot.updated_at, owner.id if owner else None, owner.updated_at if owner else None)
+    return spot_fragments.get_or_build(key, lambda: dumps(build(spot, owner))[:-1])
+
+
+def result_json(fragment, distance):
+    """One search result: a cached fragment closed with its distance"""
+    return b'%s,"distance_km":%s}' % (fragment, dumps(round(distance, 2)))
+
+
+def results_json(results):
+    """JSON array of pre-encoded results"""
+    return b'[' + b','.join(results) + b']'
@@ -0,0 +1,156 @@
+"""
+Typeahead search over spot titles, locations and descriptions.
+
+On Postgres, ParkingSpot.text_search ranks by pg_trgm word similarity
+using trigram GIN indexes. Elsewhere this in-memory index is used. It is
+kept current like the other spot indexes (see core/spot_index.py), so
+local writes show up on the next query and other workers' writes within
+refresh_seconds.
+
+Text is folded (lower case, accents stripped) and split into words. A
+sorted vocabulary serves as the prefix trie: the words starting with a
+query term form one contiguous bisect range. Every term of the query must
+prefix some word of a spot. A term scores its field's weight, in full for
+a whole-word match and less the more of the word it leaves out. The sum
+is divided by 1 + distance / distance_scale_km when a position is given.
+"""
+import bisect
+import heapq
+import math
+import re
+import unicodedata
+
+from core.models.parking_spot import ParkingSpot
+from core.spot_index import SPOT_COLUMNS, LiveSpotIndex
+
+FIELD_WEIGHTS = (('title', 3.0), ('location', 2.0), ('description', 1.0))
+MIN_TERM = 2          # shorter terms match too much to narrow anything
+MAX_EXPANSIONS = 500  # vocabulary words tried per prefix, shortest first
+EARTH_RADIUS_KM = 6371.0
+
+_WORD = re.compile(r'\w+')
+
+
+def fold(text):
+    """Lower case without accents, so 'Café' finds 'cafe'"""
+    decomposed = unicodedata.normalize('NFKD', text.lower())
+    return ''.join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def words(text):
+    return _WORD.findall(fold(text)) if text else []
+
+
+def query_terms(query):
+    return [term for term in dict.fromkeys(words(query)) if len(term) >= MIN_TERM]
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    a = math.sin((p2 - p1) / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(math.radians(lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class TextIndex(LiveSpotIndex):
+    columns = SPOT_COLUMNS + (ParkingSpot.title, ParkingSpot.location, ParkingSpot.description)
+
+    def _load(self):
+        rows, seqs = self._load_rows()
+        return self._build_state(rows), seqs
+
+    def _build_state(self, rows):
+        postings, docs = {}, {}
+        for row in rows:
+            self._insert(postings, docs, row)
+        return postings, sorted(postings), docs
+
+    def _swap(self, state):
+        self.postings, self.vocabulary, self.docs = state
+
+    def _size(self):
+        return len(self.docs)
+
+    @staticmethod
+    def _document(row):
+        weights = {}
+        for field, weight in FIELD_WEIGHTS:
+            for word in words(getattr(row, field)):
+                weights[word] = max(weights.get(word, 0.0), weight)
+        return weights
+
+    @classmethod
+    def _insert(cls, postings, docs, row):
+        weights = cls._document(row)
+        docs[row.id] = (row.latitude, row.longitude, tuple(weights))
+        new_words = []
+        for word, weight in weights.items():
+            posting = postings.get(word)
+            if posting is None:
+                posting = postings[word] = {}
+                new_words.append(word)
+            posting[row.id] = weight
+        return new_words
+
+    def _upsert(self, row):
+        self._remove(row.id)
+        for word in self._insert(self.postings, self.docs, row):
+            bisect.insort(self.vocabulary, word)
+
+    def _remove(self, spot_id):
+        doc = self.docs.pop(spot_id, None)
+        if doc is None:
+            return
+        for word in doc[2]:
+            posting = self.postings[word]
+            posting.pop(spot_id, None)
+            if not posting:
+                del self.postings[word]
+                del self.vocabulary[bisect.bisect_left(self.vocabulary, word)]
+
+    def _term_scores(self, term):
+        """spot id -> score of `term` as a prefix of the spot's words"""
+        start = bisect.bisect_left(self.vocabulary, term)
+        end = bisect.bisect_left(self.vocabulary, term + '\U0010ffff')
+        expansions = self.vocabulary[start:end]
+        if len(expansions) > MAX_EXPANSIONS:
+            expansions = sorted(expansions, key=len)[:MAX_EXPANSIONS]
+        scores = {}
+        for word in expansions:
+            # A whole word scores its field weight, a bare prefix from half to nearly all of it
+            completeness = 1.0 if word == term else 0.5 + 0.5 * len(term) / len(word)
+            for spot_id, weight in self.postings[word].items():
+                score = weight * completeness
+                if score > scores.get(spot_id, 0.0):
+                    scores[spot_id] = score
+        return scores
+
+    def search(self, query, limit=10, latitude=None, longitude=None, distance_scale_km=10.0):
+        """[(spot id, score, distance km or None)] best first"""
+        terms = query_terms(query)
+        if not terms:
+            return []
+        self.ready()
+        with self.lock:
+            totals = None
+            # Longest terms first: usually the most selective, so the candidate set shrinks fastest
+            for term in sorted(terms, key=len, reverse=True):
+                scores = self._term_scores(term)
+                if totals is None:
+                    totals = scores
+                else:
+                    totals = {spot_id: total + scores[spot_id] for spot_id, total in totals.items() if spot_id in scores}
+                if not totals:
+                    return []
+            located = latitude is not None and longitude is not None
+            ranked = []
+            for spot_id, total in totals.items():
+                distance = None
+                if located:
+                    lat, lng, _ = self.docs[spot_id]
+                    distance = haversine_km(latitude, longitude, lat, lng)
+                    total /= 1 + distance / distance_scale_km
+                ranked.append((total, spot_id, distance))
+        return [(spot_id, score, distance) for score, spot_id, distance in heapq.nlargest(limit, ranked)]
+
+
+text_index = TextIndex(background=True)
@@ -0,0 +1,177 @@
+"""
+k-nearest parking spots from a KD-tree.
+
+Spots are stored as points on the unit sphere (x, y, z). The straight-line
+(chord) distance between two such points grows monotonically with their
+great-circle distance, so pruning on chord distance to a node's bounding
+box is exact for haversine distance, with no polar or antimeridian
+special cases.
+
+The tree lives in the shared catalog snapshot (core/spot_catalog.py), built
+once and memory-mapped by every worker. Spots changed since that snapshot
+live in a small per-worker overlay: tree entries of changed or removed
+spots are tombstoned, and their current version is scanned linearly. Once
+the snapshot falls more than OVERLAY_LIMIT changes behind, the next refresh
+publishes (or picks up another worker's) newer snapshot.
+
+`nearest()` is an incremental best-first search (one heap of tree nodes
+keyed by their lower-bound distance and of spots keyed by their exact
+distance), so it yields spots in exact distance order for as long as the
+caller keeps asking, with attribute filters applied during the traversal.
+"""
+import heapq
+import math
+
+import numpy as np
+
+from core.models.parking_spot import ParkingSpot
+from core.spot_catalog import catalog
+from core.spot_index import LiveSpotIndex
+
+EARTH_RADIUS_KM = 6371.0
+OVERLAY_LIMIT = 2000
+
+
+def unit_vector(lat, lng):
+    lat, lng = math.radians(lat), math.radians(lng)
+    cos_lat = math.cos(lat)
+    return cos_lat * math.cos(lng), cos_lat * math.sin(lng), math.sin(lat)
+
+
+def chord_to_km(chord_sq):
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(chord_sq) / 2))
+
+
+def km_to_chord_sq(km):
+    return (2 * math.sin(min(math.pi, km / EARTH_RADIUS_KM) / 2)) ** 2
+
+
+class SpotFilter:
+    """Attribute filters checked while traversing the tree"""
+
+    def __init__(self, min_price=None, max_price=None, parking_types=None, vehicle_sizes=None):
+        self.min_price = min_price
+        self.max_price = max_price
+        self.parking_types = set(parking_types) if parking_types else None
+        self.vehicle_sizes = set(vehicle_sizes) if vehicle_sizes else None
+
+    def __call__(self, price, parking_type, vehicle_size):
+        return (
+            (self.min_price is None or price >= self.min_price)
+            and (self.max_price is None or price <= self.max_price)
+            and (self.parking_types is None or parking_type in self.parking_types)
+            and (self.vehicle_sizes is None or vehicle_size in self.vehicle_sizes)
+        )
+
+    def masker(self, snapshot):
+        """Vectorised form for a snapshot: segment of its spots -> boolean mask"""
+        type_codes = None if self.parking_types is None else \
+            [i for i, label in enumerate(snapshot.parking_types) if label in self.parking_types]
+        size_codes = None if self.vehicle_sizes is None else \
+            [i for i, label in enumerate(snapshot.vehicle_sizes) if label in self.vehicle_sizes]
+
+        def mask(segment):
+            keep = segment['available'].copy()
+            if self.min_price is not None:
+                keep &= segment['price'] >= self.min_price
+            if self.max_price is not None:
+                keep &= segment['price'] <= self.max_price
+            if type_codes is not None:
+                keep &= np.isin(segment['parking_type'], type_codes)
+            if size_codes is not None:
+                keep &= np.isin(segment['vehicle_size'], size_codes)
+            return keep
+
+        return mask
+
+
+class NearestIndex(LiveSpotIndex):
+
+    def _load(self):
+        # A snapshot within OVERLAY_LIMIT changes of the head is caught up by the next delta
+        snapshot = catalog.publish(min_version={
+            shard: head - OVERLAY_LIMIT for shard, head in ParkingSpot.head_seqs().items()
+        })
+        return snapshot, dict(snapshot.version)
+
+    def _swap(self, snapshot):
+        self.snapshot = snapshot
+        self.tombstones = set()
+        self.overlay = {}  # spot id -> (point, attrs)
+
+    def _size(self):
+        return self.snapshot.available_count - len(self.tombstones) + len(self.overlay)
+
+    def _upsert(self, row):
+        self._remove(row.id)
+        self.overlay[row.id] = (
+            unit_vector(row.latitude, row.longitude),
+            (float(row.price_per_hour or 0), row.parking_type, row.max_vehicle_size),
+        )
+
+    def _remove(self, spot_id):
+        self.overlay.pop(spot_id, None)
+        i = self.snapshot.position(spot_id)
+        if i is not None and self.snapshot.spots['available'][i]:
+            self.tombstones.add(spot_id)
+
+    def _needs_rebuild(self):
+        return len(self.overlay) + len(self.tombstones) > OVERLAY_LIMIT
+
+    def nearest(self, lat, lng, spot_filter=None, max_km=None):
+        """Yield (spot id, distance km) in exact distance order, optionally within max_km"""
+        self.ready()
+        with self.lock:
+            snapshot, tombstones, overlay = self.snapshot, set(self.tombstones), dict(self.overlay)
+        spot_filter = spot_filter or SpotFilter()
+        mask = spot_filter.masker(snapshot)
+        limit = km_to_chord_sq(max_km) if max_km is not None else math.inf
+        q = unit_vector(lat, lng)
+        qv = np.array(q)
+        spots, nodes = snapshot.spots, snapshot.nodes
+
+        def box_distance_sq(node):
+            box = nodes[node]
+            gap = np.maximum(box['box_min'] - qv, 0) + np.maximum(qv - box['box_max'], 0)
+            return float(gap @ gap)
+
+        # Entries: (distance², tiebreak, spot id or None, node)
+        heap = []
+        counter = 0
+        for spot_id, (point, attrs) in overlay.items():
+            d = (point[0] - q[0]) ** 2 + (point[1] - q[1]) ** 2 + (point[2] - q[2]) ** 2
+            if d <= limit and spot_filter(*attrs):
+                heap.append((d, counter, spot_id, -1))
+                counter += 1
+        if len(nodes):
+            heap.append((box_distance_sq(0), counter, None, 0))
+            counter += 1
+        heapq.heapify(heap)
+
+        while heap:
+            d, _, spot_id, node = heapq.heappop(heap)
+            if d > limit:
+                return
+            if spot_id is not None:
+                yield spot_id, chord_to_km(d)
+                continue
+            row = nodes[node]
+            lo, hi, left, right = int(row['lo']), int(row['hi']), int(row['left']), int(row['right'])
+            if left < 0:
+                segment = spots[lo:hi]
+                keep = np.nonzero(mask(segment))[0]
+                if not len(keep):
+                    continue
+                kept = segment[keep]
+                distances = (kept['x'] - q[0]) ** 2 + (kept['y'] - q[1]) ** 2 + (kept['z'] - q[2]) ** 2
+                for spot_id, d in zip(kept['id'].tolist(), distances.tolist()):
+                    if d <= limit and spot_id not in tombstones:
+                        heapq.heappush(heap, (d, counter, spot_id, -1))
+                        counter += 1
+            else:
+                for child in (left, right):
+                    heapq.heappush(heap, (box_distance_sq(child), counter, None, child))
+                    counter += 1
+
+
+nearest_index = NearestIndex(background=True)
@@ -0,0 +1,98 @@
+"""
+Compact encodings of spot search results for map clients.
+
+The default response is a list of objects, which repeats every key (and a
+nested owner object) for every spot. Clients can instead ask, through the
+Accept header, for a columnar layout: one array per field, coordinates as
+integers in units of 1/COORD_SCALE degree (about 1 m) and owners listed
+once and referenced by index.
+
+    COLUMNS_TYPE   the columnar layout as JSON
+    MSGPACK_TYPE   the same layout as MessagePack (needs the msgpack package)
+
+Clients that ask for neither still get the original JSON list.
+"""
+from core import spot_json
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+COLUMNS_TYPE = 'application/vnd.parkspace.columns+json'
+MSGPACK_TYPE = 'application/msgpack'
+MSGPACK_TYPES = (MSGPACK_TYPE, 'application/x-msgpack')
+COORD_SCALE = 10 ** 5
+LAYOUT_VERSION = 1
+
+
+def negotiate(request):
+    """COLUMNS_TYPE, MSGPACK_TYPE or None (the default JSON list) for the request's Accept header"""
+    offered = []
+    for position, part in enumerate(request.headers.get('Accept', '').split(',')):
+        media_type, *params = (p.strip() for p in part.split(';'))
+        quality = 1.0
+        for param in params:
+            if param.startswith('q='):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        if quality > 0:
+            offered.append((-quality, position, media_type.lower()))
+
+    for _, _, media_type in sorted(offered):
+        if media_type == COLUMNS_TYPE:
+            return COLUMNS_TYPE
+        if media_type in MSGPACK_TYPES and msgpack is not None:
+            return MSGPACK_TYPE
+        if media_type in ('application/json', '*/*', 'application/*'):
+            return None
+    return None
+
+
+def columns(found, owners):
+    """Columnar layout of (spot, distance) pairs, `owners` mapping owner id to User"""
+    owner_index = {}
+    owner_columns = {'first_name': [], 'last_name': [], 'email': [], 'mobile_number': []}
+    layout = {
+        'id': [], 'title': [], 'lat_e5': [], 'lng_e5': [], 'location': [], 'parking_type': [],
+        'price_per_hour': [], 'max_vehicle_size': [], 'availability_hours': [], 'is_available': [],
+        'description': [], 'distance_m': [], 'owner': [],
+    }
+    for spot, distance in found:
+        owner = owners.get(spot.owner_id)
+        if owner is None:
+            layout['owner'].append(None)
+        else:
+            if owner.id not in owner_index:
+                owner_index[owner.id] = len(owner_index)
+                for name, values in owner_columns.items():
+                    values.append(getattr(owner, name))
+            layout['owner'].append(owner_index[owner.id])
+        layout['id'].append(spot.id)
+        layout['title'].append(spot.title or f"Parking Spot {spot.id}")
+        layout['lat_e5'].append(round(float(spot.latitude) * COORD_SCALE))
+        layout['lng_e5'].append(round(float(spot.longitude) * COORD_SCALE))
+        layout['location'].append(spot.location)
+        layout['parking_type'].append(spot.parking_type)
+        layout['price_per_hour'].append(float(spot.price_per_hour) if spot.price_per_hour else 0)
+        layout['max_vehicle_size'].append(spot.max_vehicle_size)
+        layout['availability_hours'].append(spot.availability_hours or "24/7")
+        layout['is_available'].append(spot.is_available)
+        layout['description'].append(spot.description)
+        layout['distance_m'].append(round(distance * 1000))
+    return {
+        'version': LAYOUT_VERSION,
+        'count': len(found),
+        'coord_scale': COORD_SCALE,
+        'columns': layout,
+        'owners': owner_columns,
+    }
+
+
+def encode(media_type, payload):
+    """Body bytes of a columnar payload in `media_type`"""
+    if media_type == MSGPACK_TYPE:
+        return msgpack.packb(payload, use_bin_type=True)
+    return spot_json.dumps(payload)
@@ -0,0 +1,93 @@
+"""
+Background tasks run by `manage.py run_jobs` (see core/jobs.py).
+
+Payloads are JSON, so tasks take plain values (ids, paths, dicts) and load
+what they need themselves. A task may run more than once (a retry after a
+crash past its commit), so each one is safe to repeat.
+"""
+import hashlib
+import os
+
+from django.conf import settings
+
+from core.jobs import task
+from core.merch_metrics import DEFAULT_CHUNKSIZE, MetricsAccumulator, aggregate_csv_files, iter_json_products
+from core.models.merch_metric import MerchMetric
+from core.models.parking_spot import ParkingSpot
+
+
+def spot_summary(parking_spot):
+    return {
+        'id': parking_spot.id,
+        'title': parking_spot.title,
+        'location': parking_spot.location,
+        'latitude': parking_spot.latitude,
+        'longitude': parking_spot.longitude,
+        'price_per_hour': parking_spot.price_per_hour,
+        'parking_type': parking_spot.parking_type,
+        'is_available': parking_spot.is_available,
+        'max_vehicle_size': parking_spot.max_vehicle_size,
+        'availability_hours': parking_spot.availability_hours,
+    }
+
+
+@task('spots.create_for_signup', max_attempts=5, retry_delay=10)
+def create_signup_spot(parking_data):
+    """The parking spot a provider described when signing up"""
+    for spot in ParkingSpot.get_by_owner(parking_data['owner_id']):
+        # Already created by an attempt that died before recording its result
+        if (spot.latitude, spot.longitude) == (float(parking_data['latitude']), float(parking_data['longitude'])):
+            return {'parking_spot': spot_summary(spot)}
+    return {'parking_spot': spot_summary(ParkingSpot.add(dict(parking_data)))}
+
+
+def batch_id_for(paths):
+    digest = hashlib.sha1()
+    for path in paths:
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+@task('merch.ingest', max_attempts=3, retry_delay=60, concurrency=1)
+def ingest_merch(sales=(), reviews=(), returns=(), json_files=(), batch_id=None,
+                 chunksize=DEFAULT_CHUNKSIZE, workers=None):
+    """Apply a batch of merch files to the metrics store; the batch id makes repeats no-ops"""
+    inputs = [*sales, *reviews, *returns, *json_files]
+    missing = [path for path in inputs if not os.path.exists(path)]
+    if missing:
+        raise FileNotFoundError(f"File not found: {', '.join(missing)}")
+
+    workers = workers or getattr(settings, 'MERCH_OFFLINE_MAX_WORKERS', 1)
+    accumulator = aggregate_csv_files(sales, reviews, returns, chunksize=chunksize, max_workers=workers)
+    product_names = {}
+    for path in json_files:
+        batch = MetricsAccumulator()
+        with open(path, 'rb') as f:
+            for product in iter_json_products(f):
+                product_names[product['asin']] = product['product']
+                batch.add_product(product)
+        accumulator.merge(batch)
+
+    batch_id = batch_id or batch_id_for(inputs)
+    touched = MerchMetric.ingest(accumulator, product_names, batch_id=batch_id)
+    return {'batch_id': batch_id, 'products_updated': touched, 'skipped': touched is None}
+
+
+@task('merch.rebuild_dashboard', concurrency=1, public=True)
+def rebuild_merch_dashboard(source=None, mode=None):
+    """Recompute the dashboard data, leaving the shared merch cache warm for the web workers"""
+    from core.views.users_view import load_merch_metrics
+    rows, _ = load_merch_metrics(
+        source, mode, max_workers=getattr(settings, 'MERCH_OFFLINE_MAX_WORKERS', 1), backend='process',
+    )
+    return {'rows': len(rows)}
+
+
+@task('spots.publish_catalog', concurrency=1, public=True)
+def publish_spot_catalog():
+    """Publish a spot catalog snapshot at the current head, for the nearest-spot indexes to pick up"""
+    from core.spot_catalog import catalog
+    snapshot = catalog.publish(min_version=ParkingSpot.head_seqs())
+    return {'path': os.path.basename(snapshot.path), 'spots': len(snapshot)}
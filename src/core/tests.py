@@ -1,3 +1,1792 @@
-from django.test import TestCase
+import bisect
+import gzip
+import io
+import json
+import math
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+import types
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.http import JsonResponse
+from django.core.management import call_command
+from django.test import Client, RequestFactory, TestCase, override_settings
+from django.urls import path
+from sqlalchemy import delete, event, func, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import ORMExecuteState, sessionmaker
+from sqlalchemy.util import ThreadLocalRegistry
+
+from core import (
+    admission, jobs, metrics, opening_hours, query_detector, seeding, sharding, spot_json, spot_wire, sqlalchemy_engine
+)
+from core.auth_utils import generate_jwt
+from core.benchmark import compare_reports, percentile, run_benchmarks
+from core.geo_cluster import ClusterIndex
+from core.merch_cache import MerchDatasetCache
+from core.merch_metrics import (
+    MetricsAccumulator, UploadTooLarge, aggregate_csv_files, build_csv_metrics, build_metrics, build_rows, get_executor,
+    iter_json_products,
+)
+from core.merch_query import NO_ISSUES, SORT_FIELDS, InvalidQuery, query_page, query_rows
+from core.models import ChangeCounter, Job, MerchBatch, MerchMetric, ParkingSpot, ParkingSpotHours, User, UserRole
+from core.models.parking_spot import PRICE_BUCKETS, price_bucket_label
+from core.models.reservation import Reservation, ReservationConflict
+from core.query_detector import QueryProblem
+from core.spot_catalog import SpotCatalog
+from core.spot_index import LiveSpotIndex
+from core.spot_text import TextIndex, haversine_km, query_terms
+from core.spot_tree import NearestIndex, SpotFilter
+from core.spot_wire import COLUMNS_TYPE, COORD_SCALE, MSGPACK_TYPE
+from core.tasks import create_signup_spot, rebuild_merch_dashboard
+from core.views.parking_spot_view import spot_payload
+from core.views.users_view import load_merch_metrics
+
+
+def _temp_dir(test):
+    path = tempfile.mkdtemp(prefix='parkspacehub-test-')
+    test.addCleanup(shutil.rmtree, path, ignore_errors=True)
+    return path
+
+
+def _add_users(count):
+    users = [User(first_name=f'User {i}', email=f'user{i}@example.com', password='unused') for i in range(count)]
+    sqlalchemy_engine.session.add_all(users)
+    sqlalchemy_engine.session.commit()
+    return users
+
+
+def _add_spot(latitude, longitude, **fields):
+    return ParkingSpot.add({
+        'title': 'Test spot', 'location': 'Test Road', 'latitude': latitude, 'longitude': longitude,
+        'price_per_hour': 40, 'parking_type': 'open', 'is_available': 'yes', **fields,
+    })
+
+
+def _list_users(request):
+    return JsonResponse({'emails': [user.email for user in User.query.order_by(User.id).all()]})
+
+
+def _list_users_one_by_one(request):
+    ids = [user_id for (user_id,) in sqlalchemy_engine.session.query(User.id).order_by(User.id)]
+    return JsonResponse({'emails': [User.get_by_id(user_id).email for user_id in ids]})
+
+
+# Mounted with ROOT_URLCONF='core.tests' by tests that need views of their own
+urlpatterns = [
+    path('users/', _list_users),
+    path('users/one-by-one/', _list_users_one_by_one),
+]
+
+
+def _write(path, text):
+    with open(path, 'w') as f:
+        f.write(text)
+    return path
+
+
+# Nothing a test does should land in the repo's cache/ directories or throttle its requests
+@override_settings(METRICS_DIR=None, ADMISSION_CLASSES={})
+class AppTestCase(TestCase):
+    pass
+
+
+class DatabaseTestCase(AppTestCase):
+    """
+    Points the SQLAlchemy engine and session at fresh SQLite files for each
+    test. `shards` adds a database per extra shard id and `regions` maps
+    geohash prefixes to them, as DATABASE_SHARDS/SPOT_SHARD_REGIONS would.
+    """
+    shards = ()
+    regions = {}
+
+    def setUp(self):
+        super().setUp()
+        dir = _temp_dir(self)
+        saved = (sqlalchemy_engine.engine, dict(sharding.engines), sharding.shard_map,
+                 sqlalchemy_engine.session.session_factory, sqlalchemy_engine.session.registry)
+        self.addCleanup(self._restore, *saved)
+        sqlalchemy_engine.session.remove()
+        url, shard_urls = self.database_urls(dir)
+        self.engine = sqlalchemy_engine._create_engine(url)
+        options = sharding.configure(self.engine, shard_urls, self.regions, sqlalchemy_engine._create_engine) or {}
+        sqlalchemy_engine.engine = self.engine
+        self._use_session_factory(sessionmaker(bind=self.engine, **options))
+        for engine in sharding.engines.values():
+            sqlalchemy_engine.Base.metadata.create_all(engine)
+        # Spot ids start over in every test database
+        spot_json.spot_fragments.clear()
+
+    def database_urls(self, dir):
+        """(URL of the default database, {shard id: URL}) for a test using `dir`"""
+        return f'sqlite:///{dir}/default.db', {shard: f'sqlite:///{dir}/{shard}.db' for shard in self.shards}
+
+    @staticmethod
+    def _use_session_factory(factory):
+        sqlalchemy_engine.session.session_factory = factory
+        sqlalchemy_engine.session.registry = ThreadLocalRegistry(factory)
+
+    def _restore(self, engine, engines, shard_map, factory, registry):
+        sqlalchemy_engine.session.remove()
+        for shard_engine in sharding.engines.values():
+            shard_engine.dispose()
+        sqlalchemy_engine.engine = engine
+        sharding.engines.clear()
+        sharding.engines.update(engines)
+        sharding.shard_map = shard_map
+        sharding._spot_shards.clear()
+        sqlalchemy_engine.session.session_factory = factory
+        sqlalchemy_engine.session.registry = registry
+
+
+class PostgresTestCase(DatabaseTestCase):
+    """
+    DatabaseTestCase on the scratch Postgres database named by the
+    TEST_POSTGRES_URL environment variable, whose tables are dropped and
+    recreated around every test. Skipped when the variable is not set.
+    Subclass it together with a SQLite test case to run the same tests on
+    both backends.
+    """
+
+    def setUp(self):
+        if not os.environ.get('TEST_POSTGRES_URL'):
+            self.skipTest('TEST_POSTGRES_URL is not set')
+        engine = sqlalchemy_engine._create_engine(os.environ['TEST_POSTGRES_URL'])
+        sqlalchemy_engine.Base.metadata.drop_all(engine)
+        engine.dispose()
+        super().setUp()
+        self.addCleanup(self._drop_tables)
+
+    def database_urls(self, dir):
+        return os.environ['TEST_POSTGRES_URL'], {}
+
+    def _drop_tables(self):
+        sqlalchemy_engine.session.remove()
+        sqlalchemy_engine.Base.metadata.drop_all(self.engine)
+
+
+class MerchDatasetCacheTests(AppTestCase):
+
+    def setUp(self):
+        self.dir = _temp_dir(self)
+        self.csv = _write(os.path.join(self.dir, 'sales.csv'), 'asin,gmv\nA,1\n')
+        self.builds = 0
+
+    def build(self):
+        self.builds += 1
+        return [{'rows': self.builds}], {}
+
+    def test_memory_hit_skips_builder(self):
+        cache = MerchDatasetCache(os.path.join(self.dir, 'cache'))
+        first = cache.get_or_build([self.csv], self.build)
+        second = cache.get_or_build([self.csv], self.build)
+        self.assertEqual(self.builds, 1)
+        self.assertIs(first, second)
+
+    def test_new_process_reads_disk_snapshot(self):
+        cache_dir = os.path.join(self.dir, 'cache')
+        MerchDatasetCache(cache_dir).get_or_build([self.csv], self.build)
+        value = MerchDatasetCache(cache_dir).get_or_build([self.csv], self.build)
+        self.assertEqual(self.builds, 1)
+        self.assertEqual(value, ([{'rows': 1}], {}))
+
+    def test_changed_file_rebuilds_and_drops_old_snapshot(self):
+        cache_dir = os.path.join(self.dir, 'cache')
+        cache = MerchDatasetCache(cache_dir)
+        cache.get_or_build([self.csv], self.build)
+        _write(self.csv, 'asin,gmv\nA,1\nB,2\n')
+        os.utime(self.csv, ns=(time.time_ns() + 10**9,) * 2)
+        value = cache.get_or_build([self.csv], self.build)
+        self.assertEqual(value[0], [{'rows': 2}])
+        self.assertEqual(len([n for n in os.listdir(cache_dir) if n.endswith('.pkl')]), 1)
+
+    def test_unreadable_snapshot_is_rebuilt(self):
+        cache_dir = os.path.join(self.dir, 'cache')
+        MerchDatasetCache(cache_dir).get_or_build([self.csv], self.build)
+        for name in os.listdir(cache_dir):
+            _write(os.path.join(cache_dir, name), 'not a pickle')
+        value = MerchDatasetCache(cache_dir).get_or_build([self.csv], self.build)
+        self.assertEqual(value[0], [{'rows': 2}])
+
+    def test_invalidate_forgets_memory_and_disk(self):
+        cache_dir = os.path.join(self.dir, 'cache')
+        cache = MerchDatasetCache(cache_dir)
+        cache.get_or_build([self.csv], self.build)
+        cache.invalidate()
+        self.assertEqual(os.listdir(cache_dir), [])
+        cache.get_or_build([self.csv], self.build)
+        self.assertEqual(self.builds, 2)
+
+
+class IterJsonProductsTests(AppTestCase):
+
+    def products(self, text, **kwargs):
+        return list(iter_json_products(io.BytesIO(text.encode('utf-8')), **kwargs))
+
+    def test_matches_json_load_at_any_chunk_size(self):
+        path = os.path.join(settings.BASE_DIR, 'sde2_merchtech_dataset.json')
+        with open(path, 'rb') as f:
+            expected = json.load(f)['products']
+        for chunk_size in (1, 7, 64, 64 * 1024):
+            with open(path, 'rb') as f:
+                self.assertEqual(list(iter_json_products(f, chunk_size=chunk_size)), expected)
+
+    def test_other_keys_and_multibyte_text_across_chunks(self):
+        doc = {'meta': {'products': 'not this one'}, 'products': [{'asin': 'A', 'product': 'Café ☕'}, {}],
+               'after': [1, 2.5, None]}
+        self.assertEqual(self.products(json.dumps(doc, ensure_ascii=False), chunk_size=3), doc['products'])
+
+    def test_empty_inputs(self):
+        self.assertEqual(self.products('{}'), [])
+        self.assertEqual(self.products('{"products": []}'), [])
+
+    def test_number_split_at_chunk_boundary(self):
+        self.assertEqual(self.products('{"products": [12345, 6.75e2]}', chunk_size=4), [12345, 675.0])
+
+    def test_max_bytes_and_progress(self):
+        seen = []
+        text = json.dumps({'products': [{'asin': str(i)} for i in range(50)]})
+        self.assertEqual(len(self.products(text, chunk_size=16, progress=seen.append)), 50)
+        self.assertEqual(seen[-1], len(text))
+        with self.assertRaises(UploadTooLarge):
+            self.products(text, chunk_size=16, max_bytes=100)
+
+    def test_invalid_json_raises_value_error(self):
+        for text in ('[]', '{"products": [1 2]}', '{"products": [{"asin": }]}'):
+            with self.assertRaises(ValueError):
+                self.products(text)
+
+
+class MetricsAccumulatorTests(AppTestCase):
+
+    def test_streamed_products_match_dataframe_aggregation(self):
+        products = [
+            {'asin': 'A', 'sales': [{'asin': 'A', 'gmv': 10.0, 'units_sold': 2, 'refunds': 0},
+                                    {'asin': 'A', 'gmv': 5.0, 'units_sold': 1, 'refunds': 1}],
+             'reviews': [{'asin': 'A', 'rating': 4}, {'asin': 'A', 'rating': 'n/a'}],
+             'returns': [{'asin': 'A', 'count': '1'}]},
+            {'asin': 'B', 'sales': [{'asin': 'B', 'gmv': 1.0, 'units_sold': 4, 'refunds': 0}],
+             'reviews': [], 'returns': []},
+        ]
+        accumulator = MetricsAccumulator()
+        for product in products:
+            accumulator.add_product(product)
+
+        def frame(kind):
+            return pd.DataFrame([r for p in products for r in p[kind]], columns=['asin', *{
+                'sales': ['gmv', 'units_sold', 'refunds'], 'reviews': ['rating'], 'returns': ['count'],
+            }[kind]])
+
+        expected, _ = build_metrics(frame('sales'), frame('reviews'), frame('returns'))
+        self.assertEqual(build_rows(accumulator.to_frame())[0], expected)
+
+
+class CsvAggregationTests(AppTestCase):
+
+    def setUp(self):
+        self.sources = [os.path.join(settings.BASE_DIR, f'sde2_{name}.csv') for name in ('sales', 'reviews', 'returns')]
+
+    def test_chunked_matches_memory(self):
+        expected = build_csv_metrics(*self.sources, mode='memory')
+        for chunksize in (1, 3, 1000):
+            self.assertEqual(build_csv_metrics(*self.sources, mode='chunked', chunksize=chunksize), expected)
+
+    def test_split_files_match_one_file(self):
+        sales = self.sources[0]
+        with open(sales) as f:
+            header, *lines = f.read().splitlines()
+        dir = _temp_dir(self)
+        parts = [
+            _write(os.path.join(dir, f'sales-{i}.csv'), '\n'.join([header, *lines[i::3]]) + '\n')
+            for i in range(3)
+        ]
+        expected = build_csv_metrics(*self.sources)
+        for backend in ('thread', 'process'):
+            self.assertEqual(build_csv_metrics(parts, *self.sources[1:], max_workers=2, backend=backend), expected)
+
+    def test_unknown_mode_is_rejected(self):
+        with self.assertRaises(ValueError):
+            build_csv_metrics(*self.sources, mode='streaming')
+
+
+class MerchWorkerTests(AppTestCase):
+
+    def setUp(self):
+        dir = _temp_dir(self)
+        patcher = mock.patch('core.views.users_view.merch_cache', MerchDatasetCache(os.path.join(dir, 'cache')))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        sales = os.path.join(settings.BASE_DIR, 'sde2_sales.csv')
+        self.sources = {'sales': [sales, _write(os.path.join(dir, 'more-sales.csv'), 'asin,gmv,units_sold,refunds\n')]}
+
+    def test_requests_do_not_start_a_process_pool(self):
+        with self.settings(MERCH_CSV_SOURCES=self.sources), \
+                mock.patch('core.merch_metrics.ProcessPoolExecutor', side_effect=AssertionError('process pool')):
+            rows, _ = load_merch_metrics('csv')
+        self.assertTrue(rows)
+
+    def test_background_rebuild_uses_the_offline_process_pool(self):
+        with self.settings(MERCH_CSV_SOURCES=self.sources, MERCH_OFFLINE_MAX_WORKERS=3), \
+                mock.patch('core.merch_metrics.get_executor', wraps=get_executor) as executor:
+            self.assertTrue(rebuild_merch_dashboard()['rows'])
+        executor.assert_called_once_with(3, 'process')
+
+
+class MerchMetricStoreTests(DatabaseTestCase):
+
+    def batch(self, *products):
+        accumulator = MetricsAccumulator()
+        for asin, sales, ratings, returns in products:
+            accumulator.add_product({
+                'asin': asin,
+                'sales': [{'asin': asin, 'gmv': gmv, 'units_sold': units, 'refunds': refunds}
+                          for gmv, units, refunds in sales],
+                'reviews': [{'asin': asin, 'rating': rating} for rating in ratings],
+                'returns': [{'asin': asin, 'count': count} for count in returns],
+            })
+        return accumulator
+
+    def test_batches_add_up_and_repeats_are_skipped(self):
+        first = self.batch(('A', [(10, 2, 1)], [4], []))
+        second = self.batch(('A', [(5, 1, 0)], [2], [3]), ('B', [], [5], []))
+        self.assertEqual(MerchMetric.ingest(first, {'A': 'Lamp'}, batch_id='week-1'), 1)
+        self.assertEqual(MerchMetric.ingest(second, batch_id='week-2'), 2)
+        self.assertIsNone(MerchMetric.ingest(second, batch_id='week-2'))
+
+        accumulator, names = MerchMetric.load_accumulator()
+        self.assertEqual(names, {'A': 'Lamp'})
+        self.assertEqual(list(accumulator.sales['A']), [15, 3, 1])
+        self.assertEqual(list(accumulator.reviews['A']), [6, 2])
+        self.assertEqual(accumulator.returns, {'A': 3})
+        self.assertNotIn('B', accumulator.sales)
+        self.assertEqual(MerchBatch.query.count(), 2)
+
+    def test_store_matches_csv_aggregation(self):
+        sources = [os.path.join(settings.BASE_DIR, f'sde2_{name}.csv') for name in ('sales', 'reviews', 'returns')]
+        MerchMetric.ingest(aggregate_csv_files(*sources), chunk_size=4)
+        stored, _ = MerchMetric.load_accumulator()
+        self.assertEqual(build_rows(stored.to_frame()), build_csv_metrics(*sources))
+
+
+def _dashboard_rows(count):
+    return [{
+        'product_id': f'ASIN-{i:04d}', 'product_name': f'Product {i % 7}', 'gmv': float(i % 5 * 100),
+        'avg_rating': i % 3 + 2.5, 'return_rate': i % 4 * 0.1, 'total_orders': i % 6,
+        'issues': 'Low GMV' if i % 5 == 0 else 'Low Rating, High Return Rate' if i % 3 == 0 else NO_ISSUES,
+    } for i in range(count)]
+
+
+class MerchQueryTests(AppTestCase):
+
+    def walk(self, rows, **query):
+        seen, cursor = [], None
+        while True:
+            page, total, cursor = query_page(rows, cursor=cursor, limit=4, **query)
+            seen += page
+            if not cursor:
+                return seen, total
+
+    def test_pages_cover_the_sorted_rows_once_despite_ties(self):
+        rows = _dashboard_rows(37)
+        for sort, field in SORT_FIELDS.items():
+            for descending in (True, False):
+                expected = sorted(rows, key=lambda r: (r[field], r['product_id']), reverse=descending)
+                self.assertEqual(self.walk(rows, sort=sort, descending=descending), (expected, 37))
+
+    def test_issue_filter_and_top(self):
+        rows = _dashboard_rows(37)
+        seen, total = self.walk(rows, issue='Low Rating', top=5)
+        self.assertEqual(total, 5)
+        self.assertEqual(seen, query_rows(rows, issue='Low Rating', top=5))
+        self.assertTrue(all('Low Rating' in r['issues'] for r in seen))
+        none, _ = self.walk(rows, issue='none')
+        self.assertTrue(none and all(r['issues'] == NO_ISSUES for r in none))
+
+    def test_invalid_queries(self):
+        rows = _dashboard_rows(10)
+        _, _, cursor = query_page(rows, sort='gmv', limit=2)
+        for query in ({'sort': 'price'}, {'issue': 'Late'}, {'cursor': 'not-a-cursor'},
+                      {'cursor': cursor, 'sort': 'rating'}, {'cursor': cursor, 'descending': False}):
+            with self.assertRaises(InvalidQuery):
+                query_page(rows, **query)
+
+    def test_api_pages_and_rejects_bad_parameters(self):
+        rows = _dashboard_rows(12)
+        with mock.patch('core.views.merch_api_view.load_merch_metrics', return_value=(rows, {})):
+            first = self.client.get('/api/merch-metrics/', {'limit': 10, 'sort': 'name', 'order': 'asc'}).json()
+            second = self.client.get('/api/merch-metrics/', {
+                'limit': 10, 'sort': 'name', 'order': 'asc', 'cursor': first['next_cursor'],
+            }).json()
+            bad = [self.client.get('/api/merch-metrics/', params).status_code
+                   for params in ({'limit': 0}, {'top': 'x'}, {'sort': 'price'}, {'cursor': first['next_cursor']})]
+        self.assertEqual(first['count'], 12)
+        self.assertEqual(len(first['chart_data']['labels']), 12)
+        self.assertNotIn('chart_data', second)
+        self.assertIsNone(second['next_cursor'])
+        self.assertEqual(first['results'] + second['results'], query_rows(rows, 'name', descending=False))
+        self.assertEqual(bad, [400] * 4)
+
+
+class DownloadJsonTests(AppTestCase):
+
+    def setUp(self):
+        self.cache_dir = os.path.join(_temp_dir(self), 'download')
+        with open(os.path.join(settings.BASE_DIR, 'sde2_merchtech_dataset.json'), 'rb') as f:
+            self.body = f.read()
+
+    def get(self, **headers):
+        with self.settings(DOWNLOAD_CACHE_DIR=self.cache_dir):
+            return self.client.get('/download-json/', headers=headers)
+
+    def test_full_body_and_revalidation(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.body)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(self.get(if_none_match=response['ETag']).status_code, 304)
+        self.assertEqual(self.get(if_modified_since=response['Last-Modified']).status_code, 304)
+
+    def test_ranges(self):
+        etag = self.get()['ETag']
+        response = self.get(range='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), self.body[10:20])
+        self.assertEqual(response['Content-Range'], f'bytes 10-19/{len(self.body)}')
+        self.assertEqual(b''.join(self.get(range='bytes=-5').streaming_content), self.body[-5:])
+        self.assertEqual(self.get(range=f'bytes={len(self.body)}-').status_code, 416)
+        self.assertEqual(self.get(range='bytes=0-9', if_range=etag).status_code, 206)
+        self.assertEqual(self.get(range='bytes=0-9', if_range='"stale"').status_code, 200)
+
+    def test_gzip_copy_is_made_once(self):
+        response = self.get(accept_encoding='gzip, br')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), self.body)
+        self.assertNotEqual(response['ETag'], self.get()['ETag'])
+        self.assertIn('Accept-Encoding', response['Vary'])
+        with mock.patch('core.http_utils.gzip.GzipFile', side_effect=AssertionError('recompressed')):
+            self.assertEqual(self.get(accept_encoding='gzip').status_code, 200)
+        # Range requests are answered from the uncompressed file
+        self.assertEqual(self.get(accept_encoding='gzip', range='bytes=0-0').status_code, 206)
+
+    def test_gzip_only_when_acceptable(self):
+        accepted = {
+            'gzip': True, 'GZIP;q=0.5': True, 'br, *': True, 'gzip;q=0': False, 'gzip; q=0.000': False,
+            'x-gzip': False, 'br': False, '*;q=0': False, 'gzip;q=0, *': False, 'identity;q=0, *;q=0.1': True,
+            '': False,
+        }
+        for header, gzipped in accepted.items():
+            response = self.get(accept_encoding=header)
+            self.assertEqual(response.get('Content-Encoding') == 'gzip', gzipped, header)
+
+
+class BenchmarkTests(DatabaseTestCase):
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual([percentile(values, p) for p in (0, 50, 95, 100)], [1, 50, 95, 100])
+        self.assertEqual(percentile([7], 99), 7)
+        self.assertIsNone(percentile([], 50))
+
+    def test_compare_reports(self):
+        def report(p50, rps, queries, name='login'):
+            return {'results': [{'scenario': name, 'latency_ms': {'p50': p50, 'p95': p50 * 2},
+                                 'throughput_rps': rps, 'queries_per_request': queries}]}
+        self.assertEqual(compare_reports(report(10, 100, 3), report(12, 80, 2)), [{
+            'scenario': 'login', 'p50_change_pct': 20.0, 'p95_change_pct': 20.0,
+            'throughput_change_pct': -20.0, 'queries_change': -1,
+        }])
+        self.assertEqual(compare_reports(report(10, 100, 3), report(12, 80, 2, name='signup')), [])
+
+    def test_run_against_a_seeded_database(self):
+        url = f'sqlite:///{_temp_dir(self)}/bench.db'
+        report = run_benchmarks(url, users=2, spots=50, iterations=3, warmup=1, radii=(5,),
+                                only=['nearby', 'download'])
+        self.assertEqual(report['meta']['database'], 'sqlite')
+        results = {r['scenario']: r for r in report['results']}
+        self.assertEqual(set(results), {'nearby_search_r5km', 'download_json'})
+        self.assertEqual(results['nearby_search_r5km']['status_codes'], {'200': 3})
+        self.assertGreater(results['nearby_search_r5km']['queries_per_request'], 0)
+        self.assertEqual(results['download_json']['queries_per_request'], 0)
+
+
+class SeedingTests(DatabaseTestCase):
+
+    def test_clusters_are_round_at_any_latitude(self):
+        rng = random.Random(1)
+        for lat in (0.0, 60.0):
+            with mock.patch('core.seeding.CITIES', [('Somewhere', lat, 10.0, 1)]), \
+                    mock.patch('core.seeding.CENTRE_SHARE', 1.0):
+                points = [seeding.spot_coordinates(rng)[1:] for _ in range(4000)]
+            km_north = statistics.pstdev(p[0] for p in points) * seeding.KM_PER_DEGREE
+            km_east = statistics.pstdev(p[1] for p in points) * seeding.KM_PER_DEGREE * math.cos(math.radians(lat))
+            self.assertAlmostEqual(km_east / km_north, 1.0, delta=0.1)
+            self.assertAlmostEqual(km_north, seeding.CENTRE_SIGMA_KM, delta=0.25)
+
+    def test_seed_database(self):
+        emails, provider_ids = seeding.seed_database(self.engine, users=10, spots=200, batch_size=64)
+        self.assertEqual(len(emails), 10)
+        self.assertEqual(len(provider_ids), 3)
+        with self.engine.connect() as conn:
+            spots = conn.execute(select(ParkingSpot.owner_id, ParkingSpot.change_seq)).all()
+            hours = conn.execute(select(func.count()).select_from(ParkingSpotHours)).scalar()
+        self.assertEqual(len(spots), 200)
+        self.assertEqual(len({seq for _, seq in spots}), 200)
+        self.assertTrue({owner for owner, _ in spots} <= set(provider_ids))
+        self.assertGreater(hours, 0)
+        self.assertIsNotNone(User.authenticate(emails[0], seeding.SEED_PASSWORD))
+
+
+@override_settings(ROOT_URLCONF='core.tests', PERF_PROFILE_TOKEN='let-me-profile', PERF_PROFILER='cprofile')
+class PerformanceMiddlewareTests(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        _add_users(3)
+        self.profile_dir = _temp_dir(self)
+
+    def get(self, **headers):
+        with self.settings(PERF_PROFILE_DIR=self.profile_dir):
+            return self.client.get('/users/', headers=headers)
+
+    def timings(self, response):
+        return {part.split(';')[0] for part in response['Server-Timing'].split(', ')}
+
+    def test_plain_requests_leave_orm_results_alone(self):
+        with mock.patch.object(ORMExecuteState, 'invoke_statement', side_effect=AssertionError('frozen')):
+            response = self.get()
+        self.assertEqual(len(response.json()['emails']), 3)
+        self.assertEqual(self.timings(response), {'db', 'view', 'total'})
+        self.assertEqual(os.listdir(self.profile_dir), [])
+
+    def test_profiled_requests_report_orm_time(self):
+        response = self.get(x_profile='let-me-profile')
+        self.assertEqual(len(response.json()['emails']), 3)
+        self.assertIn('orm', self.timings(response))
+        self.assertEqual(len(os.listdir(self.profile_dir)), 1)
+        self.assertNotIn('orm', self.timings(self.get(x_profile='guess')))
+
+
+class MetricsTests(AppTestCase):
+    DEAD_PID = 4194305  # above Linux's pid_max, so never a live process
+
+    def setUp(self):
+        self.dir = _temp_dir(self)
+        patcher = mock.patch.object(metrics, '_identity', (None, None))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def write_snapshot(self, name, value):
+        with open(os.path.join(self.dir, name), 'w') as f:
+            json.dump({'counters': [['test_folded_total', [], value]], 'gauges': [['test_gauge', [], 5]],
+                       'histograms': []}, f)
+
+    def render(self):
+        with self.settings(METRICS_DIR=self.dir):
+            return metrics.render()
+
+    def test_dead_processes_are_folded_once(self):
+        self.write_snapshot(f'{self.DEAD_PID}-a1.json', 3)
+        self.assertIn('test_folded_total 3\n', self.render())
+        self.assertNotIn(f'{self.DEAD_PID}-a1.json', os.listdir(self.dir))
+        self.assertIn(metrics.ARCHIVE_FILE, os.listdir(self.dir))
+        self.write_snapshot(f'{self.DEAD_PID}-b2.json', 4)
+        output = self.render()
+        self.assertIn('test_folded_total 7\n', output)
+        self.assertNotIn('test_gauge', output)
+        self.assertIn('test_folded_total 7\n', self.render())
+
+    def test_reused_pid_does_not_take_over_an_old_snapshot(self):
+        self.write_snapshot(f'{os.getpid()}-old.json', 2)
+        metrics.inc('test_folded_total', 1)
+        self.addCleanup(metrics.registry.counters.pop, ('test_folded_total', ()))
+        self.assertIn('test_folded_total 3\n', self.render())
+        names = os.listdir(self.dir)
+        self.assertNotIn(f'{os.getpid()}-old.json', names)
+        self.assertIn(f'{os.getpid()}-{metrics._identity[1]}.json', names)
+
+    def test_snapshot_left_behind_by_an_interrupted_fold_is_not_counted_twice(self):
+        self.write_snapshot(f'{self.DEAD_PID}-a1.json', 3)
+        self.render()
+        self.write_snapshot(f'{self.DEAD_PID}-a1.json', 3)
+        with open(os.path.join(self.dir, metrics.ARCHIVE_FILE)) as f:
+            archive = json.load(f)
+        archive['folded'] = [f'{self.DEAD_PID}-a1.json']
+        with open(os.path.join(self.dir, metrics.ARCHIVE_FILE), 'w') as f:
+            json.dump(archive, f)
+        self.assertIn('test_folded_total 3\n', self.render())
+
+
+class ShardPoolMetricsTests(DatabaseTestCase):
+    shards = ('east',)
+
+    def test_pool_gauges_per_shard(self):
+        output = metrics.render()
+        for shard in ('default', 'east'):
+            self.assertIn(f'db_pool_size{{shard="{shard}"}}', output)
+            self.assertIn(f'db_pool_checkouts_total{{shard="{shard}"}}', output)
+
+
+@override_settings(ROOT_URLCONF='core.tests', QUERY_DETECTOR_REPEAT_THRESHOLD=5)
+class QueryDetectorTests(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        _add_users(6)
+
+    def get(self, path, mode):
+        with self.settings(QUERY_DETECTOR_MODE=mode):
+            return Client().get(path)
+
+    def test_raise_mode_fails_an_n_plus_one_view(self):
+        with self.assertRaises(QueryProblem) as caught:
+            self.get('/users/one-by-one/', 'raise')
+        self.assertIn('N+1 in GET /users/one-by-one/: 6 x', str(caught.exception))
+        self.assertIn('User.get_by_id', str(caught.exception))
+        self.assertEqual(self.get('/users/', 'raise').status_code, 200)
+
+    def test_warn_mode_logs_and_serves(self):
+        with self.assertLogs('core.query_detector', 'WARNING') as logs:
+            response = self.get('/users/one-by-one/', 'warn')
+        self.assertEqual(len(response.json()['emails']), 6)
+        self.assertIn('User.get_by_id', logs.output[0])
+
+    def test_off(self):
+        self.assertEqual(self.get('/users/one-by-one/', 'off').status_code, 200)
+
+    def test_stack_without_qualnames(self):
+        # Before Python 3.11 code objects have no co_qualname
+        code = types.SimpleNamespace(co_filename=os.path.join(query_detector._SRC_ROOT, 'core', 'models', 'users.py'),
+                                     co_name='get_by_id')
+        frame = types.SimpleNamespace(f_code=code, f_lineno=7, f_back=None)
+        with mock.patch.object(query_detector.sys, '_getframe', return_value=frame):
+            stack = query_detector._app_stack()
+        self.assertEqual(stack, [(os.path.join('core', 'models', 'users.py'), 7, 'get_by_id')])
+
+
+KOLKATA = (22.5726, 88.3639)
+
+
+class FacetSearchTests(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        seeding.seed_database(self.engine, users=5, spots=1500, rng=random.Random(7))
+        self.nearby = [
+            spot for spot in ParkingSpot.search(*KOLKATA, 20, limit=10**6)
+            if haversine_km(*KOLKATA, spot.latitude, spot.longitude) <= 20
+        ]
+
+    def expected(self, min_price=None, max_price=None, parking_types=None, vehicle_sizes=None):
+        def price_ok(spot):
+            return (min_price is None or spot.price_per_hour >= min_price) and \
+                (max_price is None or spot.price_per_hour <= max_price)
+        type_ok = lambda spot: not parking_types or spot.parking_type in parking_types
+        size_ok = lambda spot: not vehicle_sizes or spot.max_vehicle_size in vehicle_sizes
+        counts = {'parking_type': {}, 'max_vehicle_size': {}, 'price': {}, 'total': 0}
+        for spot in self.nearby:
+            if size_ok(spot):
+                counts['parking_type'][spot.parking_type] = \
+                    counts['parking_type'].get(spot.parking_type, 0) + price_ok(spot)
+            if type_ok(spot):
+                counts['max_vehicle_size'][spot.max_vehicle_size] = \
+                    counts['max_vehicle_size'].get(spot.max_vehicle_size, 0) + price_ok(spot)
+            if type_ok(spot) and size_ok(spot):
+                bucket = bisect.bisect_left(PRICE_BUCKETS, spot.price_per_hour)
+                counts['price'][bucket] = counts['price'].get(bucket, 0) + 1
+                counts['total'] += price_ok(spot)
+        counts['price'] = {price_bucket_label(i): counts['price'].get(i, 0) for i in range(len(PRICE_BUCKETS) + 1)}
+        return counts
+
+    def test_facet_counts_leave_out_their_own_filter(self):
+        self.assertGreater(len(self.nearby), 100)
+        for filters in ({}, {'parking_types': ['open', 'garage']}, {'vehicle_sizes': ['suv', 'truck']},
+                        {'min_price': 30, 'max_price': 60, 'parking_types': ['covered'], 'vehicle_sizes': ['car']}):
+            self.assertEqual(ParkingSpot.facet_counts(*KOLKATA, 20, **filters), self.expected(**filters))
+
+    def test_search_api_filters_and_counts(self):
+        response = self.client.get('/api/parking-spots/', {
+            'lat': KOLKATA[0], 'lng': KOLKATA[1], 'radius': 20, 'facets': 1,
+            'parking_type': 'open,driveway', 'fits': 'suv', 'max_price': 50,
+        })
+        body = response.json()
+        self.assertEqual(body['facets'], self.expected(
+            max_price=50, parking_types=['open', 'driveway'], vehicle_sizes=['suv', 'truck'],
+        ))
+        self.assertEqual(len(body['results']), min(50, body['facets']['total']))
+        for spot in body['results']:
+            self.assertIn(spot['parking_type'], ('open', 'driveway'))
+            self.assertIn(spot['max_vehicle_size'], ('suv', 'truck'))
+            self.assertLessEqual(spot['price_per_hour'], 50)
+        distances = [spot['distance_km'] for spot in body['results']]
+        self.assertEqual(distances, sorted(distances))
+        bad = self.client.get('/api/parking-spots/', {'lat': KOLKATA[0], 'lng': KOLKATA[1], 'fits': 'plane'})
+        self.assertEqual(bad.status_code, 400)
+
+
+def _destination(lat, lng, bearing, km):
+    """Point `km` from (lat, lng) along the great circle leaving at `bearing` degrees"""
+    p1, b, d = math.radians(lat), math.radians(bearing), km / 6371
+    p2 = math.asin(math.sin(p1) * math.cos(d) + math.cos(p1) * math.sin(d) * math.cos(b))
+    dlng = math.atan2(math.sin(b) * math.sin(d) * math.cos(p1), math.cos(d) - math.sin(p1) * math.sin(p2))
+    return math.degrees(p2), lng + math.degrees(dlng)
+
+
+class RadiusEdgeTests(DatabaseTestCase):
+    """Near the pole, spots poleward of the centre right inside the radius used to be cut off"""
+    TROMSO = (69.6492, 18.9553)
+    RADIUS = 300
+
+    def setUp(self):
+        super().setUp()
+        self.inside = {
+            _add_spot(*_destination(*self.TROMSO, bearing, self.RADIUS * 0.995), parking_type='open').id
+            for bearing in (0, 30, 45, 60, 75, 90, 180, 315)
+        }
+        for bearing in (0, 45, 60, 90, 180):
+            _add_spot(*_destination(*self.TROMSO, bearing, self.RADIUS * 1.005), parking_type='covered')
+
+    def test_search_misses_no_spot_inside_the_radius(self):
+        found = {spot.id for spot in ParkingSpot.search(*self.TROMSO, self.RADIUS, limit=100)}
+        self.assertLessEqual(self.inside, found)
+
+    def test_results_and_facets_agree(self):
+        body = self.client.get('/api/parking-spots/', {
+            'lat': self.TROMSO[0], 'lng': self.TROMSO[1], 'radius': self.RADIUS, 'facets': 1,
+        }).json()
+        self.assertEqual({spot['id'] for spot in body['results']}, self.inside)
+        self.assertEqual(body['facets']['total'], len(self.inside))
+        self.assertEqual(body['facets']['parking_type'], {'open': len(self.inside)})
+
+
+class PostgresRadiusEdgeTests(PostgresTestCase, RadiusEdgeTests):
+    pass
+
+
+MUMBAI = (19.0760, 72.8777)
+
+
+class OpeningHoursTests(AppTestCase):
+    DAY = opening_hours.MINUTES_PER_DAY
+
+    def test_parses_common_formats(self):
+        week = opening_hours.MINUTES_PER_WEEK
+        self.assertEqual(opening_hours.parse_hours('24/7'), [(0, week)])
+        self.assertEqual(opening_hours.parse_hours('9AM-6PM')[0], (9 * 60, 18 * 60))
+        self.assertEqual(len(opening_hours.parse_hours('9AM-6PM')), 7)
+        self.assertEqual(opening_hours.parse_hours('Mon-Fri 9AM-6PM; Sat 10AM-2PM')[-1],
+                         (5 * self.DAY + 10 * 60, 5 * self.DAY + 14 * 60))
+        self.assertEqual(opening_hours.parse_hours('9-6PM')[0], (9 * 60, 18 * 60))
+        self.assertEqual(opening_hours.parse_hours('9-12')[0], (9 * 60, 12 * 60))
+
+    def test_overnight_ranges_wrap_past_sunday(self):
+        for text in ('22:00-06:00', '10PM-6AM', '22-6'):
+            intervals = opening_hours.parse_hours(text)
+            self.assertEqual(intervals[0], (0, 6 * 60), text)
+            self.assertEqual(intervals[-1], (6 * self.DAY + 22 * 60, opening_hours.MINUTES_PER_WEEK), text)
+
+    def test_bare_ranges_closing_before_they_open_are_ambiguous(self):
+        for text in ('9-5', 'Mon-Fri 10-2', '12-8'):
+            with self.assertRaisesRegex(opening_hours.HoursParseError, 'ambiguous'):
+                opening_hours.parse_hours(text)
+        self.assertEqual(opening_hours.parse_hours('9:00-5:00')[0], (0, 5 * 60))
+
+    def test_unrecognised(self):
+        for text in ('', 'whenever', 'Funday 9AM-5PM', '13PM-2PM'):
+            with self.assertRaises(opening_hours.HoursParseError):
+                opening_hours.parse_hours(text)
+
+
+class BackfillHoursTests(DatabaseTestCase):
+    shards = ('east',)
+    regions = {'tun': 'east'}  # Kolkata
+
+    def test_backfills_every_shard_and_logs_skipped_spots(self):
+        west = _add_spot(*MUMBAI, availability_hours='9AM-6PM')
+        east = _add_spot(*KOLKATA, availability_hours='24/7')
+        vague = _add_spot(*KOLKATA, availability_hours='9-5')
+        for engine in sharding.engines.values():
+            with engine.begin() as conn:
+                conn.execute(delete(ParkingSpotHours.__table__))
+
+        out = io.StringIO()
+        with self.assertLogs('core.opening_hours', 'WARNING') as logs:
+            call_command('backfill_hours', stdout=out)
+        self.assertIn('Parsed hours of 2 spots', out.getvalue())
+        self.assertIn(f'1 spots have unrecognised availability_hours and never match open filters: {vague.id}',
+                      out.getvalue())
+        self.assertIn(f"spot {vague.id}, availability_hours '9-5'", logs.output[0])
+
+        def spot_ids(shard):
+            with sharding.engines[shard].connect() as conn:
+                return {row.spot_id for row in conn.execute(select(ParkingSpotHours.spot_id))}
+        self.assertEqual(spot_ids('default'), {west.id})
+        self.assertEqual(spot_ids('east'), {east.id})
+
+
+class ReservationTests(DatabaseTestCase):
+    shards = ('east',)
+    regions = {'tun': 'east'}  # Kolkata
+
+    def setUp(self):
+        super().setUp()
+        self.user, self.other = _add_users(2)
+        self.west = _add_spot(*MUMBAI)
+        self.east = _add_spot(*KOLKATA)
+        self.start = datetime(2030, 1, 7, 9)
+
+    def slot(self, hours_from, hours_to):
+        return self.start + timedelta(hours=hours_from), self.start + timedelta(hours=hours_to)
+
+    def stored_status(self, shard, reservation_id):
+        with sharding.engines[shard].connect() as conn:
+            return conn.execute(select(Reservation.status).where(Reservation.id == reservation_id)).scalar()
+
+    def test_bookings_of_a_spot_never_overlap(self):
+        first = Reservation.book(self.east.id, self.user.id, *self.slot(0, 2))
+        with self.assertRaises(ReservationConflict):
+            Reservation.book(self.east.id, self.other.id, *self.slot(1, 3))
+        Reservation.book(self.east.id, self.other.id, *self.slot(2, 3))  # back to back
+        Reservation.book(self.west.id, self.other.id, *self.slot(0, 2))  # another spot
+        self.assertEqual([r.id for r in Reservation.for_spot(self.east.id, *self.slot(-1, 5))][0], first.id)
+        with self.assertRaises(ValueError):
+            Reservation.book(self.east.id, self.user.id, *self.slot(0, 24 * 8))
+
+    def test_unavailable_spots_cannot_be_booked_but_can_be_cancelled(self):
+        booked = Reservation.book(self.east.id, self.user.id, *self.slot(0, 2))
+        ParkingSpot.get_by_id(self.east.id).update_spot({'is_available': 'no'})
+        with self.assertRaisesRegex(ReservationConflict, 'not available'):
+            Reservation.book(self.east.id, self.other.id, *self.slot(4, 6))
+        booked.cancel()
+        self.assertEqual(self.stored_status('east', booked.id), 'cancelled')
+
+    def test_only_the_overlap_constraint_is_a_conflict(self):
+        def violation(constraint):
+            orig = Exception()
+            orig.diag = types.SimpleNamespace(constraint_name=constraint)
+            return IntegrityError('INSERT INTO reservations ...', {}, orig)
+
+        with mock.patch.object(sqlalchemy_engine.session, 'commit', side_effect=violation('reservations_no_overlap')):
+            with self.assertRaisesRegex(ReservationConflict, 'just booked'):
+                Reservation.book(self.east.id, self.user.id, *self.slot(0, 2))
+        with mock.patch.object(sqlalchemy_engine.session, 'commit', side_effect=violation(None)):
+            with self.assertRaises(IntegrityError):
+                Reservation.book(self.east.id, self.user.id, *self.slot(0, 2))
+        self.assertEqual(Reservation.for_spot(self.east.id, *self.slot(-1, 5)), [])
+
+    def test_lookups_and_cancellation_use_the_spots_shard(self):
+        east = Reservation.book(self.east.id, self.user.id, *self.slot(0, 2))
+        west = Reservation.book(self.west.id, self.user.id, *self.slot(0, 2))
+        self.assertNotEqual(east.id, west.id)
+        self.assertEqual(Reservation.get_by_id(east.id).spot_id, self.east.id)
+        self.assertEqual(Reservation.get_by_id(east.id, spot_id=self.east.id).id, east.id)
+        self.assertIsNone(Reservation.get_by_id(east.id, spot_id=self.west.id))
+
+        spot_id, user_id = self.east.id, self.other.id
+        sqlalchemy_engine.session.remove()
+        Reservation.get_by_id(east.id).cancel()
+        self.assertEqual(self.stored_status('east', east.id), 'cancelled')
+        self.assertEqual(self.stored_status('default', west.id), 'confirmed')
+        # The slot is free again
+        Reservation.book(spot_id, user_id, *self.slot(0, 2))
+
+    def test_api(self):
+        def auth(user):
+            return {'authorization': f'Bearer {generate_jwt(user.id, "seeker")}'}
+
+        booking = {'spot_id': self.east.id, 'starts_at': '2030-01-07T09:00:00Z', 'ends_at': '2030-01-07T11:00:00Z'}
+        created = self.client.post('/api/reservations/', json.dumps(booking), content_type='application/json',
+                                   headers=auth(self.user))
+        self.assertEqual(created.status_code, 201)
+        taken = self.client.post('/api/reservations/', json.dumps(booking), content_type='application/json',
+                                 headers=auth(self.other))
+        self.assertEqual(taken.status_code, 409)
+        booked = self.client.get('/api/reservations/', {'spot_id': self.east.id, 'between': '2030-01-07,2030-01-08'})
+        self.assertEqual(len(booked.json()['booked']), 1)
+
+        url = f"/api/reservations/{created.json()['id']}/"
+        self.assertEqual(self.client.delete(url, headers=auth(self.other)).status_code, 403)
+        self.assertEqual(self.client.delete('/api/reservations/999999/', headers=auth(self.user)).status_code, 404)
+        cancelled = self.client.delete(f'{url}?spot_id={self.east.id}', headers=auth(self.user))
+        self.assertEqual(cancelled.json()['status'], 'cancelled')
+        self.assertEqual(self.stored_status('east', created.json()['id']), 'cancelled')
+
+
+class ClusterIndexTests(DatabaseTestCase):
+    shards = ('east',)
+    regions = {'tun': 'east'}  # Kolkata
+
+    def setUp(self):
+        super().setUp()
+        self.spots = [_add_spot(*KOLKATA, price_per_hour=20 + i) for i in range(3)] + [_add_spot(*MUMBAI)]
+        self.index = ClusterIndex()
+
+    def world(self):
+        _, clusters = self.index.clusters(-80, -179, 80, 179, 0)
+        return {(c['count'], c['min_price']) for c in clusters}
+
+    def test_follows_writes_on_every_shard_without_counting_rows(self):
+        self.assertEqual(self.world(), {(4, 20.0)})
+        statements = []
+        for engine in sharding.engines.values():
+            event.listen(engine, 'before_cursor_execute', lambda *args: statements.append(args[2]))
+
+        _add_spot(*MUMBAI, price_per_hour=5)
+        self.spots[0].soft_delete()
+        self.index.refresh()
+        self.assertEqual(self.world(), {(4, 5.0)})
+        ParkingSpot.get_by_id(self.spots[1].id).update_spot({'is_available': 'no'})
+        self.index.refresh()
+        self.assertEqual(self.world(), {(3, 5.0)})
+        self.assertFalse([s for s in statements if 'count(' in s.lower()])
+
+        _, clusters = self.index.clusters(KOLKATA[0] - 1, KOLKATA[1] - 1, KOLKATA[0] + 1, KOLKATA[1] + 1, 16)
+        self.assertEqual([c['id'] for c in clusters], [self.spots[2].id])
+
+    def test_background_index_never_refreshes_on_the_request_path(self):
+        index = ClusterIndex(background=True)
+        with mock.patch.object(index, '_ensure_thread') as thread:
+            index.clusters(-80, -179, 80, 179, 0)
+            index.mark_stale()
+            with mock.patch.object(index, 'refresh') as refresh:
+                index.clusters(-80, -179, 80, 179, 0)
+        refresh.assert_not_called()
+        thread.assert_called()
+
+    def test_api(self):
+        with mock.patch('core.views.parking_spot_view.cluster_index', self.index):
+            response = self.client.get('/api/parking-spots/clusters/', {'bbox': '60,5,100,35', 'zoom': 3})
+            bad = self.client.get('/api/parking-spots/clusters/', {'bbox': '100,35,60,5', 'zoom': 3})
+        self.assertEqual(sum(c['count'] for c in response.json()['clusters']), 4)
+        self.assertEqual(bad.status_code, 400)
+
+
+class NearestIndexTests(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        seeding.seed_database(self.engine, users=5, spots=600, rng=random.Random(11))
+        catalog = SpotCatalog(_temp_dir(self))
+        patcher = mock.patch('core.spot_tree.catalog', catalog)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.index = NearestIndex()
+        self.origin = KOLKATA
+
+    def brute_force(self, keep=lambda spot: True, max_km=math.inf):
+        spots = sqlalchemy_engine.session.query(ParkingSpot).filter(
+            ParkingSpot.is_active == True, ParkingSpot.is_available == 'yes'
+        ).all()
+        ranked = sorted((haversine_km(*self.origin, s.latitude, s.longitude), s.id) for s in spots if keep(s))
+        return [(spot_id, d) for d, spot_id in ranked if d <= max_km]
+
+    def assertSameRanking(self, found, expected):
+        self.assertEqual([spot_id for spot_id, _ in found], [spot_id for spot_id, _ in expected])
+        for (_, d), (_, want) in zip(found, expected):
+            self.assertAlmostEqual(d, want, places=6)
+
+    def test_matches_brute_force(self):
+        found = list(self.index.nearest(*self.origin))
+        self.assertSameRanking(found, self.brute_force())
+
+    def test_filters_and_radius_are_applied_during_the_walk(self):
+        spot_filter = SpotFilter(min_price=30, max_price=80, parking_types=['covered'])
+        found = list(self.index.nearest(*self.origin, spot_filter, max_km=500))
+        expected = self.brute_force(
+            lambda s: 30 <= s.price_per_hour <= 80 and s.parking_type == 'covered', max_km=500
+        )
+        self.assertTrue(expected)
+        self.assertSameRanking(found, expected)
+
+    def test_overlay_tracks_writes_after_the_snapshot(self):
+        nearest_id = next(self.index.nearest(*self.origin))[0]
+        ParkingSpot.get_by_id(nearest_id).soft_delete()
+        added = _add_spot(self.origin[0] + 0.001, self.origin[1])
+        self.index.refresh()
+
+        found = list(self.index.nearest(*self.origin))
+        self.assertEqual(found[0][0], added.id)
+        self.assertNotIn(nearest_id, [spot_id for spot_id, _ in found])
+        self.assertSameRanking(found, self.brute_force())
+
+    def test_hooks_are_abstract(self):
+        class Partial(LiveSpotIndex):
+            def _load(self):
+                return None, {}
+
+        with self.assertRaises(TypeError):
+            Partial()
+
+
+class SpotJsonTests(DatabaseTestCase):
+
+    def search(self):
+        response = self.client.get('/api/parking-spots/', {'lat': KOLKATA[0], 'lng': KOLKATA[1], 'radius': 5})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_fragment_cache_is_an_lru(self):
+        cache = spot_json.FragmentCache(2)
+        builds = []
+
+        def build(value):
+            return lambda: builds.append(value) or value
+
+        self.assertEqual(cache.get_or_build('a', build(b'1')), b'1')
+        cache.get_or_build('b', build(b'2'))
+        self.assertEqual(cache.get_or_build('a', build(b'x')), b'1')  # hit, now most recent
+        cache.get_or_build('c', build(b'3'))  # evicts b
+        cache.get_or_build('b', build(b'4'))
+        self.assertEqual(builds, [b'1', b'2', b'3', b'4'])
+        self.assertEqual(len(cache), 2)
+
+    def test_results_match_the_uncached_payload(self):
+        owner = User(first_name='Asha', last_name='Roy', email='asha@example.com', password='unused',
+                     mobile_number='9800000000')
+        sqlalchemy_engine.session.add(owner)
+        sqlalchemy_engine.session.commit()
+        spot = _add_spot(*KOLKATA, title='Dalhousie "Square" — covered', owner_id=owner.id)
+        ownerless = _add_spot(KOLKATA[0] + 0.01, KOLKATA[1])
+
+        results = self.search()
+        self.assertEqual([r['id'] for r in results], [spot.id, ownerless.id])
+        expected = {**spot_payload(spot, owner), 'distance_km': 0.0}
+        self.assertEqual(results[0], json.loads(json.dumps(expected)))
+        self.assertEqual(results[1]['owner'], {'first_name': 'Unknown', 'last_name': 'Owner', 'email': ''})
+        self.assertEqual(results[1]['distance_km'], round(haversine_km(*KOLKATA, KOLKATA[0] + 0.01, KOLKATA[1]), 2))
+
+    def test_writes_to_the_spot_or_owner_are_never_served_stale(self):
+        owner = User(first_name='Asha', email='asha@example.com', password='unused')
+        sqlalchemy_engine.session.add(owner)
+        sqlalchemy_engine.session.commit()
+        spot = _add_spot(*KOLKATA, owner_id=owner.id)
+        self.assertEqual(self.search()[0]['price_per_hour'], 40)
+        self.assertEqual(self.search()[0]['price_per_hour'], 40)
+        self.assertEqual(len(spot_json.spot_fragments), 1)
+
+        ParkingSpot.get_by_id(spot.id).update_spot({'price_per_hour': 55})
+        self.assertEqual(self.search()[0]['price_per_hour'], 55)
+        owner = sqlalchemy_engine.session.get(User, owner.id)
+        owner.first_name = 'Ashima'  # updated_at moves on with it
+        sqlalchemy_engine.session.commit()
+        self.assertEqual(self.search()[0]['owner']['first_name'], 'Ashima')
+
+    def test_dumps_matches_the_standard_library(self):
+        value = {'title': 'Café — "lot"', 'price': 12.5, 'ids': [1, 2], 'none': None}
+        with mock.patch.object(spot_json, 'orjson', None):
+            plain = spot_json.dumps(value)
+        self.assertEqual(json.loads(spot_json.dumps(value)), json.loads(plain))
+        self.assertEqual(spot_json.result_json(plain[:-1], 1.234), plain[:-1] + b',"distance_km":1.23}')
+
+
+class WireFormatTests(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        owners = [User(first_name=f'Owner {i}', last_name='Das', email=f'owner{i}@example.com', password='unused',
+                       mobile_number=f'98000000{i:02d}') for i in range(3)]
+        sqlalchemy_engine.session.add_all(owners)
+        sqlalchemy_engine.session.commit()
+        rng = random.Random(5)
+        for i in range(40):
+            owner = {'owner_id': owners[i % 4].id} if i % 4 < 3 else {}
+            _add_spot(KOLKATA[0] + rng.uniform(-0.05, 0.05), KOLKATA[1] + rng.uniform(-0.05, 0.05),
+                      title=f'Spot {i} — "covered"', price_per_hour=rng.choice([0, 20, 35.5]),
+                      description=f'Near gate {i}' if i % 2 else None, **owner)
+
+    def search(self, accept=None, **params):
+        headers = {'HTTP_ACCEPT': accept} if accept else {}
+        return self.client.get('/api/parking-spots/', {'lat': KOLKATA[0], 'lng': KOLKATA[1], 'radius': 20, **params},
+                               **headers)
+
+    @staticmethod
+    def rows(payload):
+        """The columnar layout turned back into the default JSON objects"""
+        columns, owners, scale = payload['columns'], payload['owners'], payload['coord_scale']
+        rows = []
+        for i in range(payload['count']):
+            owner = columns['owner'][i]
+            rows.append({
+                'id': columns['id'][i], 'title': columns['title'][i],
+                'latitude': columns['lat_e5'][i] / scale, 'longitude': columns['lng_e5'][i] / scale,
+                'location': columns['location'][i], 'parking_type': columns['parking_type'][i],
+                'price_per_hour': columns['price_per_hour'][i], 'max_vehicle_size': columns['max_vehicle_size'][i],
+                'availability_hours': columns['availability_hours'][i], 'is_available': columns['is_available'][i],
+                'contact_phone': owners['mobile_number'][owner] if owner is not None else None,
+                'description': columns['description'][i],
+                'owner': {name: owners[name][owner] for name in ('first_name', 'last_name', 'email')}
+                if owner is not None else {'first_name': 'Unknown', 'last_name': 'Owner', 'email': ''},
+                'distance_km': columns['distance_m'][i] / 1000,
+            })
+        return rows
+
+    def assertSameResults(self, rows, expected):
+        self.assertEqual(len(rows), len(expected))
+        for row, want in zip(rows, expected):
+            for field in ('latitude', 'longitude'):
+                self.assertAlmostEqual(row.pop(field), want[field], delta=1 / COORD_SCALE)
+            self.assertAlmostEqual(row.pop('distance_km'), want['distance_km'], delta=0.005)
+            self.assertEqual(row, {k: v for k, v in want.items() if k not in ('latitude', 'longitude', 'distance_km')})
+
+    def test_columns_carry_the_default_results(self):
+        default = self.search()
+        self.assertEqual(default['Content-Type'], 'application/json')
+        expected = default.json()
+        self.assertEqual(len(expected), 40)
+        self.assertEqual(expected, sorted(expected, key=lambda r: r['distance_km']))
+
+        response = self.search(accept=f'{COLUMNS_TYPE}, application/json;q=0.5')
+        self.assertEqual(response['Content-Type'], COLUMNS_TYPE)
+        payload = response.json()
+        self.assertEqual(len(payload['owners']['email']), 3)  # each owner listed once
+        self.assertSameResults(self.rows(payload), expected)
+
+    def test_facets_ride_along_in_every_format(self):
+        expected = self.search(facets='1').json()
+        payload = self.search(accept=COLUMNS_TYPE, facets='1').json()
+        self.assertEqual(payload['facets'], expected['facets'])
+        self.assertSameResults(self.rows(payload), expected['results'])
+
+    @unittest.skipIf(spot_wire.msgpack is None, 'msgpack is not installed')
+    def test_msgpack_matches_columns(self):
+        columns = self.search(accept=COLUMNS_TYPE).json()
+        response = self.search(accept='application/x-msgpack')
+        self.assertEqual(response['Content-Type'], MSGPACK_TYPE)
+        self.assertEqual(spot_wire.msgpack.unpackb(response.content, raw=False), columns)
+
+    def test_negotiation_keeps_json_by_default(self):
+        self.assertEqual(self.search(accept=f'application/json, {COLUMNS_TYPE};q=0.9')['Content-Type'],
+                         'application/json')
+        self.assertEqual(self.search(accept=f'{COLUMNS_TYPE};q=0, */*')['Content-Type'], 'application/json')
+        self.assertEqual(self.search(accept='text/html')['Content-Type'], 'application/json')
+
+
+class PostgresWireFormatTests(PostgresTestCase, WireFormatTests):
+    """WireFormatTests on Postgres: the same results in every format"""
+
+
+class ChangeFeedTests(DatabaseTestCase):
+
+    def changes(self, since=None, **headers):
+        params = {'since': since} if since is not None else {}
+        return self.client.get('/api/parking-spots/changes/', params, **headers)
+
+    def test_counters_hand_out_ascending_numbers_up_to_the_head(self):
+        with self.engine.begin() as conn:
+            first = ChangeCounter.allocate(conn, 'reservations.id', 3)
+            second = ChangeCounter.allocate(conn, 'reservations.id')
+        self.assertEqual(len(set(first + second)), 4)
+        self.assertEqual(first, sorted(first))
+        self.assertLess(first[-1], second[0])
+        with self.engine.connect() as conn:
+            self.assertEqual(ChangeCounter.head(conn, 'reservations.id'), second[0])
+
+    def test_inserts_updates_and_tombstones_since_a_token(self):
+        spots = [_add_spot(*KOLKATA, title=f'Spot {i}') for i in range(3)]
+        first = self.changes()
+        body = first.json()
+        self.assertEqual([s['id'] for s in body['upserted']], [s.id for s in spots])
+        self.assertEqual((body['deleted'], body['has_more']), ([], False))
+        self.assertEqual(self.changes(first.json()['next'], HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+
+        ParkingSpot.get_by_id(spots[0].id).update_spot({'price_per_hour': 55})
+        ParkingSpot.get_by_id(spots[1].id).soft_delete()
+        response = self.changes(body['next'], HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], first['ETag'])
+        delta = response.json()
+        self.assertEqual([(s['id'], s['price_per_hour']) for s in delta['upserted']], [(spots[0].id, 55)])
+        self.assertEqual(delta['deleted'], [spots[1].id])
+        self.assertEqual(self.changes(delta['next']).json()['upserted'], [])
+
+    @override_settings(SPOT_CHANGES_PAGE_SIZE=2)
+    def test_pages_until_caught_up(self):
+        ids = [_add_spot(*KOLKATA).id for _ in range(5)]
+        seen, token, pages = [], None, 0
+        while True:
+            body = self.changes(token).json()
+            seen += [s['id'] for s in body['upserted']]
+            token, pages = body['next'], pages + 1
+            if not body['has_more']:
+                break
+        self.assertEqual((seen, pages), (ids, 3))
+
+    def test_rejects_foreign_tokens(self):
+        self.assertEqual(self.changes('abc').status_code, 400)
+
+
+class PostgresChangeFeedTests(PostgresTestCase, ChangeFeedTests):
+    """ChangeFeedTests on sequences, plus ordering under concurrent writers"""
+
+    def test_head_waits_for_writers_still_holding_a_number(self):
+        slow = self.engine.connect()
+        self.addCleanup(slow.close)
+        slow.begin()
+        held = ChangeCounter.allocate(slow, 'parking_spots')[0]
+        spot = _add_spot(*KOLKATA)  # commits a later number first
+        self.assertGreater(spot.change_seq, held)
+
+        heads = []
+        reader = threading.Thread(target=lambda: heads.append(ParkingSpot.head_seqs()[sharding.DEFAULT_SHARD]))
+        reader.start()
+        reader.join(0.3)
+        self.assertTrue(reader.is_alive())  # a head of spot.change_seq would let a feed skip `held`
+        slow.rollback()
+        reader.join(5)
+        self.assertEqual(heads, [spot.change_seq])
+
+
+class SpotCatalogTests(DatabaseTestCase):
+    shards = ('east',)
+    regions = {'tun': 'east'}  # Kolkata
+
+    def setUp(self):
+        super().setUp()
+        self.dir = _temp_dir(self)
+        self.catalog = SpotCatalog(self.dir)
+
+    def test_empty_catalog(self):
+        snapshot = self.catalog.publish()
+        self.assertEqual((len(snapshot), snapshot.version), (0, {'default': 0, 'east': 0}))
+        self.assertIsNone(snapshot.position(1))
+
+    def test_snapshot_holds_active_spots_at_the_head(self):
+        kolkata = _add_spot(*KOLKATA, parking_type='covered')
+        busy = _add_spot(*MUMBAI, is_available='no', max_vehicle_size='suv')
+        gone = _add_spot(*MUMBAI)
+        gone.soft_delete()
+
+        snapshot = self.catalog.publish()
+        self.assertEqual(snapshot.version, ParkingSpot.head_seqs())
+        self.assertEqual((len(snapshot), snapshot.available_count), (2, 1))
+        self.assertIsNone(snapshot.position(gone.id))
+        row = snapshot.spots[snapshot.position(kolkata.id)]
+        self.assertEqual((row['latitude'], row['longitude']), KOLKATA)
+        self.assertEqual(snapshot.parking_types[row['parking_type']], 'covered')
+        row = snapshot.spots[snapshot.position(busy.id)]
+        self.assertFalse(row['available'])
+        self.assertEqual(snapshot.vehicle_sizes[row['vehicle_size']], 'suv')
+
+    def test_free_text_labels_widen_the_codes(self):
+        spots = [_add_spot(*MUMBAI, parking_type=f'type {i}') for i in range(300)]
+        snapshot = self.catalog.publish()
+        self.assertEqual(snapshot.spots.dtype['parking_type'], np.dtype('<u2'))
+        self.assertEqual(snapshot.spots.dtype['vehicle_size'], np.dtype('u1'))
+        row = snapshot.spots[snapshot.position(spots[-1].id)]
+        self.assertEqual(snapshot.parking_types[row['parking_type']], 'type 299')
+        mask = SpotFilter(parking_types=['type 299']).masker(snapshot)(snapshot.spots)
+        self.assertEqual(list(snapshot.spots['id'][mask]), [spots[-1].id])
+
+    def test_publish_reuses_a_new_enough_snapshot(self):
+        _add_spot(*KOLKATA)
+        first = self.catalog.publish()
+        self.assertIs(self.catalog.publish(min_version=first.version), first)
+
+        spot = _add_spot(*MUMBAI)
+        heads = ParkingSpot.head_seqs()
+        second = self.catalog.publish(min_version=heads)
+        self.assertNotEqual(second.path, first.path)
+        self.assertEqual(second.version, heads)
+        self.assertIsNotNone(second.position(spot.id))
+
+        # Another worker maps the same files without building
+        other = SpotCatalog(self.dir)
+        with mock.patch.object(SpotCatalog, '_write', side_effect=AssertionError('rebuilt')):
+            self.assertEqual(other.publish(min_version=heads).path, second.path)
+
+    def test_old_snapshots_are_pruned(self):
+        for _ in range(4):
+            _add_spot(*KOLKATA)
+            self.catalog.publish(min_version=ParkingSpot.head_seqs())
+        snapshots = [name for name in os.listdir(self.dir) if name.startswith('v')]
+        self.assertEqual(len(snapshots), 2)
+        self.assertIn(os.path.basename(self.catalog.current().path), snapshots)
+
+
+class ShardMapTests(AppTestCase):
+
+    def test_geohash(self):
+        self.assertEqual(sharding.geohash(57.64911, 10.40744, 11), 'u4pruydqqvj')
+        self.assertEqual(sharding.geohash(*KOLKATA, 3), 'tun')
+        south, west, north, east = sharding.geohash_box('tun')
+        self.assertTrue(south <= KOLKATA[0] <= north and west <= KOLKATA[1] <= east)
+
+    def test_longest_prefix_wins(self):
+        shard_map = sharding.ShardMap({'tu': 'east', 'TUN': 'kolkata'})
+        self.assertEqual(shard_map.shard_for(*KOLKATA), 'kolkata')
+        self.assertEqual(shard_map.shard_for(26.0, 89.0), 'east')  # 'tux'
+        self.assertEqual(shard_map.shard_for(*MUMBAI), 'default')
+        self.assertEqual(shard_map.shard_for(None, None), 'default')
+
+    def test_shards_for_box(self):
+        shard_map = sharding.ShardMap({'tun': 'east'})
+        self.assertEqual(shard_map.shards_for_box(22.5, 88.3, 22.6, 88.4), ['east'])
+        self.assertEqual(shard_map.shards_for_box(18, 72, 23, 89), ['default', 'east'])
+        self.assertEqual(shard_map.shards_for_box(18.9, 72.8, 19.1, 73.0), ['default'])
+
+    def test_tokens(self):
+        self.assertEqual(sharding.encode_token({'default': 7}), '7')
+        self.assertEqual(sharding.decode_token('7'), {'default': 7})
+        token = sharding.encode_token({'east': 3, 'default': 7})
+        self.assertEqual(token, 'default:7.east:3')
+        self.assertEqual(sharding.decode_token(token), {'default': 7, 'east': 3})
+        self.assertEqual(sharding.decode_token(''), {})
+        for bad in ('east', 'east:x', 'east:-1', 'default:7.'):
+            with self.assertRaises(ValueError):
+                sharding.decode_token(bad)
+
+
+class ShardRoutingTests(DatabaseTestCase):
+    shards = ('east',)
+    regions = {'tun': 'east'}  # Kolkata
+
+    def spot_ids(self, shard):
+        with sharding.engines[shard].connect() as conn:
+            return sorted(conn.execute(select(ParkingSpot.id)).scalars())
+
+    def statements_on(self, shard):
+        statements = []
+        event.listen(sharding.engines[shard], 'before_cursor_execute', lambda *args: statements.append(args[2]))
+        return statements
+
+    def test_spots_and_their_rows_live_on_their_region_shard(self):
+        kolkata = _add_spot(*KOLKATA, availability_hours='Mon-Fri 09:00-18:00')
+        mumbai = _add_spot(*MUMBAI, availability_hours='Mon-Fri 09:00-18:00')
+        self.assertEqual(self.spot_ids('east'), [kolkata.id])
+        self.assertEqual(self.spot_ids('default'), [mumbai.id])
+        self.assertNotEqual(kolkata.id, mumbai.id)  # ids come from the main database's counter
+        for shard, spot in (('east', kolkata), ('default', mumbai)):
+            with sharding.engines[shard].connect() as conn:
+                self.assertEqual(
+                    set(conn.execute(select(ParkingSpotHours.spot_id)).scalars()), {spot.id}
+                )
+            self.assertEqual(sharding.spot_shard(spot.id), shard)
+
+        sqlalchemy_engine.session.remove()
+        self.assertEqual(ParkingSpot.get_by_id(kolkata.id).latitude, KOLKATA[0])
+        ParkingSpot.get_by_id(kolkata.id).update_spot({'price_per_hour': 60})
+        with sharding.engines['east'].connect() as conn:
+            self.assertEqual(conn.execute(select(ParkingSpot.price_per_hour)).scalar(), 60)
+        with self.assertRaises(ValueError):
+            ParkingSpot.get_by_id(kolkata.id).update_spot({'latitude': MUMBAI[0], 'longitude': MUMBAI[1]})
+        sqlalchemy_engine.session.rollback()
+
+    def test_searches_only_visit_overlapping_shards(self):
+        _add_spot(*KOLKATA)
+        mumbai = _add_spot(*MUMBAI)
+        east = self.statements_on('east')
+        self.assertEqual([s.id for s in ParkingSpot.search(*MUMBAI, 10)], [mumbai.id])
+        self.assertEqual(east, [])
+        self.assertEqual(len(ParkingSpot.search(20.5, 80.5, 1500)), 2)
+        self.assertTrue(east)
+
+    def test_counts_and_change_tokens_cover_every_shard(self):
+        owner = _add_users(1)[0]
+        kolkata = _add_spot(*KOLKATA, owner_id=owner.id)
+        _add_spot(*MUMBAI, owner_id=owner.id)
+        self.assertEqual(ParkingSpot.get_stats_by_owner(owner.id)['total_spots'], 2)
+
+        body = self.client.get('/api/parking-spots/changes/').json()
+        self.assertEqual(len(body['upserted']), 2)
+        self.assertEqual(set(sharding.decode_token(body['next'])), {'default', 'east'})
+        ParkingSpot.get_by_id(kolkata.id).soft_delete()
+        delta = self.client.get('/api/parking-spots/changes/', {'since': body['next']}).json()
+        self.assertEqual((delta['upserted'], delta['deleted']), ([], [kolkata.id]))
+
+
+class SignupTests(DatabaseTestCase):
+
+    def signup(self, **fields):
+        body = {'first_name': 'Ravi', 'email': 'ravi@example.com', 'password': 'secret', 'role': 'provider',
+                'latitude': str(KOLKATA[0]), 'longitude': str(KOLKATA[1]), 'address': 'Park Street',
+                'parking_type': 'covered', 'hourly_rate': '50', **fields}
+        return self.client.post('/user/signup/', json.dumps(body), content_type='application/json')
+
+    def test_provider_spot_is_created_by_the_job(self):
+        body = self.signup().json()
+        job = body['parking_spot_job']
+        self.assertEqual((job['status'], job['status_url']), ('queued', f"/api/jobs/{job['id']}/"))
+        self.assertEqual(sharding.count(sqlalchemy_engine.session.query(ParkingSpot)), 0)
+
+        jobs.Worker(kinds=['spots.create_for_signup'], concurrency=1, poll_seconds=0.01).run(burst=True)
+        sqlalchemy_engine.session.remove()
+        result = Job.get_by_id(job['id']).to_dict()
+        self.assertEqual(result['status'], 'succeeded')
+        spot = ParkingSpot.get_by_id(result['result']['parking_spot']['id'])
+        self.assertEqual(spot.owner_id, body['id'])
+        self.assertEqual((spot.location, spot.price_per_hour), ('Park Street', 50))
+
+    def test_signup_spot_task_is_safe_to_repeat(self):
+        user_id = self.signup().json()['id']
+        data = {'owner_id': user_id, 'latitude': str(KOLKATA[0]), 'longitude': str(KOLKATA[1]), 'title': 'Lot'}
+        first = create_signup_spot(data)
+        self.assertEqual(create_signup_spot(data), first)
+        self.assertEqual(len(ParkingSpot.get_by_owner(user_id)), 1)
+
+    def test_queue_failure_keeps_the_account(self):
+        with mock.patch.object(Job, 'enqueue', side_effect=RuntimeError('queue down')), \
+                self.assertLogs('core.views.users_view', 'ERROR'):
+            response = self.signup()
+        body = response.json()
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('parking_spot_job', body)
+        self.assertIn('not your parking spot', body['parking_spot_error'])
+        self.assertNotIn('queue down', body['parking_spot_error'])
+        self.assertEqual(body['location']['address'], 'Park Street')
+        self.assertIsNotNone(User.get_by_email('ravi@example.com'))
+
+    def test_provider_without_longitude_is_told(self):
+        body = self.signup(longitude='').json()
+        self.assertEqual(body['parking_spot_error'], 'A parking spot needs both latitude and longitude')
+
+    def test_failure_does_not_leak_the_error(self):
+        with mock.patch.object(User, 'add', side_effect=RuntimeError('secret dsn')), \
+                self.assertLogs('core.views.users_view', 'ERROR'):
+            response = self.signup()
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.json(), {'error': 'Signup failed'})
+
+    def test_seeker_gets_no_spot(self):
+        response = self.client.post('/user/signup/', json.dumps({
+            'first_name': 'Asha', 'email': 'asha@example.com', 'password': 'secret', 'role': 'seeker'
+        }), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('parking_spot_job', response.json())
+        self.assertEqual(sharding.count(sqlalchemy_engine.session.query(ParkingSpot)), 0)
+
+    def test_duplicate_email(self):
+        self.signup()
+        self.assertEqual(self.signup().status_code, 400)
+
+
+class JobQueueTests(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.calls = []
+        tasks = {
+            'test.record': jobs.Task('test.record', lambda value: self.calls.append(value) or {'value': value}),
+            'test.fail': jobs.Task('test.fail', self.fail_task, max_attempts=3, retry_delay=10),
+            'test.public': jobs.Task('test.public', lambda: None, public=True),
+        }
+        patcher = mock.patch.dict(jobs.TASKS, tasks)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def fail_task():
+        raise RuntimeError('boom')
+
+    def worker(self, kinds=('test.record', 'test.fail'), **options):
+        return jobs.Worker(kinds=kinds, poll_seconds=0.01, **options)
+
+    def job(self, job_id):
+        sqlalchemy_engine.session.remove()
+        return Job.get_by_id(job_id)
+
+    def test_burst_runs_due_jobs_by_priority(self):
+        low = jobs.TASKS['test.record'].enqueue({'value': 'low'}).id
+        jobs.TASKS['test.record'].enqueue({'value': 'high'}, priority=5)
+        later = jobs.TASKS['test.record'].enqueue({'value': 'later'}, delay=timedelta(hours=1)).id
+        self.worker(concurrency=1).run(burst=True)
+        self.assertEqual(self.calls, ['high', 'low'])
+        done = self.job(low)
+        self.assertEqual((done.status, done.to_dict()['result'], done.locked_by), ('succeeded', {'value': 'low'}, None))
+        self.assertEqual(self.job(later).status, 'queued')
+
+    def test_concurrent_claims_hand_out_each_job_once(self):
+        ids = {jobs.TASKS['test.record'].enqueue({'value': i}).id for i in range(20)}
+        claimed, errors = [], []
+
+        def claim_all(worker):
+            try:
+                while (job := Job.claim(worker, ['test.record'])) is not None:
+                    claimed.append(job[0])
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=claim_all, args=(f'worker-{i}',)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(sorted(claimed), sorted(ids))
+
+    def test_failures_back_off_then_fail(self):
+        job_id = jobs.TASKS['test.fail'].enqueue().id
+        for attempt, delay in ((1, 10), (2, 20)):
+            with self.assertLogs('core.jobs', 'ERROR'):
+                self.worker().run(burst=True)
+            stored = self.job(job_id)
+            self.assertEqual((stored.status, stored.attempts, stored.error), ('queued', attempt, 'RuntimeError: boom'))
+            wait = (stored.run_after - datetime.utcnow()).total_seconds()
+            self.assertTrue(delay - 5 < wait <= delay, wait)
+            self.worker().run(burst=True)  # not due yet
+            self.assertEqual(self.job(job_id).attempts, attempt)
+            with self.engine.begin() as conn:
+                conn.execute(Job.__table__.update().values(run_after=datetime.utcnow() - timedelta(seconds=1)))
+        with self.assertLogs('core.jobs', 'ERROR'):
+            self.worker().run(burst=True)
+        stored = self.job(job_id)
+        self.assertEqual((stored.status, stored.attempts), ('failed', 3))
+        self.assertIsNotNone(stored.finished_at)
+
+    def test_release_stale_requeues_or_fails(self):
+        retry = jobs.TASKS['test.record'].enqueue({'value': 1}).id
+        spent = Job.enqueue('test.record', {'value': 2}, max_attempts=1).id
+        fresh = jobs.TASKS['test.record'].enqueue({'value': 3}).id
+        for _ in range(3):
+            Job.claim('dead', ['test.record'])
+        with self.engine.begin() as conn:
+            conn.execute(Job.__table__.update().where(Job.id.in_([retry, spent])).values(
+                locked_at=datetime.utcnow() - timedelta(minutes=10)))
+
+        self.assertEqual(Job.release_stale(timedelta(minutes=5)), (1, 1))
+        self.assertEqual([self.job(j).status for j in (retry, spent, fresh)], ['queued', 'failed', 'running'])
+        self.assertEqual(self.job(retry).locked_by, None)
+
+    def test_only_the_owning_worker_finishes_a_job(self):
+        job_id = jobs.TASKS['test.record'].enqueue({'value': 1}).id
+        Job.claim('slow', ['test.record'])
+        with self.engine.begin() as conn:
+            conn.execute(Job.__table__.update().values(locked_at=datetime.utcnow() - timedelta(minutes=10)))
+        Job.release_stale(timedelta(minutes=5))
+        Job.claim('fast', ['test.record'])
+
+        self.assertEqual(Job.succeed(job_id, 'slow', {'late': True}), 0)
+        self.assertEqual((self.job(job_id).status, self.job(job_id).locked_by), ('running', 'fast'))
+        self.assertEqual(Job.succeed(job_id, 'fast', {'value': 1}), 1)
+        self.assertEqual(self.job(job_id).to_dict()['result'], {'value': 1})
+
+    def test_api(self):
+        admin, seeker = (user.id for user in _add_users(2))
+        UserRole.add({'user_id': admin, 'name': 'admin'})
+        UserRole.add({'user_id': seeker, 'name': 'seeker'})
+
+        def post(body, user_id=admin):
+            # The role is checked in the database, not taken from the token
+            return self.client.post('/api/jobs/', body if isinstance(body, str) else json.dumps(body),
+                                    content_type='application/json',
+                                    headers={'authorization': f'Bearer {generate_jwt(user_id, "admin")}'})
+
+        self.assertEqual(self.client.get('/api/jobs/missing/').status_code, 404)
+        self.assertEqual(post('{').status_code, 400)
+        self.assertEqual(post({'kind': 'test.public', 'payload': [1]}).status_code, 400)
+        self.assertEqual(post({'kind': 'test.record', 'payload': {'value': 1}}).status_code, 400)  # not public
+        self.assertEqual(post({'kind': 'test.public'}, user_id=seeker).status_code, 403)
+
+        queued = post({'kind': 'test.public'})
+        self.assertEqual(queued.status_code, 202)
+        polled = self.client.get(queued['Location'])
+        self.assertEqual((polled.json()['status'], polled['Retry-After']), ('queued', '2'))
+        self.worker(kinds=['test.public']).run(burst=True)
+        polled = self.client.get(queued['Location'])
+        self.assertEqual(polled.json()['status'], 'succeeded')
+        self.assertFalse(polled.has_header('Retry-After'))
+
+
+class AdmissionTests(AppTestCase):
+
+    def setUp(self):
+        self.dir = _temp_dir(self)
+        patcher = mock.patch.dict(admission._limiters, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.factory = RequestFactory()
+
+    def limiter(self, name='search'):
+        return admission.ClassLimiter(os.path.join(self.dir, f'{name}.bin'))
+
+    def test_token_bucket_refills_at_the_rate(self):
+        limiter = self.limiter()
+        clock = [1000.0]
+        with mock.patch('core.admission.time.monotonic', lambda: clock[0]):
+            self.assertEqual([limiter.take('ip:a', 2, 3) for _ in range(3)], [0, 0, 0])
+            self.assertAlmostEqual(limiter.take('ip:a', 2, 3), 0.5)
+            self.assertEqual(limiter.take('ip:b', 2, 3), 0)  # a bucket per client
+            clock[0] += 0.5
+            self.assertEqual(limiter.take('ip:a', 2, 3), 0)
+            clock[0] += 60
+            self.assertEqual([limiter.take('ip:a', 2, 3) for _ in range(3)], [0, 0, 0])  # capped at burst
+            self.assertGreater(limiter.take('ip:a', 2, 3), 0)
+
+    def test_buckets_are_shared_between_processes(self):
+        limiter = self.limiter()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                for _ in range(3):
+                    self.limiter().take('ip:a', 0.001, 3)
+            finally:
+                os._exit(0)
+        os.waitpid(pid, 0)
+        self.assertGreater(limiter.take('ip:a', 0.001, 3), 0)
+
+    def test_in_flight_cap_ignores_dead_workers(self):
+        limiter = self.limiter()
+        self.assertTrue(limiter.enter(2))
+        self.assertTrue(limiter.enter(2))
+        self.assertFalse(limiter.enter(2))
+        limiter.leave()
+        self.assertTrue(limiter.enter(2))
+        limiter.leave()
+        limiter.leave()
+
+        child = os.fork()
+        if child == 0:
+            self.limiter().enter(2)
+            self.limiter().enter(2)
+            os._exit(0)  # dies with both requests counted
+        os.waitpid(child, 0)
+        self.assertTrue(limiter.enter(2))
+
+    def test_client_key(self):
+        request = self.factory.get('/', REMOTE_ADDR='10.0.0.1', HTTP_X_FORWARDED_FOR='203.0.113.9, 10.0.0.1')
+        self.assertEqual(admission.client_key(request), 'ip:10.0.0.1')
+        with self.settings(ADMISSION_TRUST_X_FORWARDED_FOR=True):
+            self.assertEqual(admission.client_key(request), 'ip:203.0.113.9')
+        signed = self.factory.get('/', HTTP_AUTHORIZATION=f'Bearer {generate_jwt(7, "seeker")}')
+        self.assertEqual(admission.client_key(signed), 'user:7')
+        forged = self.factory.get('/', REMOTE_ADDR='10.0.0.2', HTTP_AUTHORIZATION='Bearer forged')
+        self.assertEqual(admission.client_key(forged), 'ip:10.0.0.2')
+
+    def test_admit(self):
+        calls = []
+
+        @admission.admit('search')
+        def view(request):
+            calls.append(request)
+            return JsonResponse({})
+
+        limits = {'search': {'rate': 0.01, 'burst': 2, 'concurrency': 1, 'retry_after': 3}}
+        with self.settings(ADMISSION_CLASSES=limits, ADMISSION_DIR=self.dir):
+            self.assertEqual([view(self.factory.get('/')).status_code for _ in range(2)], [200, 200])
+            limited = view(self.factory.get('/'))
+            self.assertEqual((limited.status_code, limited['Retry-After']), (429, '100'))
+
+            admission.limiter('search').enter(1)  # another request of the class is running
+            busy = view(self.factory.get('/', REMOTE_ADDR='10.0.0.9'))
+            self.assertEqual((busy.status_code, busy['Retry-After']), (503, '3'))
+            admission.limiter('search').leave()
+
+            with mock.patch.object(admission.ClassLimiter, 'take', side_effect=OSError('read-only')), \
+                    self.assertLogs('core.admission', 'ERROR'):
+                self.assertEqual(view(self.factory.get('/')).status_code, 200)  # fails open
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(view(self.factory.get('/')).status_code, 200)  # class not configured
+
+
+class TextSearchTests(DatabaseTestCase):
+    """The typeahead endpoint on the database's backend: pg_trgm on Postgres, the in-memory index elsewhere"""
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch('core.views.parking_spot_view.text_index', TextIndex())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.koramangala = _add_spot(12.9352, 77.6245, title='Koramangala covered parking',
+                                     location='Koramangala 5th Block, Bengaluru')
+        self.park_street = _add_spot(*KOLKATA, title='Park Street basement', location='Park Street, Kolkata',
+                                     description='Covered, near the metro')
+        self.cafe = _add_spot(KOLKATA[0] + 0.2, KOLKATA[1], title='Café Street lot', location='Salt Lake, Kolkata')
+        self.closed = _add_spot(12.94, 77.62, title='Koramangala driveway', location='Koramangala, Bengaluru',
+                                is_available='no')
+
+    def search(self, q, **params):
+        return self.client.get('/api/parking-spots/search/', {'q': q, **params})
+
+    def ids(self, q, **params):
+        response = self.search(q, **params)
+        self.assertEqual(response.status_code, 200)
+        return [r['id'] for r in response.json()['results']]
+
+    def test_partial_words_find_bookable_spots(self):
+        self.assertEqual(self.ids('koraman'), [self.koramangala.id])
+        self.assertEqual(self.ids('park street')[0], self.park_street.id)
+
+    def test_titles_outrank_descriptions(self):
+        self.assertEqual(self.ids('covered'), [self.koramangala.id, self.park_street.id])
+
+    def test_position_favours_nearer_spots(self):
+        self.assertEqual(self.ids('street', lat=KOLKATA[0] + 0.2, lng=KOLKATA[1])[0], self.cafe.id)
+        results = self.search('street', lat=KOLKATA[0], lng=KOLKATA[1]).json()['results']
+        self.assertEqual(results[0]['id'], self.park_street.id)
+        self.assertEqual(results[0]['distance_km'], 0)
+
+    def test_writes_are_searchable(self):
+        self.ids('koramangala')  # builds the index
+        ParkingSpot.get_by_id(self.koramangala.id).update_spot({'title': 'Indiranagar garage'})
+        self.park_street.soft_delete()
+        self.assertEqual(self.ids('indiranagar'), [self.koramangala.id])
+        self.assertNotIn(self.park_street.id, self.ids('park street'))
+
+    def test_bad_requests(self):
+        for params in ({'q': 'k'}, {'q': 'park', 'limit': 0}, {'q': 'park', 'limit': 'x'}, {'q': 'park', 'lat': 1}):
+            self.assertEqual(self.client.get('/api/parking-spots/search/', params).status_code, 400, params)
+
+
+class PostgresTextSearchTests(PostgresTestCase, TextSearchTests):
+    """TextSearchTests on pg_trgm, for the same answers from both backends"""
+
+    def setUp(self):
+        if os.environ.get('TEST_POSTGRES_URL'):
+            engine = sqlalchemy_engine._create_engine(os.environ['TEST_POSTGRES_URL'])
+            try:
+                with engine.begin() as conn:
+                    conn.exec_driver_sql('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+            except Exception as e:
+                self.skipTest(f'pg_trgm is not available: {e}')
+            finally:
+                engine.dispose()
+        super().setUp()
+
+
+class TextIndexTests(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.index = TextIndex()
+
+    def test_terms_are_folded_prefixes_that_must_all_match(self):
+        cafe = _add_spot(*KOLKATA, title='Café Coffee Day lot')
+        _add_spot(*KOLKATA, title='Coffee House yard')
+        self.assertEqual(query_terms('Café, c  COFFEE!'), ['cafe', 'coffee'])
+        self.assertEqual([spot_id for spot_id, _, _ in self.index.search('caf cof')], [cafe.id])
+        self.assertEqual(len(self.index.search('coff')), 2)
+        self.assertEqual(self.index.search('tea'), [])
+
+    def test_whole_words_beat_prefixes(self):
+        whole = _add_spot(*KOLKATA, title='Park lot')
+        longer = _add_spot(*KOLKATA, title='Parkway lot')
+        (first, first_score, _), (second, second_score, _) = self.index.search('park')
+        self.assertEqual((first, second), (whole.id, longer.id))
+        self.assertEqual(first_score, 3.0)
+        self.assertAlmostEqual(second_score, 3.0 * (0.5 + 0.5 * 4 / 7))
+
+    def test_distance_divides_the_score(self):
+        near = _add_spot(*KOLKATA, title='Metro lot')
+        far = _add_spot(*MUMBAI, title='Metro lot')
+        ranked = self.index.search('metro', latitude=MUMBAI[0], longitude=MUMBAI[1], distance_scale_km=10)
+        self.assertEqual([spot_id for spot_id, _, _ in ranked], [far.id, near.id])
+        _, score, distance = ranked[1]
+        self.assertAlmostEqual(distance, haversine_km(*MUMBAI, *KOLKATA))
+        self.assertAlmostEqual(score, 3.0 / (1 + distance / 10))
+
+    def test_vocabulary_follows_writes(self):
+        spot = _add_spot(*KOLKATA, title='Unique zebra lot')
+        self.index.search('zebra')
+        ParkingSpot.get_by_id(spot.id).update_spot({'title': 'Plain lot'})
+        self.index.refresh()
+        self.assertEqual(self.index.search('zebra'), [])
+        self.assertNotIn('zebra', self.index.vocabulary)
+        self.assertEqual(self.index.vocabulary, sorted(self.index.vocabulary))
@@ -17,7 +17,14 @@ Including another URLconf
 
 from django.urls import path
 from core.views.users_view import UserView, merch_dashboard, download_json
-from core.views.parking_spot_view import ParkingSpotAPIView, parking_spot_view
+from core.views.parking_spot_view import (
+    ParkingSpotAPIView, parking_spot_changes, parking_spot_clusters, parking_spot_nearest, parking_spot_search,
+    parking_spot_view,
+)
+from core.views.merch_api_view import merch_metrics_api
+from core.views.metrics_view import metrics_view
+from core.views.reservation_view import ReservationAPIView
+from core.views.job_view import JobAPIView
 
 urlpatterns = [
     path('', UserView.as_view(), name='home'),               
@@ -25,11 +32,25 @@ urlpatterns = [
     path('user/signup/', UserView.as_view(), name='signup'), 
     path('merch-dashboard/', merch_dashboard, name='merch_dashboard'),
     path('download-json/', download_json, name='download_json'),
+    path('api/merch-metrics/', merch_metrics_api, name='merch_metrics_api'),
     
     # ✅ HTML render view
     path('parking-spots/', parking_spot_view, name='parking-spot-view'),
 
     # ✅ API endpoint
     path('api/parking-spots/', ParkingSpotAPIView.as_view(), name='parking-spot-api'),
+    path('api/parking-spots/clusters/', parking_spot_clusters, name='parking-spot-clusters'),
+    path('api/parking-spots/nearest/', parking_spot_nearest, name='parking-spot-nearest'),
+    path('api/parking-spots/search/', parking_spot_search, name='parking-spot-search'),
+    path('api/parking-spots/changes/', parking_spot_changes, name='parking-spot-changes'),
+    path('api/reservations/', ReservationAPIView.as_view(), name='reservation-api'),
+    path('api/reservations/<int:reservation_id>/', ReservationAPIView.as_view(), name='reservation-detail-api'),
+
+    # ✅ Background jobs: admins queue public tasks, anyone holding a job id polls it
+    path('api/jobs/', JobAPIView.as_view(), name='job-api'),
+    path('api/jobs/<str:job_id>/', JobAPIView.as_view(), name='job-detail-api'),
+
+    # ✅ Prometheus scrape endpoint
+    path('metrics', metrics_view, name='metrics'),
 ]
 
@@ -0,0 +1,46 @@
+import json
+
+from django.http import JsonResponse
+from django.urls import reverse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+
+from core.auth_utils import jwt_required
+from core.jobs import load_tasks
+from core.models.job import Job
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class JobAPIView(View):
+
+    def get(self, request, job_id=None, *args, **kwargs):
+        """Status of a job; its random id is all a caller needs to poll it"""
+        job = Job.get_by_id(job_id) if job_id else None
+        if not job:
+            return JsonResponse({'error': 'Job not found'}, status=404)
+        response = JsonResponse(job.to_dict())
+        if job.status in ('queued', 'running'):
+            # Hint for pollers
+            response['Retry-After'] = '2'
+        return response
+
+    @method_decorator(jwt_required(allowed_roles=['admin']))
+    def post(self, request, *args, **kwargs):
+        """Queue {kind, payload} for one of the tasks marked public"""
+        try:
+            data = json.loads(request.body)
+            kind = data['kind']
+            payload = data.get('payload') or {}
+            if not isinstance(payload, dict):
+                raise ValueError('payload must be an object')
+        except (ValueError, KeyError, TypeError) as e:
+            return JsonResponse({'error': f'Invalid job: {e}'}, status=400)
+
+        t = load_tasks().get(kind)
+        if t is None or not t.public:
+            return JsonResponse({'error': f"Unknown task '{kind}'"}, status=400)
+        job = t.enqueue(payload, created_by=request.user.id)
+        response = JsonResponse(job.to_dict(), status=202)
+        response['Location'] = reverse('job-detail-api', args=[job.id])
+        return response
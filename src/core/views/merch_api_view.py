@@ -0,0 +1,62 @@
+from django.conf import settings
+from django.http import JsonResponse
+
+from core import perf
+from core.admission import admit
+from core.merch_query import InvalidQuery, downsample_chart, query_page, query_rows
+from core.views.users_view import load_merch_metrics
+
+
+def _int_param(request, name, default, maximum=None):
+    value = request.GET.get(name)
+    if value in (None, ''):
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        raise InvalidQuery(f"'{name}' must be an integer")
+    if value < 1:
+        raise InvalidQuery(f"'{name}' must be positive")
+    return min(value, maximum) if maximum else value
+
+
+@admit('dashboard')
+def merch_metrics_api(request):
+    """
+    GET /api/merch-metrics/
+        ?sort=gmv|rating|return_rate|orders|name|product_id  &order=desc|asc
+        &issue=Low GMV|Low Rating|High Return Rate|none      &top=N
+        &limit=N  &cursor=<next_cursor>  &chart=1  &points=N
+        &source=csv|store  &mode=memory|chunked
+    """
+    try:
+        sort = request.GET.get('sort', 'gmv')
+        descending = request.GET.get('order', 'desc') != 'asc'
+        max_page = getattr(settings, 'MERCH_API_MAX_PAGE_SIZE', 500)
+        limit = _int_param(request, 'limit', getattr(settings, 'MERCH_PAGE_SIZE', 50), max_page)
+        top = _int_param(request, 'top', None)
+
+        issue = request.GET.get('issue') or None
+        cursor = request.GET.get('cursor') or None
+        with_chart = request.GET.get('chart') == '1' or not cursor
+        max_points = getattr(settings, 'MERCH_CHART_MAX_POINTS', 100)
+        points = _int_param(request, 'points', max_points, max_points)
+
+        rows, _ = load_merch_metrics(request.GET.get('source'), request.GET.get('mode'))
+        page, total, next_cursor = query_page(
+            rows, sort=sort, descending=descending, issue=issue, top=top, limit=limit, cursor=cursor,
+        )
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    data = {
+        'count': total,
+        'results': page,
+        'next_cursor': next_cursor,
+    }
+    # The chart does not change between pages, so it comes with the first page or on request
+    if with_chart:
+        chart_rows = rows if not (issue or top) else query_rows(rows, sort, descending, issue, top)
+        data['chart_data'] = downsample_chart(chart_rows, points)
+    with perf.span('serialize'):
+        return JsonResponse(data)
@@ -0,0 +1,12 @@
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+from core import metrics
+
+
+def metrics_view(request):
+    """Prometheus scrape endpoint, merged across every worker process"""
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return HttpResponseForbidden('Forbidden')
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
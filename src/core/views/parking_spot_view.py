@@ -1,17 +1,323 @@
+from datetime import datetime, timedelta
+from itertools import islice
+from zoneinfo import ZoneInfo
+
+from django.conf import settings
 from django.shortcuts import render
 from django.views import View
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.gzip import gzip_page
+from django.views.decorators.vary import vary_on_headers
 import math, traceback
 
-from core.models.parking_spot import ParkingSpot
+from core import opening_hours, perf, sharding, spot_json, spot_wire, sqlalchemy_engine
+from core.admission import admit
+from core.geo_cluster import cluster_index
+from core.spot_text import MIN_TERM, haversine_km, query_terms, text_index
+from core.spot_tree import SpotFilter, nearest_index
+from core.models.parking_spot import ParkingSpot, VEHICLE_SIZES
 from core.models.users import User
 
+
+def _list_param(request, name):
+    """`?name=a,b` and `?name=a&name=b` both give ['a', 'b']"""
+    values = []
+    for raw in request.GET.getlist(name):
+        values.extend(v.strip() for v in raw.split(',') if v.strip())
+    return values
+
+
+def _float_param(request, name):
+    value = request.GET.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        raise ValueError(f'{name} must be a number')
+
+
+def spot_time_zone():
+    return ZoneInfo(getattr(settings, 'SPOT_HOURS_TIME_ZONE', 'Asia/Kolkata'))
+
+
+def parse_slot(value, name='slot'):
+    """
+    `<ISO start>,<ISO end>` (naive times are spot-local) as
+    ((local start, local end), (UTC start, UTC end)), ValueError if malformed.
+    """
+    tz = spot_time_zone()
+    try:
+        start, end = (part.strip() for part in value.split(','))
+        local = opening_hours.as_local(start, tz), opening_hours.as_local(end, tz)
+        utc = opening_hours.as_utc(start, tz), opening_hours.as_utc(end, tz)
+    except ValueError as e:
+        raise ValueError(f'{name} needs <ISO start>,<ISO end> ({e})')
+    if utc[1] <= utc[0]:
+        raise ValueError(f'{name} must end after it starts')
+    return local, utc
+
+
+def _open_window(request):
+    """
+    (start, end) in spot-local time from `open_now=1`, `open_at=<ISO datetime>`
+    or `open_between=<ISO start>,<ISO end>`; naive times are spot-local.
+    """
+    tz = spot_time_zone()
+    if request.GET.get('open_between'):
+        return parse_slot(request.GET['open_between'], 'open_between')[0]
+    try:
+        if request.GET.get('open_at'):
+            start = opening_hours.as_local(request.GET['open_at'], tz)
+        elif request.GET.get('open_now') in ('1', 'true'):
+            start = datetime.now(tz).replace(tzinfo=None)
+        else:
+            return None
+    except ValueError as e:
+        raise ValueError(f'open_at needs an ISO datetime ({e})')
+    return start, start + timedelta(minutes=1)
+
+
+def search_filters(request):
+    """Filters of a nearby search: price range, parking types, vehicle sizes, opening hours and bookings"""
+    vehicle_sizes = _list_param(request, 'max_vehicle_size')
+    fits = request.GET.get('fits')
+    if fits:
+        # "fits a truck": every size at least as large as the vehicle
+        if fits not in VEHICLE_SIZES:
+            raise ValueError(f"fits must be one of {', '.join(VEHICLE_SIZES)}")
+        larger = VEHICLE_SIZES[VEHICLE_SIZES.index(fits):]
+        vehicle_sizes = [s for s in vehicle_sizes if s in larger] if vehicle_sizes else list(larger)
+        if not vehicle_sizes:
+            raise ValueError(f'none of the requested max_vehicle_size values fit a {fits}')
+    open_window = _open_window(request)
+    free_window = None
+    if request.GET.get('free_between'):
+        # Bookable for the slot: open all through it and not reserved by anyone
+        local, free_window = parse_slot(request.GET['free_between'], 'free_between')
+        open_window = open_window or local
+    return {
+        'min_price': _float_param(request, 'min_price'),
+        'max_price': _float_param(request, 'max_price'),
+        'parking_types': _list_param(request, 'parking_type'),
+        'vehicle_sizes': vehicle_sizes,
+        'open_window': open_window,
+        'free_window': free_window,
+    }
+
+
+def spot_payload(spot, owner):
+    """JSON shape of one search result, less its distance_km (see core/spot_json.py)"""
+    return {
+        "id": spot.id,
+        "title": spot.title or f"Parking Spot {spot.id}",
+        "latitude": float(spot.latitude),
+        "longitude": float(spot.longitude),
+        "location": spot.location,
+        "parking_type": spot.parking_type,
+        "price_per_hour": float(spot.price_per_hour) if spot.price_per_hour else 0,
+        "max_vehicle_size": spot.max_vehicle_size,
+        "availability_hours": spot.availability_hours or "24/7",
+        "is_available": spot.is_available,
+        "contact_phone": owner.mobile_number if owner else None,
+        "description": getattr(spot, 'description', ''),
+        "owner": {
+            "first_name": owner.first_name if owner else "Unknown",
+            "last_name": owner.last_name if owner else "Owner",
+            "email": owner.email if owner else ""
+        }
+    }
+
+
+def load_owners(found):
+    """Owners of (spot, distance) pairs by id, in one query"""
+    owner_ids = {spot.owner_id for spot, _ in found if spot.owner_id}
+    return {u.id: u for u in User.get_by_ids(owner_ids)} if owner_ids else {}
+
+
+def encoded_results(found, owners):
+    """JSON body for (spot, distance) pairs, reusing each spot's cached fragment"""
+    return [
+        spot_json.result_json(spot_json.spot_fragment(spot, owners.get(spot.owner_id), spot_payload), distance)
+        for spot, distance in found
+    ]
+
+
 def parking_spot_view(request):
     return render(request, 'users/parking_spot.html')
 
+
+@admit('search')
+def parking_spot_clusters(request):
+    """Marker clusters for a map viewport: `bbox=west,south,east,north` (Leaflet toBBoxString) and `zoom`"""
+    try:
+        west, south, east, north = (float(v) for v in request.GET.get('bbox', '').split(','))
+        zoom = int(request.GET.get('zoom', ''))
+    except ValueError:
+        return JsonResponse({'error': 'bbox=west,south,east,north and an integer zoom are required'}, status=400)
+    if south > north or west > east:
+        return JsonResponse({'error': 'bbox must be west,south,east,north'}, status=400)
+
+    level, clusters = cluster_index.clusters(south, west, north, east, zoom)
+    with perf.span('serialize'):
+        return JsonResponse({'zoom': zoom, 'level': level, 'clusters': clusters})
+
+
+@admit('search')
+def parking_spot_nearest(request):
+    """
+    The `k` (default 10) closest bookable spots to lat/lng in exact distance
+    order, optionally within `max_km`, with the same filters as the nearby
+    search. Price, type and size are checked while walking the KD-tree;
+    opening hours, bookings and the tree's freshness are confirmed against
+    the database one batch of candidates at a time.
+    """
+    try:
+        lat = float(request.GET['lat'])
+        lng = float(request.GET['lng'])
+        k = min(int(request.GET.get('k', 10)), getattr(settings, 'NEAREST_MAX_K', 100))
+        max_km = _float_param(request, 'max_km')
+        filters = search_filters(request)
+    except (KeyError, ValueError) as e:
+        return JsonResponse({'error': f'lat, lng and a numeric k are required ({e})'}, status=400)
+    if k < 1:
+        return JsonResponse({'error': 'k must be at least 1'}, status=400)
+
+    spot_filter = SpotFilter(filters['min_price'], filters['max_price'], filters['parking_types'],
+                             filters['vehicle_sizes'])
+    candidates = nearest_index.nearest(lat, lng, spot_filter, max_km)
+    found = []  # (spot, distance)
+    with perf.span('knn'):
+        while len(found) < k:
+            batch = list(islice(candidates, max(k - len(found), 8)))
+            if not batch:
+                break
+            spots = ParkingSpot.bookable_among(
+                [spot_id for spot_id, _ in batch], filters['open_window'], filters['free_window']
+            )
+            found.extend((spots[spot_id], d) for spot_id, d in batch if spot_id in spots)
+
+    with perf.span('serialize'):
+        found = found[:k]
+        body = spot_json.results_json(encoded_results(found, load_owners(found)))
+        return HttpResponse(body, content_type='application/json')
+
+
+def text_search_backend():
+    backend = getattr(settings, 'SPOT_TEXT_SEARCH_BACKEND', 'auto')
+    if backend == 'auto':
+        backend = 'postgres' if sqlalchemy_engine.engine.dialect.name == 'postgresql' else 'memory'
+    return backend
+
+
+@admit('search')
+def parking_spot_search(request):
+    """
+    Typeahead: bookable spots whose title, location or description match
+    `q` as the user types it, best first. Each word of `q` may be the start
+    of a word ('kora' finds Koramangala). With lat/lng nearer spots rank
+    higher and results carry their distance. Postgres ranks by trigram
+    similarity (ParkingSpot.text_search), anything else uses the in-memory
+    prefix index of core/spot_text.py.
+    """
+    query = request.GET.get('q', '').strip()
+    try:
+        limit = min(int(request.GET.get('limit', 10)), getattr(settings, 'SPOT_TEXT_SEARCH_MAX_LIMIT', 20))
+        lat = _float_param(request, 'lat')
+        lng = _float_param(request, 'lng')
+    except ValueError as e:
+        return JsonResponse({'error': f'limit, lat and lng must be numbers ({e})'}, status=400)
+    if not query_terms(query):
+        return JsonResponse({'error': f'q needs a word of at least {MIN_TERM} characters'}, status=400)
+    if limit < 1:
+        return JsonResponse({'error': 'limit must be at least 1'}, status=400)
+    if (lat is None) != (lng is None):
+        return JsonResponse({'error': 'lat and lng go together'}, status=400)
+    scale = getattr(settings, 'SPOT_TEXT_SEARCH_DISTANCE_SCALE_KM', 10.0)
+
+    found = []  # (spot, score)
+    with perf.span('text_search'):
+        if text_search_backend() == 'postgres':
+            found = ParkingSpot.text_search(query, limit, lat, lng, scale)
+        else:
+            # A little extra in case the index is a moment behind the database
+            ranked = text_index.search(query, limit + 5, lat, lng, scale)
+            spots = ParkingSpot.bookable_among([spot_id for spot_id, _, _ in ranked]) if ranked else {}
+            found = [(spots[spot_id], score) for spot_id, score, _ in ranked if spot_id in spots][:limit]
+
+    with perf.span('serialize'):
+        results = []
+        for spot, score in found:
+            result = {
+                'id': spot.id,
+                'title': spot.title,
+                'location': spot.location,
+                'latitude': spot.latitude,
+                'longitude': spot.longitude,
+                'parking_type': spot.parking_type,
+                'price_per_hour': spot.price_per_hour,
+                'score': round(score, 3),
+            }
+            if lat is not None:
+                result['distance_km'] = round(haversine_km(lat, lng, spot.latitude, spot.longitude), 2)
+            results.append(result)
+        return JsonResponse({'query': query, 'results': results})
+
+
+@gzip_page
+def parking_spot_changes(request):
+    """
+    Spots written since the version token `since` (omit it for a first full
+    sync): `upserted` spots, `deleted` ids of deactivated ones and the token
+    to send next. Pages of SPOT_CHANGES_PAGE_SIZE, `has_more` while behind.
+    The ETag is the catalog's current version, so polling an unchanged
+    catalog with If-None-Match gets a bodyless 304.
+    """
+    try:
+        since = sharding.decode_token(request.GET.get('since', ''))
+        if any(seq < 0 for seq in since.values()):
+            raise ValueError
+    except ValueError:
+        return JsonResponse({'error': 'since must be a token returned by this endpoint'}, status=400)
+
+    heads = ParkingSpot.head_seqs()
+    etag = f'"spots-{sharding.encode_token(heads)}"'
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        page_size = getattr(settings, 'SPOT_CHANGES_PAGE_SIZE', 500)
+        spots, following, has_more = [], {}, False
+        # Each shard numbers its own changes; the page is filled shard by shard
+        for shard, head in sorted(heads.items()):
+            seen = since.get(shard, 0)
+            room = page_size - len(spots)
+            page = ParkingSpot.changes_since(seen, room, shard, until=head) if room and seen < head else []
+            spots += page
+            if room and len(page) < room:
+                following[shard] = max(seen, head)
+            else:
+                following[shard] = page[-1].change_seq if page else seen
+                has_more = has_more or seen < head
+        with perf.span('serialize'):
+            response = JsonResponse({
+                'since': sharding.encode_token({shard: since.get(shard, 0) for shard in heads}),
+                'next': sharding.encode_token(following),
+                'has_more': has_more,
+                'upserted': [spot.to_dict() for spot in spots if spot.is_active],
+                # A first sync has nothing to delete
+                'deleted': [spot.id for spot in spots if not spot.is_active] if any(since.values()) else [],
+            })
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
 @method_decorator(csrf_exempt, name='dispatch')
+@method_decorator(gzip_page, name='dispatch')
+@method_decorator(vary_on_headers('Accept'), name='dispatch')
+@method_decorator(admit('search'), name='get')
 class ParkingSpotAPIView(View):
     
     def get(self, request, *args, **kwargs):
@@ -22,37 +328,37 @@ class ParkingSpotAPIView(View):
             if lat == 0 or lng == 0:
                 return JsonResponse({'error': 'Latitude and longitude are required'}, status=400)
 
-            all_spots = ParkingSpot.get_available_spots()
-            nearby_spots = []
+            try:
+                filters = search_filters(request)
+            except ValueError as e:
+                return JsonResponse({'error': str(e)}, status=400)
+            all_spots = ParkingSpot.search(lat, lng, radius, **filters)
+            found = []  # (spot, distance)
 
             for spot in all_spots:
-                distance = self.calculate_distance(lat, lng, spot.latitude, spot.longitude)
+                with perf.span('haversine'):
+                    distance = self.calculate_distance(lat, lng, spot.latitude, spot.longitude)
                 if distance <= radius:
-                    owner = User.get_by_id(spot.owner_id) if spot.owner_id else None
-                    spot_data = {
-                        "id": spot.id,
-                        "title": spot.title or f"Parking Spot {spot.id}",
-                        "latitude": float(spot.latitude),
-                        "longitude": float(spot.longitude),
-                        "location": spot.location,
-                        "parking_type": spot.parking_type,
-                        "price_per_hour": float(spot.price_per_hour) if spot.price_per_hour else 0,
-                        "max_vehicle_size": spot.max_vehicle_size,
-                        "availability_hours": spot.availability_hours or "24/7",
-                        "is_available": spot.is_available,
-                        "contact_phone": owner.mobile_number,
-                        "description": getattr(spot, 'description', ''),
-                        "distance_km": round(distance, 2),
-                        "owner": {
-                            "first_name": owner.first_name if owner else "Unknown",
-                            "last_name": owner.last_name if owner else "Owner",
-                            "email": owner.email if owner else ""
-                        }
-                    }
-                    nearby_spots.append(spot_data)
-
-            nearby_spots.sort(key=lambda x: x['distance_km'])
-            return JsonResponse(nearby_spots, safe=False)
+                    found.append((spot, distance))
+
+            found.sort(key=lambda pair: round(pair[1], 2))
+            owners = load_owners(found)
+            # Filter panel counts, same radius and filters, one aggregate query
+            facets = ParkingSpot.facet_counts(lat, lng, radius, **filters) \
+                if request.GET.get('facets') in ('1', 'true') else None
+
+            media_type = spot_wire.negotiate(request)
+            with perf.span('serialize'):
+                if media_type:
+                    # Opt-in columnar layout for map clients (see core/spot_wire.py)
+                    payload = spot_wire.columns(found, owners)
+                    if facets is not None:
+                        payload['facets'] = facets
+                    return HttpResponse(spot_wire.encode(media_type, payload), content_type=media_type)
+                body = spot_json.results_json(encoded_results(found, owners))
+                if facets is not None:
+                    body = b'{"results":%s,"facets":%s}' % (body, spot_json.dumps(facets))
+                return HttpResponse(body, content_type='application/json')
         except Exception as e:
             return JsonResponse({'error': str(e)}, status=500)
 
@@ -0,0 +1,70 @@
+import json
+from datetime import datetime, timedelta
+
+from django.http import JsonResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+
+from core.auth_utils import jwt_required
+from core.models.reservation import Reservation, ReservationConflict
+from core.views.parking_spot_view import parse_slot
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class ReservationAPIView(View):
+
+    def get(self, request, *args, **kwargs):
+        """Booked slots of a spot within `between` (default: the next 7 days)"""
+        try:
+            spot_id = int(request.GET.get('spot_id', ''))
+        except ValueError:
+            return JsonResponse({'error': 'spot_id is required'}, status=400)
+        try:
+            if request.GET.get('between'):
+                _, (start, end) = parse_slot(request.GET['between'], 'between')
+            else:
+                start = datetime.utcnow()
+                end = start + timedelta(days=7)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        booked = [
+            {'starts_at': r.starts_at.isoformat() + 'Z', 'ends_at': r.ends_at.isoformat() + 'Z'}
+            for r in Reservation.for_spot(spot_id, start, end)
+        ]
+        return JsonResponse({'spot_id': spot_id, 'booked': booked})
+
+    @method_decorator(jwt_required())
+    def post(self, request, *args, **kwargs):
+        """Book {spot_id, starts_at, ends_at} for the signed-in user; 409 if the slot is taken"""
+        try:
+            data = json.loads(request.body)
+            spot_id = int(data['spot_id'])
+            local, (starts_at, ends_at) = parse_slot(f"{data['starts_at']},{data['ends_at']}", 'starts_at/ends_at')
+        except (ValueError, KeyError, TypeError) as e:
+            return JsonResponse({'error': f'Invalid reservation: {e}'}, status=400)
+
+        try:
+            reservation = Reservation.book(spot_id, request.user.id, starts_at, ends_at, open_window=local)
+        except ReservationConflict as e:
+            return JsonResponse({'error': str(e)}, status=409)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        return JsonResponse(reservation.to_dict(), status=201)
+
+    @method_decorator(jwt_required())
+    def delete(self, request, reservation_id=None, *args, **kwargs):
+        """Cancel one of the signed-in user's reservations; `?spot_id=` saves looking on every shard"""
+        try:
+            spot_id = int(request.GET['spot_id']) if request.GET.get('spot_id') else None
+        except ValueError:
+            return JsonResponse({'error': 'spot_id must be an integer'}, status=400)
+        reservation = Reservation.get_by_id(reservation_id, spot_id) if reservation_id else None
+        if not reservation:
+            return JsonResponse({'error': 'Reservation not found'}, status=404)
+        if reservation.user_id != request.user.id:
+            return JsonResponse({'error': 'Access denied'}, status=403)
+        if reservation.status != 'cancelled':
+            reservation.cancel()
+        return JsonResponse(reservation.to_dict())
@@ -1,21 +1,35 @@
 import traceback
+import glob
 import json
+import logging
 import os
 from django.conf import settings
 from django.http import JsonResponse
 from django.shortcuts import render
+from django.urls import reverse
 from django.views import View
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
 
+from core import sqlalchemy_engine
+from core.admission import admit
 from core.auth_utils import generate_jwt, jwt_required
 from core.models.parking_spot import ParkingSpot
 from core.models.users import User
 from core.models.user_role import UserRole
-from django.http import FileResponse, HttpResponse
-import pandas as pd
+from core.models.merch_metric import MerchMetric
+from core.http_utils import serve_file
+from core.tasks import create_signup_spot
+from core.merch_cache import merch_cache
+from core.merch_query import downsample_chart, query_page
+from core.merch_metrics import (
+    DEFAULT_CHUNKSIZE, MetricsAccumulator, UploadTooLarge, build_csv_metrics, build_rows,
+    iter_json_products
+)
+from django.http import HttpResponse
 BASE_DIR = settings.BASE_DIR  # ye park-space-hub/ ko point karega
 SRC_DIR = os.path.join(BASE_DIR)
+logger = logging.getLogger(__name__)
 
 
 @method_decorator(csrf_exempt, name='dispatch')
@@ -46,6 +60,7 @@ class UserView(View):
         # } for u in users]
         # return JsonResponse(data, safe=False)
 
+    @method_decorator(admit('auth'))
     def put(self, request, *args, **kwargs):
         # PUT /user → login
         try:
@@ -77,7 +92,6 @@ class UserView(View):
             return JsonResponse({'error': str(e)}, status=500)
 
     def signup(self, request, *args, **kwargs):
-        print("Signup function called")
         # GET or POST /user/signup
         if request.method == 'GET':
             return render(request, 'users/signup.html')
@@ -85,7 +99,6 @@ class UserView(View):
         elif request.method == 'POST':
             try:
                 data = json.loads(request.body)
-                print("Received signup data:", data)
                 role_name = data.pop('role', 'seeker')
                 
                 # Extract location data for providers
@@ -122,8 +135,8 @@ class UserView(View):
                     'name': role_name
                 })
                 
-                parking_spot = None
-                # If provider, create parking spot
+                parking_job = None
+                # If provider, queue the parking spot; it is created by a job worker
                 if role_name == 'provider' and parking_data.get('latitude') and parking_data.get('longitude'):
                     try:
                         # Add owner_id to parking data
@@ -134,15 +147,12 @@ class UserView(View):
                         if not parking_data.get('contact_phone') and hasattr(user, 'phone'):
                             parking_data['contact_phone'] = user.mobile_number
                         
-                        # Create parking spot using your model
-                        parking_spot = ParkingSpot.add(parking_data)
-                        print(f"Created parking spot: {parking_spot.id} for user: {user.id}")
+                        parking_job = create_signup_spot.enqueue({'parking_data': parking_data}, created_by=user.id)
                         
-                    except Exception as parking_error:
-                        print(f"Error creating parking spot: {parking_error}")
-                        print(traceback.format_exc())
+                    except Exception:
                         # Continue with user creation even if parking spot fails
-                        pass
+                        sqlalchemy_engine.session.rollback()
+                        logger.exception('Could not queue the signup parking spot of user %s', user.id)
 
                 response_data = {
                     'message': 'User created successfully',
@@ -152,22 +162,19 @@ class UserView(View):
                     'generated_password': raw_password if raw_password else 'Provided by user'
                 }
                 
-                # Add parking spot data to response if provider and spot was created
-                if role_name == 'provider' and parking_spot:
-                    response_data['parking_spot'] = {
-                        'id': parking_spot.id,
-                        'title': parking_spot.title,
-                        'location': parking_spot.location,
-                        'latitude': parking_spot.latitude,
-                        'longitude': parking_spot.longitude,
-                        'price_per_hour': parking_spot.price_per_hour,
-                        'parking_type': parking_spot.parking_type,
-                        'is_available': parking_spot.is_available,
-                        'max_vehicle_size': parking_spot.max_vehicle_size,
-                        'availability_hours': parking_spot.availability_hours
+                # Poll the job for the parking spot (its result) or why it could not be created
+                if parking_job:
+                    response_data['parking_spot_job'] = {
+                        'id': parking_job.id,
+                        'status': parking_job.status,
+                        'status_url': reverse('job-detail-api', args=[parking_job.id]),
                     }
                 elif role_name == 'provider' and parking_data.get('latitude'):
                     # If parking spot creation failed but we had data
+                    response_data['parking_spot_error'] = (
+                        'Your account was created, but not your parking spot; please add it again'
+                        if parking_data.get('longitude') else 'A parking spot needs both latitude and longitude'
+                    )
                     response_data['location'] = {
                         'latitude': parking_data['latitude'],
                         'longitude': parking_data['longitude'],
@@ -179,142 +186,133 @@ class UserView(View):
 
                 return JsonResponse(response_data)
                 
-            except Exception as e:
-                print(traceback.format_exc())
-                return JsonResponse({'error': str(e)}, status=500)
+            except Exception:
+                logger.exception('Signup failed')
+                return JsonResponse({'error': 'Signup failed'}, status=500)
 
     def home(self, request, *args, **kwargs):
         return render(request, 'home.html')
     
 
 import json
-import pandas as pd
 from django.shortcuts import render
 from django.views.decorators.csrf import csrf_exempt
 
+def _upload_progress_logger(name, total_bytes, step=10):
+    """Progress callback for iter_json_products that logs every `step` percent"""
+    last = {'pct': -step}
+
+    def report(bytes_read):
+        pct = int(bytes_read * 100 / total_bytes) if total_bytes else 100
+        if pct - last['pct'] >= step:
+            last['pct'] = pct
+            logger.info('Processing %s: %s%% (%s/%s bytes)', name, pct, bytes_read, total_bytes)
+    return report
+
+
+def _merch_source_paths(source, default_path):
+    """Files for one CSV source, from the MERCH_CSV_SOURCES glob patterns if configured"""
+    patterns = getattr(settings, 'MERCH_CSV_SOURCES', {}).get(source)
+    if not patterns:
+        return [default_path]
+    paths = sorted({path for pattern in patterns for path in glob.glob(pattern)})
+    return paths or [default_path]
+
+
+def load_merch_metrics(source=None, mode=None, max_workers=None, backend=None):
+    """
+    (rows, chart_data) for the dashboard's stored data: the MerchMetric store
+    when `source` is 'store', otherwise the (cached) CSV sources. The CSV
+    files are spread over `max_workers` of `backend`, by default the
+    in-request MERCH_MAX_WORKERS/MERCH_PARALLEL_BACKEND. Raises ValueError
+    for an unknown source or aggregation mode.
+    """
+    source = source or getattr(settings, 'MERCH_DASHBOARD_SOURCE', 'csv')
+    if source == 'store':
+        # 🔹 Pre-aggregated per-ASIN totals kept up to date by `manage.py merch_ingest`
+        accumulator, product_id_name_dict = MerchMetric.load_accumulator()
+        return build_rows(accumulator.to_frame(), product_id_name_dict)
+    if source != 'csv':
+        raise ValueError(f"Unknown source '{source}'")
+
+    mode = mode or getattr(settings, 'MERCH_AGGREGATION_MODE', 'memory')
+    if mode not in ('memory', 'chunked'):
+        raise ValueError(f"Unknown aggregation mode '{mode}'")
+
+    # Each source may be split over several files (e.g. one per region)
+    sales_paths = _merch_source_paths('sales', os.path.join(SRC_DIR, 'sde2_sales.csv'))
+    reviews_paths = _merch_source_paths('reviews', os.path.join(SRC_DIR, 'sde2_reviews.csv'))
+    returns_paths = _merch_source_paths('returns', os.path.join(SRC_DIR, 'sde2_returns.csv'))
+
+    # Parsed results are cached until one of the CSVs changes on disk
+    return merch_cache.get_or_build(
+        sales_paths + reviews_paths + returns_paths,
+        lambda: build_csv_metrics(
+            sales_paths, reviews_paths, returns_paths,
+            mode=mode,
+            chunksize=getattr(settings, 'MERCH_CSV_CHUNKSIZE', DEFAULT_CHUNKSIZE),
+            max_workers=max_workers or getattr(settings, 'MERCH_MAX_WORKERS', 1),
+            backend=backend or getattr(settings, 'MERCH_PARALLEL_BACKEND', 'thread'),
+        ),
+    )
+
+
 @csrf_exempt
+@admit('dashboard')
 def merch_dashboard(request):
     context = {
         'data': [],
         'chart_data': {},
     }
-
-
-    # File paths for default CSVs
-    sales_path = os.path.join(SRC_DIR, 'sde2_sales.csv')
-    reviews_path = os.path.join(SRC_DIR, 'sde2_reviews.csv')
-    returns_path = os.path.join(SRC_DIR, 'sde2_returns.csv')
-    json_path = os.path.join(SRC_DIR, 'sde2_merchtech_dataset.json')
-    pid = 'asin'
+    max_points = getattr(settings, 'MERCH_CHART_MAX_POINTS', 100)
     product_id_name_dict = {}
 
-    # Helper to build metrics
-    def build_metrics(sales, reviews, returns):
-        # SALES
-        sales_metrics = sales.groupby(pid).agg(
-            total_gmv=('gmv', 'sum'),
-            total_orders=('units_sold', 'sum'),
-            total_refunds=('refunds', 'sum')
-        ).reset_index()
-
-        # REVIEWS
-        reviews['rating'] = pd.to_numeric(reviews['rating'], errors='coerce')
-        reviews_metrics = reviews.groupby(pid).agg(
-            avg_rating=('rating', 'mean'),
-            review_count=('rating', 'count')
-        ).reset_index()
-
-        # RETURNS
-        returns['count'] = pd.to_numeric(returns['count'], errors='coerce').fillna(0)
-        returns_metrics = returns.groupby(pid).agg(
-            returns_count=('count', 'sum')
-        ).reset_index()
-
-        # MERGE
-        df = (
-            sales_metrics.merge(reviews_metrics, on=pid, how='left')
-            .merge(returns_metrics, on=pid, how='left')
-        )
-        df.fillna(0, inplace=True)
-
-        # RETURN RATE
-        df['return_rate'] = df.apply(
-            lambda r: (r['returns_count'] / r['total_orders']) if r['total_orders'] > 0 else 0,
-            axis=1
-        )
-
-        rows = []
-        for _, r in df.iterrows():
-            issues, suggestions = [], []
-
-            if r['total_gmv'] < df['total_gmv'].quantile(0.25):
-                issues.append('Low GMV')
-                suggestions.append('Review pricing & marketing')
-
-            if 0 < r['avg_rating'] < 3.0:
-                issues.append('Low Rating')
-                suggestions.append('Improve quality or descriptions')
-
-            if r['return_rate'] > 0.2:
-                issues.append('High Return Rate')
-                suggestions.append('Check product defects')
-
-            if r['review_count'] < 3 and r['total_gmv'] < df['total_gmv'].median():
-                suggestions.append('Increase review sampling / promos')
-
-            rows.append({
-                'product_id': r[pid],
-                'product_name': product_id_name_dict.get(r[pid], r[pid]),
-                'gmv': round(r['total_gmv'], 2),
-                'avg_rating': round(r['avg_rating'], 2),
-                'return_rate': round(r['return_rate'] * 100, 2),
-                'total_orders': int(r['total_orders']),
-                'issues': ', '.join(issues) or 'No major issues',
-                'suggestions': '; '.join(dict.fromkeys(suggestions)) or 'No action needed',
-            })
-
-        chart_data = {
-            "labels": [r['product_name'] for r in rows],
-            "gmv": [r['gmv'] for r in rows],
-            "rating": [r['avg_rating'] for r in rows],
-            "returns": [r['return_rate'] for r in rows],
-            "total_orders": [r['total_orders'] for r in rows]
-        }
-
-        return rows, chart_data
-
     # 🔹 If user uploaded a JSON
     if request.method == 'POST' and request.FILES.get('json_file'):
         file = request.FILES['json_file']
-        data = json.load(file)
-        products = data['products']
-
-        sales_data, reviews_data, returns_data = [], [], []
-
-        for product in products:
-            asin = product['asin']
-            product_id_name_dict[asin] = product['product']
-            sales_data.extend(product['sales'])
-            reviews_data.extend(product['reviews'])
-            returns_data.extend(product['returns'])
-
-        sales = pd.DataFrame(sales_data)
-        reviews = pd.DataFrame(reviews_data)
-        returns = pd.DataFrame(returns_data)
-
-        rows, chart_data = build_metrics(sales, reviews, returns)
+        max_bytes = getattr(settings, 'MERCH_UPLOAD_MAX_BYTES', None)
+        if max_bytes and file.size > max_bytes:
+            context['error'] = f'Upload is too large ({file.size} bytes, limit {max_bytes})'
+            return render(request, 'users/merch_dashboard.html', context, status=413)
+
+        # Stream products one at a time into running per-ASIN totals
+        accumulator = MetricsAccumulator()
+        progress = _upload_progress_logger(file.name, file.size)
+        try:
+            for product in iter_json_products(file, max_bytes=max_bytes, progress=progress):
+                product_id_name_dict[product['asin']] = product['product']
+                accumulator.add_product(product)
+        except UploadTooLarge as e:
+            context['error'] = str(e)
+            return render(request, 'users/merch_dashboard.html', context, status=413)
+        except (ValueError, KeyError) as e:
+            context['error'] = f'Invalid dataset JSON: {e}'
+            return render(request, 'users/merch_dashboard.html', context, status=400)
+
+        # Uploaded data is not kept server-side, so all rows go into the page
+        rows, _ = build_rows(accumulator.to_frame(), product_id_name_dict)
         context['data'] = rows
-        context['chart_data'] = chart_data
+        context['chart_data'] = downsample_chart(rows, max_points)
 
     else:
-        # 🔹 Load default CSV data (when page loads or no JSON uploaded)
-        sales = pd.read_csv(sales_path)
-        reviews = pd.read_csv(reviews_path)
-        returns = pd.read_csv(returns_path)
-
-        rows, chart_data = build_metrics(sales, reviews, returns)
-        context['data'] = rows
-        context['chart_data'] = chart_data
+        # 🔹 Load default data (when page loads or no JSON uploaded)
+        source = request.GET.get('source')
+        mode = request.GET.get('mode')
+        try:
+            rows, _ = load_merch_metrics(source, mode)
+        except ValueError as e:
+            context['error'] = str(e)
+            return render(request, 'users/merch_dashboard.html', context, status=400)
+
+        # Only the first page is rendered, the table pulls the rest from merch_metrics_api
+        page, total, next_cursor = query_page(
+            rows, sort='product_id', descending=False, limit=getattr(settings, 'MERCH_PAGE_SIZE', 50)
+        )
+        context['data'] = page
+        context['chart_data'] = downsample_chart(rows, max_points)
+        context['total_count'] = total
+        context['next_cursor'] = next_cursor
+        context['api_query'] = request.GET.urlencode()
 
     return render(request, 'users/merch_dashboard.html', context)
 
@@ -323,7 +321,11 @@ def download_json(request):
     json_path = os.path.join(SRC_DIR, 'sde2_merchtech_dataset.json')
     
     if os.path.exists(json_path):
-        return FileResponse(open(json_path, 'rb'), as_attachment=True, filename='sde2_merchtech_dataset.json')
+        # Conditional (304), Range (206) and pre-gzipped responses, see core/http_utils.py
+        return serve_file(
+            request, json_path, 'sde2_merchtech_dataset.json',
+            gzip_cache_dir=getattr(settings, 'DOWNLOAD_CACHE_DIR', None),
+        )
     else:
         return HttpResponse("File not found", status=404)
 